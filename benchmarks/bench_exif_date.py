@@ -0,0 +1,94 @@
+"""
+Micro-benchmark of the capture date reading: exifReader.read_exif_date against exifread.process_file.
+
+Usage:
+    python benchmarks/bench_exif_date.py [--folder FOLDER] [--repeat N]
+
+Without --folder, a synthetic JPEG with a large MakerNote is generated in a temporary folder.
+"""
+
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exifread
+from exifReader import read_exif_date
+
+
+def build_synthetic_jpeg(path, maker_note_size=60000):
+    """
+    Write a minimal JPEG whose APP1 segment holds IFD0, an Exif IFD with DateTimeOriginal and a MakerNote.
+    """
+    date = b'2023:05:01 10:00:00\x00'
+    # TIFF header + IFD0 with a single entry: the Exif IFD pointer
+    ifd0_offset = 8
+    exif_ifd_offset = ifd0_offset + 2 + 12 + 4
+    date_offset = exif_ifd_offset + 2 + 2 * 12 + 4
+    maker_note_offset = date_offset + len(date)
+    tiff = b'II*\x00' + struct.pack('<I', ifd0_offset)
+    tiff += struct.pack('<H', 1) + struct.pack('<HHII', 0x8769, 4, 1, exif_ifd_offset) + struct.pack('<I', 0)
+    tiff += struct.pack('<H', 2)
+    tiff += struct.pack('<HHII', 0x9003, 2, len(date), date_offset)
+    tiff += struct.pack('<HHII', 0x927C, 7, maker_note_size, maker_note_offset)
+    tiff += struct.pack('<I', 0)
+    tiff += date + os.urandom(maker_note_size)
+    app1 = b'Exif\x00\x00' + tiff
+    with open(path, 'wb') as f:
+        f.write(b'\xff\xd8')
+        f.write(b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1)
+        f.write(b'\xff\xda' + struct.pack('>H', 2) + os.urandom(1000) + b'\xff\xd9')
+
+
+def exifread_date(image_path):
+    with open(image_path, 'rb') as f:
+        tags = exifread.process_file(f)
+        date_taken = tags.get('EXIF DateTimeOriginal')
+        if date_taken:
+            return date_taken.values
+    return None
+
+
+def time_reader(reader, files, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in files:
+            reader(path)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark capture date readers")
+    parser.add_argument('--folder', help="Folder of JPG/PNG files to read")
+    parser.add_argument('--repeat', type=int, default=20, help="Number of passes over the files")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if args.folder:
+            files = [os.path.join(args.folder, name) for name in os.listdir(args.folder)
+                     if os.path.splitext(name)[1].lower() in ['.jpg', '.jpeg', '.png']]
+        else:
+            files = [os.path.join(temp_dir, f"IMG_{i:04d}.jpg") for i in range(50)]
+            for path in files:
+                build_synthetic_jpeg(path)
+
+        if len(files) == 0:
+            print("No image files found")
+            return
+
+        mismatches = [path for path in files if read_exif_date(path) != exifread_date(path)]
+        fast_time = time_reader(read_exif_date, files, args.repeat)
+        exifread_time = time_reader(exifread_date, files, args.repeat)
+        num_reads = len(files) * args.repeat
+        print(f"Files: {len(files)}, reads: {num_reads}, mismatches: {len(mismatches)}")
+        print(f"exifReader.read_exif_date: {fast_time * 1e6 / num_reads:8.1f} us/file")
+        print(f"exifread.process_file:     {exifread_time * 1e6 / num_reads:8.1f} us/file")
+        print(f"Speed-up: x{exifread_time / fast_time:.1f}")
+
+
+if __name__ == '__main__':
+    main()
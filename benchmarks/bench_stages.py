@@ -0,0 +1,158 @@
+"""
+Benchmark of the processing stages on synthetic corpora.
+
+For each corpus size and worker count, a fresh copy of the corpus is processed stage by stage:
+convert_heic_to_jpg (convert_heic_to_jpg_subfolders), process_photos, convert_all_mov_to_mp4,
+sort_all_other_files, and the import ledger is loaded. The timings are saved as JSON, and can be
+compared with the results of another version of the project.
+
+Usage:
+    python benchmarks/bench_stages.py [--sizes 50,200] [--workers 1,4] [--output results.json]
+                                      [--compare previous.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import generate_corpus
+from infoBoxMgmt import set_console_output
+import convertAndSort
+import mov_to_mp4
+from importLedger import open_import_ledger
+
+RESULTS_VERSION = 1
+# Paths recorded in the import ledger, per file of the corpus
+LEDGER_ENTRIES_PER_FILE = 20
+
+
+def get_corpus_counts(size):
+    # Proportions of a typical phone: mostly HEIC, some JPG/PNG, a few videos and sidecar files
+    return {'num_heic': size * 6 // 10, 'num_jpg': size * 2 // 10, 'num_png': size // 20,
+            'num_mov': max(1, size // 50), 'num_other': size // 10}
+
+
+def get_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_ledger(metadata_folder, num_entries):
+    os.makedirs(metadata_folder, exist_ok=True)
+    paths = [f"202301__\\IMG_{index:06d}.HEIC" for index in range(num_entries)]
+    with open(os.path.join(metadata_folder, "imported_2023-01-01_000000.txt"), 'w') as f:
+        f.write("\n".join(paths))
+    # First load migrates the text list, the next ones only open the database
+    migrate_s = timed(lambda: open_import_ledger(metadata_folder).close())
+    start = time.perf_counter()
+    with open_import_ledger(metadata_folder) as ledger:
+        found = sum(1 for path in paths if path in ledger)
+    load_s = time.perf_counter() - start
+    assert found == len(paths)
+    return migrate_s, load_s
+
+
+def bench_stages(template_folder, work_folder, num_files, workers):
+    """
+    Process a copy of the corpus and time each stage.
+
+    Returns:
+    list: One result per stage.
+    """
+    import_folder = os.path.join(work_folder, '.import')
+    output_folder = os.path.join(work_folder, 'output')
+    shutil.copytree(template_folder, import_folder)
+    timings = [
+        ('convert_heic_to_jpg', timed(convertAndSort.convert_heic_to_jpg_subfolders, import_folder, 50, workers)),
+        ('process_photos', timed(convertAndSort.process_photos, import_folder, output_folder)),
+        ('convert_all_mov_to_mp4', timed(mov_to_mp4.convert_all_mov_to_mp4, import_folder, output_folder, 8,
+                                         max_jobs=workers, video_mode='auto')),
+        ('sort_all_other_files', timed(convertAndSort.sort_all_other_files, import_folder,
+                                       os.path.join(output_folder, 'OtherFiles'))),
+    ]
+    migrate_s, load_s = bench_ledger(os.path.join(import_folder, '.metadata'), num_files * LEDGER_ENTRIES_PER_FILE)
+    timings.append(('ledger_migrate', migrate_s))
+    timings.append(('ledger_load', load_s))
+    return [{'stage': stage, 'files': num_files, 'workers': workers, 'seconds': round(seconds, 4),
+             'files_per_s': round(num_files / seconds, 1) if seconds > 0 else None}
+            for stage, seconds in timings]
+
+
+def compare(results, previous_path):
+    with open(previous_path, 'r') as f:
+        previous = {(result['stage'], result['files'], result['workers']): result['seconds']
+                    for result in json.load(f)['results']}
+    print(f"\nCompared with {previous_path} (ratio > 1 is slower):")
+    for result in results:
+        key = (result['stage'], result['files'], result['workers'])
+        if key in previous and previous[key] > 0:
+            print(f"  {result['stage']:24} files={result['files']:<6} workers={result['workers']:<3} "
+                  f"x{result['seconds'] / previous[key]:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the processing stages on synthetic corpora")
+    parser.add_argument('--sizes', default="50,200", help="Comma separated corpus sizes (default: 50,200)")
+    parser.add_argument('--workers', default=f"1,{os.cpu_count() or 1}",
+                        help="Comma separated worker counts (default: 1 and the number of cores)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the corpus generator")
+    parser.add_argument('--output', default=None, help="JSON results file (default: bench_stages_<time>.json)")
+    parser.add_argument('--compare', default=None, help="Previous JSON results file to compare with")
+    args = parser.parse_args()
+    # Stage messages would hide the results
+    set_console_output(open(os.devnull, 'w'))
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    worker_counts = [int(workers) for workers in args.workers.split(',')]
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            template_folder = os.path.join(temp_dir, f"corpus_{size}")
+            counts = generate_corpus(template_folder, seed=args.seed, **get_corpus_counts(size))
+            num_files = sum(counts.values())
+            print(f"Corpus of {num_files} files: {counts}")
+            for workers in worker_counts:
+                work_folder = os.path.join(temp_dir, f"run_{size}_{workers}")
+                for result in bench_stages(template_folder, work_folder, num_files, workers):
+                    print(f"  {result['stage']:24} workers={workers:<3} {result['seconds']:8.3f} s "
+                          f"{result['files_per_s'] or 0:8.1f} files/s")
+                    results.append(result)
+                shutil.rmtree(work_folder)
+
+    output = args.output or f"bench_stages_{datetime.now().strftime('%Y-%m-%d_%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump({
+            'version': RESULTS_VERSION,
+            'project_version': get_version(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+            'results': results,
+        }, f, indent=2)
+    print(f"Results saved to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Synthetic media corpus, laid out like an iPhone import folder.
+
+The files are spread in month folders named like the DCIM folders of the phone (202301__, 202301_a...):
+- HEIC photos with an EXIF capture date (pillow_heif),
+- JPEG and PNG photos, half of them with an EXIF capture date,
+- short MOV videos with a creation time (ffmpeg lavfi test sources), skipped when ffmpeg is missing,
+- AAE sidecar files, as written by the phone for edited photos.
+The same seed always gives the same files.
+
+Usage:
+    python benchmarks/corpus.py FOLDER [--heic N] [--jpg N] [--png N] [--mov N] [--other N] [--seed N]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+from datetime import datetime, timedelta
+
+# Tag numbers of the EXIF capture date
+EXIF_IFD_POINTER = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+
+FIRST_DATE = datetime(2022, 1, 1)
+DEFAULT_IMAGE_SIZE = (1024, 768)
+
+
+def get_month_folder(date, index):
+    # Like the phone, which splits a month in several folders: 202301__, 202301_a, 202301_b...
+    return date.strftime("%Y%m") + ("__" if index % 3 == 0 else "_" + "abc"[index % 3])
+
+
+def build_exif(date):
+    from PIL import Image
+    exif = Image.Exif()
+    exif.get_ifd(EXIF_IFD_POINTER)[DATE_TIME_ORIGINAL] = date.strftime("%Y:%m:%d %H:%M:%S")
+    return exif.tobytes()
+
+
+def build_image(rng, size):
+    # Gradient with noise: compresses like a photo, not like a flat color.
+    # The noise comes from the seeded generator, so that the corpus is reproducible
+    from PIL import Image
+    base = Image.linear_gradient('L').resize(size)
+    noise = Image.frombytes('L', size, rng.randbytes(size[0] * size[1]))
+    red = Image.blend(base, noise, 0.5)
+    green = base.rotate(rng.randint(0, 359))
+    return Image.merge('RGB', (red, green, noise))
+
+
+def generate_video(path, date, duration_s=2):
+    command = ['ffmpeg', '-v', 'error', '-y',
+               '-f', 'lavfi', '-i', f'testsrc=duration={duration_s}:size=640x360:rate=30',
+               '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration_s}',
+               '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-c:a', 'aac',
+               '-metadata', f"creation_time={date.strftime('%Y-%m-%dT%H:%M:%S')}.000000Z", path]
+    subprocess.run(command, check=True, stdin=subprocess.DEVNULL)
+
+
+def generate_corpus(folder, num_heic=20, num_jpg=20, num_png=5, num_mov=2, num_other=5, seed=0,
+                    image_size=DEFAULT_IMAGE_SIZE):
+    """
+    Write a synthetic corpus in folder.
+
+    Returns:
+    dict: Number of files written per kind.
+    """
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    rng = random.Random(seed)
+    counts = {'heic': 0, 'jpg': 0, 'png': 0, 'mov': 0, 'other': 0}
+    kinds = (['heic'] * num_heic + ['jpg'] * num_jpg + ['png'] * num_png + ['mov'] * num_mov
+             + ['other'] * num_other)
+    rng.shuffle(kinds)
+    if num_mov > 0 and shutil.which('ffmpeg') is None:
+        print("ffmpeg not found: no videos generated")
+        kinds = [kind for kind in kinds if kind != 'mov']
+
+    date = FIRST_DATE
+    for index, kind in enumerate(kinds):
+        date += timedelta(minutes=rng.randint(1, 3000))
+        month_folder = os.path.join(folder, get_month_folder(date, index))
+        os.makedirs(month_folder, exist_ok=True)
+        base_path = os.path.join(month_folder, f"IMG_{index:04d}")
+        if kind == 'heic':
+            build_image(rng, image_size).save(base_path + ".HEIC", "HEIF", quality=80, exif=build_exif(date))
+        elif kind == 'jpg':
+            # Every other photo has no EXIF data, like the screenshots and pictures saved from apps
+            exif = build_exif(date) if index % 2 == 0 else b''
+            build_image(rng, image_size).save(base_path + ".JPG", "JPEG", quality=85, exif=exif)
+        elif kind == 'png':
+            exif = build_exif(date) if index % 2 == 0 else b''
+            build_image(rng, image_size).save(base_path + ".PNG", "PNG", exif=exif)
+        elif kind == 'mov':
+            generate_video(base_path + ".MOV", date)
+        else:
+            with open(base_path + ".AAE", 'w') as f:
+                f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<plist version="1.0"><dict>'
+                        f'<key>adjustmentTimestamp</key><date>{date.isoformat()}Z</date></dict></plist>\n')
+        counts[kind] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic iPhone media corpus")
+    parser.add_argument('folder', help="Folder receiving the corpus")
+    parser.add_argument('--heic', type=int, default=20)
+    parser.add_argument('--jpg', type=int, default=20)
+    parser.add_argument('--png', type=int, default=5)
+    parser.add_argument('--mov', type=int, default=2)
+    parser.add_argument('--other', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    counts = generate_corpus(args.folder, args.heic, args.jpg, args.png, args.mov, args.other, args.seed)
+    print(f"Generated in {args.folder}: {counts}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,97 +3,94 @@ From https://github.com/dragonGR/PyHEIC2JPG
 """
 
 import os
+import errno
 import shutil
-import exifread
+import signal
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from PIL import Image, UnidentifiedImageError
-from pillow_heif import register_heif_opener
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from infoBoxMgmt import print_message, print_message_d
-
-fail_list = []
+from exifReader import read_exif_date, parse_exif_date
+from progress import ProgressTracker
+from nameIndex import DestinationNameIndex
+from dedup import POLICY_SKIP, POLICY_LINK
+from runJournal import OPERATION_HEIC, OPERATION_MOVE, STATE_RENAMING
+from scanCache import FIELD_CAPTURE_DATE
+import instrumentation
+from instrumentation import measure, take_records, merge_records
+from memoryBudget import MemoryBudget, estimate_decode_memory
+from treeScanner import scan_tree, new_partial_name, KIND_HEIC, KIND_PHOTO, KIND_VIDEO, KIND_OTHER, KIND_PARTIAL
 
 """
     This file converts HEIC to JPG from input folder,
     then renames and sorts all photos by Year in output folder
 """
 
-def is_directory_empty(directory):
-    """
-    Check if a directory is empty.
-
-    Args:
-    directory (str): Path to the directory.
-
-    Returns:
-    bool: True if the directory is empty, False otherwise.
-    """
-    return not os.listdir(directory)
-
-def delete_empty_directories(root_directory):
+def delete_empty_directories(root_directory, directories=None):
     """
     Delete all empty directories within the specified root directory.
+    Each directory is simply removed: rmdir fails on the ones which are not empty, without listing them.
 
     Args:
     root_directory (str): Path to the root directory.
+    directories (list): Directories of the tree, deepest first, as listed by the tree scanner.
+                        The tree is walked when it is not given.
     """
-    for root, dirs, _ in os.walk(root_directory, topdown=False):
+    if directories is None:
+        directories = [os.path.join(root, directory)
+                       for root, dirs, _ in os.walk(root_directory, topdown=False) for directory in dirs]
+    for full_path in directories:
         try:
-            for directory in dirs:
-                full_path = os.path.join(root, directory)
-                if is_directory_empty(full_path):
-                    print_message_d(f"Deleting empty directory: {full_path}")
-                    os.rmdir(full_path)
-        except Exception as e:
+            os.rmdir(full_path)
+            print_message_d(f"Deleted empty directory: {full_path}")
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            if e.errno in (errno.ENOTEMPTY, errno.EEXIST):
+                continue
             print_message(f"Error deleting directory {full_path}: {e}")
             return 'STATUS_ERROR'
     return 'STATUS_SUCCESS'
 
 
-def move_file_with_unique_name(file_path, destination_directory):
+def move_file_with_unique_name(file_path, destination_directory, name_index=None, journal=None, filename=None):
     """
     Move a file to a destination directory with a unique name.
 
     Args:
     file_path (str): Path of the file to be moved.
     destination_directory (str): Destination directory.
+    name_index (DestinationNameIndex): Names already used in the destination, shared by the run.
+    journal (RunJournal): Records the move, which copies the file when it changes of drive.
+    filename (str): Name in the destination directory, the name of the file by default.
     """
-    base_name, extension = os.path.splitext(os.path.basename(file_path))
-    new_file_path = os.path.join(destination_directory, base_name + extension)
-
-    # Check if the file already exists in the destination directory
-    counter = 1
-    while os.path.exists(new_file_path):
-        new_file_path = os.path.join(destination_directory, f"{base_name}_{counter}{extension}")
-        counter += 1
+    if name_index is None:
+        name_index = DestinationNameIndex()
+    if filename is None:
+        filename = os.path.basename(file_path)
+    # Same content already in the destination directory
+    duplicate_path = name_index.place_if_duplicate(file_path, destination_directory, filename)
+    if duplicate_path is not None:
+        print_message_d(f"{file_path} is identical to {duplicate_path}")
+        return duplicate_path
+
+    # Reserve a name not used in the destination directory
+    new_file_path = name_index.reserve(destination_directory, filename)
+    operation_id = journal.begin(OPERATION_MOVE, file_path, new_file_path) if journal is not None else None
 
     # Move the file to the new unique path
-    shutil.move(file_path, new_file_path)
-
-def move_files_and_delete_empty_dirs(main_directory):
-    """
-    Move all files to the main directory and delete empty directories.
-
-    Args:
-    main_directory (str): Main directory.
-    """
-    for root, dirs, files in os.walk(main_directory, topdown=False):
-        # Skip the main directory itself
-        if root != main_directory:
-            for name in files:
-                # Construct the full file path
-                file_path = os.path.join(root, name)
-                # Move the file to the main directory
-                move_file_with_unique_name(file_path, main_directory)
-
-        for name in dirs:
-            # Construct the full directory path
-            dir_path = os.path.join(root, name)
-            # Delete the directory if it is empty
-            try:
-                os.rmdir(dir_path)
-            except OSError as e:
-                print_message(f"Error deleting directory {dir_path}: {e}")
+    try:
+        with measure('move'):
+            shutil.move(file_path, new_file_path)
+    except BaseException:
+        # Left in the journal: a partial copy is deleted by the next run
+        name_index.release(new_file_path)
+        raise
+    name_index.commit(new_file_path)
+    if journal is not None:
+        journal.finish(operation_id)
+    return new_file_path
 
 def get_exif_date(image_path):
     """
@@ -105,20 +102,91 @@ def get_exif_date(image_path):
     Returns:
     str: Capture date in the format 'YYYY:MM:DD HH:MM:SS'.
     """
-    with open(image_path, 'rb') as f:
-        tags = exifread.process_file(f)
-        date_taken = tags.get('EXIF DateTimeOriginal')
-        if date_taken:
-            return date_taken.values
-    return None
+    with measure('exif_read'):
+        try:
+            return read_exif_date(image_path)
+        except ValueError as e:
+            # Malformed or unusual file: let exifread try harder
+            print_message_d(f"Fast EXIF reader failed on {image_path} ({e}), using exifread")
+        import exifread
+        with open(image_path, 'rb') as f:
+            tags = exifread.process_file(f)
+            date_taken = tags.get('EXIF DateTimeOriginal')
+            if date_taken:
+                return date_taken.values
+        return None
+
+def get_dated_path(destination_folder, date_taken, file_ext):
+    """
+    Build the sorted path of a photo from its capture date: <destination>/<year>/<YYYY-MM-DD_HH-MM-SS><ext>.
+
+    Args:
+    destination_folder (str): Destination folder for the processed photos.
+    date_taken (str): Capture date in the format 'YYYY:MM:DD HH:MM:SS'.
+    file_ext (str): Extension of the file, with the dot.
+
+    Returns:
+    tuple: Year folder and file name.
+    """
+    year = date_taken[:4]
+    new_filename = f"{date_taken.replace(':', '-').replace(' ', '_')}{file_ext}"
+    return os.path.join(destination_folder, year), new_filename
+
+def sort_photo(current_path, destination_folder, name_index=None, scan_cache=None):
+    """
+    Move and rename a photo based on its capture date.
+
+    Args:
+    current_path (str): Path of the photo.
+    destination_folder (str): Destination folder for the processed photos.
+    name_index (DestinationNameIndex): Names already used in the destination, shared by the run.
+    scan_cache (ScanCache): Capture dates of the files already read by a previous run.
 
-def process_photos(source_folder, destination_folder):
+    Returns:
+    str: New path of the photo, None if it has no capture date and was left in place.
+    """
+    if scan_cache is None:
+        date_taken = get_exif_date(current_path)
+    else:
+        date_taken = scan_cache.lookup(current_path, FIELD_CAPTURE_DATE, get_exif_date)
+    if not date_taken:
+        return None
+    file_ext = os.path.splitext(current_path)[1].lower()
+    year_folder, new_filename = get_dated_path(destination_folder, date_taken, file_ext)
+    os.makedirs(year_folder, exist_ok=True)
+    if name_index is None:
+        name_index = DestinationNameIndex()
+    duplicate_path = name_index.place_if_duplicate(current_path, year_folder, new_filename)
+    if duplicate_path is not None:
+        print_message_d(f"{current_path} is identical to {duplicate_path}")
+        return duplicate_path
+    new_path = name_index.reserve(year_folder, new_filename)
+    try:
+        with measure('rename'):
+            os.rename(current_path, new_path)
+    except BaseException:
+        name_index.release(new_path)
+        raise
+    name_index.commit(new_path)
+    return new_path
+
+def print_duplicate_counts(name_index):
+    counts = name_index.get_duplicate_counts()
+    if counts[POLICY_SKIP] > 0:
+        print_message(f"{counts[POLICY_SKIP]} files already in the destination were skipped.")
+    if counts[POLICY_LINK] > 0:
+        print_message(f"{counts[POLICY_LINK]} files already in the destination were replaced by hard links.")
+
+def process_photos(source_folder, destination_folder, duplicate_policy=POLICY_SKIP, manifest=None, keep_heic=False):
     """
     Process photos by moving and renaming them based on the capture date.
 
     Args:
     source_folder (str): Source folder containing the photos.
     destination_folder (str): Destination folder for the processed photos.
+    duplicate_policy (str): 'skip', 'link' or 'keep' photos identical to a photo of the destination.
+    manifest (Manifest): Scan of source_folder shared by the stages, scanned here if not given.
+    keep_heic (bool): Also sort the HEIC files as they are, their capture date being read without decoding them.
     """
     try:
         if not os.path.exists(destination_folder):
@@ -128,46 +196,77 @@ def process_photos(source_folder, destination_folder):
         return 'STATUS_ERROR'
 
     num_moved = 0
-    for root, _, files in os.walk(source_folder):
-        # Get all image files in the specified directory
-        jpg_files = [file for file in files if os.path.splitext(file)[1].lower() in ['.jpg', '.jpeg', '.png']]
-        total_files = len(jpg_files)
-        print_message_d(f'Number of image files in {root}: {total_files}')
-        if total_files > 0:
-            for filename in files:
-                file_ext = os.path.splitext(filename)[1].lower()
-                if file_ext in ['.jpg', '.jpeg', '.png']:
-                    current_path = os.path.join(root, filename)
-                    try:
-                        date_taken = get_exif_date(current_path)
-                        if date_taken:
-                            year = date_taken[:4]
-                            new_filename = f"{date_taken.replace(':', '-').replace(' ', '_')}{file_ext}"
-
-                            year_folder = os.path.join(destination_folder, year)
-                            if not os.path.exists(year_folder):
-                                os.makedirs(year_folder)
-
-                            new_path = os.path.join(year_folder, new_filename)
-                            base_name, extension = os.path.splitext(os.path.basename(new_path))
-                            # Check if the file already exists in the destination directory
-                            counter = 1
-                            while os.path.exists(new_path):
-                                new_path = os.path.join(year_folder, f"{base_name}_{counter}{file_ext}")
-                                counter += 1
-                            os.rename(current_path, new_path)
-                            # Display progress
-                            num_moved += 1
-                            # progress = int((num_moved / total_files) * 100)
-                            # print_message_d(f"Rename and move progress: {progress}%", end="\r")
-                    except Exception as e:
-                        print_message(f"Error processing {current_path}: {e}")
-                        return 'STATUS_ERROR'
+    tracker = ProgressTracker('photo')
+    name_index = DestinationNameIndex(duplicate_policy)
+    if manifest is None:
+        manifest = scan_tree(source_folder)
+    jpg_files = manifest.get_files(KIND_PHOTO, KIND_HEIC) if keep_heic else manifest.get_files(KIND_PHOTO)
+    print_message_d(f'Number of image files in {source_folder}: {len(jpg_files)}')
+    tracker.plan(len(jpg_files))
+    for current_path in jpg_files:
+        try:
+            if sort_photo(current_path, destination_folder, name_index):
+                num_moved += 1
+            # Display progress
+            tracker.advance()
+        except Exception as e:
+            print_message(f"Error processing {current_path}: {e}")
+            tracker.advance(False)
+            tracker.finish()
+            return 'STATUS_ERROR'
+    tracker.finish()
     
     print_message(f"\nRename and move completed successfully. {num_moved} files.")
+    print_duplicate_counts(name_index)
     return 'STATUS_SUCCESS'
 
-def convert_single_file(heic_path, jpg_path, output_quality):
+@dataclass
+class ConversionResult:
+    source: str
+    destination: str
+    success: bool
+    error: str = None
+    # True when the JPG was written directly to its year folder
+    placed: bool = False
+    # Wanted name in the year folder, while the JPG still has its temporary name
+    placed_name: str = None
+    bytes_read: int = 0
+    bytes_written: int = 0
+    # Operation timings of the worker process, when profiling is enabled
+    timings: dict = None
+
+    def with_timings(self):
+        self.timings = take_records()
+        return self
+
+
+def init_heic_worker():
+    """
+    Initialize a conversion worker process: clear the timing records inherited from the parent process,
+    ignore Ctrl-C and register the HEIF file format with Pillow.
+    Pillow and pillow_heif are only imported by the processes which convert files.
+    """
+    instrumentation.init_worker()
+    # Ctrl-C is handled by the parent process, which cancels the conversions not started yet
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+
+def get_worker_count(max_workers=None):
+    """
+    Resolve the number of conversion worker processes.
+
+    Args:
+    max_workers (int): Requested number of workers, None to size the pool to the machine.
+
+    Returns:
+    int: Number of worker processes to start.
+    """
+    if max_workers is None or max_workers < 1:
+        return os.cpu_count() or 1
+    return max_workers
+
+def convert_single_file(heic_path, jpg_path, output_quality, temp_name=None):
     """
     Convert a single HEIC file to JPG format.
 
@@ -175,117 +274,385 @@ def convert_single_file(heic_path, jpg_path, output_quality):
     heic_path (str): Path to the HEIC file.
     jpg_path (str): Path to save the converted JPG file.
     output_quality (int): Quality of the output JPG image.
+    temp_name (str): Temporary name of the JPG in its folder, recorded in the run journal.
 
     Returns:
-    tuple: Path to the HEIC file and conversion status.
+    ConversionResult: Paths of the files and conversion status.
     """
+    from PIL import Image, UnidentifiedImageError
     try:
         with Image.open(heic_path) as image:
             # Automatically handle and preserve EXIF metadata
             exif_data = image.info.get("exif")
-            image.save(jpg_path, "JPEG", quality=output_quality, exif=exif_data)
+            os.makedirs(os.path.dirname(jpg_path), exist_ok=True)
+            # Written to a temporary name first: an interrupted conversion never leaves a truncated JPG
+            temp_path = os.path.join(os.path.dirname(jpg_path), temp_name or new_partial_name())
+            with measure('decode'):
+                image.load()
+            try:
+                with measure('encode'):
+                    image.save(temp_path, "JPEG", quality=output_quality, exif=exif_data)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
             # Preserve the original access and modification timestamps
             heic_stat = os.stat(heic_path)
-            os.utime(jpg_path, (heic_stat.st_atime, heic_stat.st_mtime))
+            os.utime(temp_path, (heic_stat.st_atime, heic_stat.st_mtime))
+            os.replace(temp_path, jpg_path)
             os.remove(heic_path)
-            return heic_path, True  # Successful conversion
+            return ConversionResult(heic_path, jpg_path, True, bytes_read=heic_stat.st_size,
+                                    bytes_written=os.path.getsize(jpg_path)).with_timings()  # Successful conversion
     except (UnidentifiedImageError, FileNotFoundError, OSError) as e:
         logging.error("Error converting '%s': %s", heic_path, e)
-        return heic_path, False  # Failed conversion
+        return ConversionResult(heic_path, jpg_path, False, str(e)).with_timings()  # Failed conversion
 
-def convert_heic_to_jpg(heic_dir, output_quality=50, max_workers=4):
+def convert_and_place_file(heic_path, jpg_path, output_quality, destination_folder, temp_name=None):
     """
-    Convert HEIC images in a directory to JPG format using parallel processing.
+    Convert a single HEIC file to JPG format, writing it directly to its dated year folder.
+    The capture date is taken from the EXIF data already decoded with the image.
+    Files without capture date are converted to jpg_path, to be sorted later.
 
-    Args:
-    heic_dir (str): Path to the directory containing HEIC files.
-    output_quality (int): Quality of the output JPG images (1-100).
-    max_workers (int): Number of parallel threads.
-    """
-    # Register the HEIF file format with Pillow
-    register_heif_opener()
+    The JPG is written with a temporary name: the worker processes do not share the name index,
+    the caller gives its final name, and deletes the HEIC file, with place_converted_file.
 
-    if not os.path.isdir(heic_dir):
-        print_message("Directory '%s' does not exist.", heic_dir)
-        return 'STATUS_NO_DIR'
+    Args:
+    heic_path (str): Path to the HEIC file.
+    jpg_path (str): Path to save the converted JPG file when it has no capture date.
+    output_quality (int): Quality of the output JPG image.
+    destination_folder (str): Destination folder for the sorted photos.
+    temp_name (str): Temporary name of the JPG in its year folder, recorded in the run journal.
 
-    # Create a directory to store the converted JPG files
-    jpg_dir = os.path.join(heic_dir, ".ConvertedFiles")
+    Returns:
+    ConversionResult: Paths of the files and conversion status.
+    """
+    from PIL import Image, UnidentifiedImageError
     try:
-        if os.path.exists(jpg_dir):
-            shutil.rmtree(jpg_dir)
-        os.makedirs(jpg_dir, exist_ok=True)
-    except Exception as e:
-        print_message(f"Error creating or deleting directory {jpg_dir}: {e}")
-        return 'STATUS_ERROR'
+        with Image.open(heic_path) as image:
+            exif_data = image.info.get("exif")
+            try:
+                with measure('exif_read'):
+                    date_taken = parse_exif_date(exif_data)
+            except ValueError:
+                date_taken = None
+            if not date_taken:
+                return convert_single_file(heic_path, jpg_path, output_quality)
+
+            year_folder, new_filename = get_dated_path(destination_folder, date_taken, ".jpg")
+            os.makedirs(year_folder, exist_ok=True)
+            temp_path = os.path.join(year_folder, temp_name or new_partial_name())
+            with measure('decode'):
+                image.load()
+            try:
+                with open(temp_path, 'xb') as jpg_file, measure('encode'):
+                    image.save(jpg_file, "JPEG", quality=output_quality, exif=exif_data)
+                    jpg_size = jpg_file.tell()
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            # Preserve the original access and modification timestamps
+            heic_stat = os.stat(heic_path)
+            os.utime(temp_path, (heic_stat.st_atime, heic_stat.st_mtime))
+            return ConversionResult(heic_path, temp_path, True, placed=True, placed_name=new_filename,
+                                    bytes_read=heic_stat.st_size, bytes_written=jpg_size).with_timings()
+    except (UnidentifiedImageError, FileNotFoundError, OSError) as e:
+        logging.error("Error converting '%s': %s", heic_path, e)
+        return ConversionResult(heic_path, jpg_path, False, str(e)).with_timings()
 
-    # Get all HEIC files in the specified directory and sub directories
-    heic_files = [file for file in os.listdir(heic_dir) if file.lower().endswith(".heic")]
-    total_files = len(heic_files)
+def place_converted_file(result, name_index, journal=None, operation_id=None):
+    """
+    Give its final, unique, name to a JPG written by convert_and_place_file, then delete its HEIC file.
 
-    if total_files == 0:
-        print_message_d("No HEIC files found in the directory.")
-        return 'STATUS_SUCCESS'
-    else:
-        print_message_d(f"Number of files to convert: {total_files}")
+    Args:
+    result (ConversionResult): Result of convert_and_place_file, updated with the final path.
+    name_index (DestinationNameIndex): Names already used in the destination, shared by the run.
+    journal (RunJournal): Journal of the run, operation_id being the conversion recorded in it.
+    """
+    if not (result.success and result.placed and result.placed_name):
+        # Failed (the HEIC file is still there) or converted without date (the HEIC file is deleted)
+        if journal is not None:
+            journal.finish(operation_id)
+        return result
+    temp_path = result.destination
+    year_folder = os.path.dirname(temp_path)
+    try:
+        # Same photo converted by a previous run
+        new_path = name_index.place_if_duplicate(temp_path, year_folder, result.placed_name)
+    except OSError as e:
+        logging.error("Error comparing '%s' with the files of %s: %s", temp_path, year_folder, e)
+        new_path = None
+    if new_path is None:
+        new_path = name_index.reserve(year_folder, result.placed_name)
+        if journal is not None:
+            journal.update(operation_id, STATE_RENAMING, temp=temp_path, destination=new_path)
+        try:
+            with measure('rename'):
+                os.rename(temp_path, new_path)
+        except OSError as e:
+            name_index.release(new_path)
+            logging.error("Error renaming '%s' to '%s': %s", temp_path, new_path, e)
+            result.success = False
+            result.error = str(e)
+            return result
+        name_index.commit(new_path)
+    result.destination = new_path
+    result.placed_name = None
+    try:
+        os.remove(result.source)
+    except OSError as e:
+        logging.error("Error deleting '%s': %s", result.source, e)
+    if journal is not None:
+        journal.finish(operation_id)
+    return result
+
+class HeicConversionPool:
+    """
+    Runs HEIC conversions in a process pool. Each conversion is submitted when its decoded image fits
+    in the memory budget with the conversions in flight.
+    """
+    def __init__(self, max_workers=None, memory_budget=None, max_in_flight=None):
+        self.workers = get_worker_count(max_workers)
+        self.memory_budget = memory_budget if memory_budget is not None else MemoryBudget()
+        # Limits the files read ahead of the workers, and the results waiting to be finished
+        self.in_flight = threading.BoundedSemaphore(max_in_flight or 2 * self.workers)
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def run(self, tasks, start, finish):
+        """
+        Convert the files of tasks. Returns once every conversion has ended, or was cancelled.
+
+        Args:
+        tasks (iterable): (heic_path, data) tuples, read as the conversions are submitted: a generator can
+                          wait for the next file.
+        start (function): start(heic_path, data) prepares a conversion and returns the worker function, its
+                          arguments and a context given back to finish.
+        finish (function): finish(heic_path, data, context, result) is called with the ConversionResult of each
+                           conversion, failed if it could not be submitted or was cancelled, context being None
+                           if start failed. Called from the thread collecting the results.
+        """
+        # Each worker process registers the HEIF file format with Pillow
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_heic_worker) as executor:
+            with self.lock:
+                self.executor = executor
+            try:
+                self.submit_all(executor, tasks, start, finish)
+            except BaseException:
+                # Ctrl-C or error of the caller: only the running conversions are waited for
+                self.cancel()
+                raise
+            finally:
+                with self.lock:
+                    self.executor = None
+        if self.memory_budget.budget_bytes is not None:
+            print_message_d(f"HEIC conversions peak memory estimate: {self.memory_budget.peak_bytes // 2**20} MB "
+                            f"of {self.memory_budget.budget_bytes // 2**20} MB")
+
+    def submit_all(self, executor, tasks, start, finish):
+        for heic_path, data in tasks:
+            # Cancelled: the next tasks are still read, so that their producer is never blocked
+            if self.stopped.is_set():
+                continue
+            self.in_flight.acquire()
+            if self.stopped.is_set():
+                self.in_flight.release()
+                continue
+            cost = estimate_decode_memory(heic_path)
+            self.memory_budget.acquire(cost)
+            context = None
+            try:
+                function, args, context = start(heic_path, data)
+                future = executor.submit(function, *args)
+            except Exception as e:
+                # Broken or cancelled pool
+                self.memory_budget.release(cost)
+                result = ConversionResult(heic_path, None, False, str(e))
+                self.end_conversion(finish, heic_path, data, context, result)
+                continue
+            future.add_done_callback(lambda future, heic_path=heic_path, data=data, context=context, cost=cost:
+                                     self.on_done(future, finish, heic_path, data, context, cost))
+
+    def on_done(self, future, finish, heic_path, data, context, cost):
+        # The worker process has released the decoded image
+        self.memory_budget.release(cost)
+        try:
+            result = future.result()
+        except BaseException as e:
+            # Also cancelled conversions, and interrupted workers: the conversion always ends
+            result = ConversionResult(heic_path, None, False, str(e) or type(e).__name__)
+        self.end_conversion(finish, heic_path, data, context, result)
 
-    # Prepare file paths for conversion
-    tasks = [(os.path.join(heic_dir, file_name), os.path.join(jpg_dir, os.path.splitext(file_name)[0] + ".jpg"))
-             for file_name in heic_files if not os.path.exists(os.path.join(jpg_dir, os.path.splitext(file_name)[0] + ".jpg"))]
+    def end_conversion(self, finish, heic_path, data, context, result):
+        try:
+            merge_records(result.timings)
+            result.timings = None
+            finish(heic_path, data, context, result)
+        except Exception as e:
+            logging.error("Error ending the conversion of '%s': %s", heic_path, e)
+        finally:
+            self.in_flight.release()
+
+    def cancel(self):
+        """
+        Do not submit new conversions and cancel the submitted ones not started yet. Running ones end normally.
+        """
+        self.stopped.set()
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+
+def convert_heic_files(tasks, output_quality=50, max_workers=None, destination_folder=None, name_index=None,
+                       journal=None, memory_budget=None, on_result=None):
+    """
+    Convert HEIC files to JPG format with a single process pool shared by all the tasks.
 
-    # Convert HEIC files to JPG in parallel using ThreadPoolExecutor
-    num_converted = 0
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_file = {executor.submit(convert_single_file, heic_path, jpg_path, output_quality): heic_path
-                          for heic_path, jpg_path in tasks}
+    Args:
+    tasks (list): (heic_path, jpg_path) tuples to convert.
+    output_quality (int): Quality of the output JPG images (1-100).
+    max_workers (int): Number of worker processes, None to use all the cores.
+    destination_folder (str): If set, dated JPGs are written directly to their year folder in it.
+    name_index (DestinationNameIndex): Names already used in the destination, shared by the run.
+    journal (RunJournal): If set, records the conversions written directly to the year folders.
+    memory_budget (MemoryBudget): Memory shared by the conversions in flight, the default budget if None.
+    on_result (function): on_result(result) is called as soon as each conversion ends.
 
-        # Process the completed futures
-        for future in as_completed(future_to_file):
-            heic_file = future_to_file[future]
-            try:
-                _, success = future.result()
-                if success:
-                    num_converted += 1
-                # Display progress
-                # progress = int((num_converted / total_files) * 100)
-                # print_message_d(f"Conversion progress: {progress}%", end="\r")
-            except Exception as e:
-                print_message("Error occurred during conversion of '%s'", heic_file)
-                fail_list.append(heic_file)
+    Returns:
+    list: ConversionResult of each file, in the order the conversions ended.
+    """
+    results = []
+    if len(tasks) == 0:
+        return results
+
+    if name_index is None:
+        name_index = DestinationNameIndex()
+
+    def start(heic_path, jpg_path):
+        if destination_folder is None:
+            return convert_single_file, (heic_path, jpg_path, output_quality), None
+        temp_name = new_partial_name()
+        operation_id = journal.begin(OPERATION_HEIC, heic_path, destination_folder, temp_name) \
+            if journal is not None else None
+        return convert_and_place_file, (heic_path, jpg_path, output_quality, destination_folder, temp_name), \
+            operation_id
+
+    def finish(heic_path, jpg_path, operation_id, result):
+        if not result.success and result.destination is None:
+            result.destination = jpg_path
+        result = place_converted_file(result, name_index, journal, operation_id)
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    # Never start more processes than there are files to convert
+    HeicConversionPool(min(get_worker_count(max_workers), len(tasks)), memory_budget).run(tasks, start, finish)
+    return results
+
+def get_manifest_heic_tasks(manifest):
+    """
+    List the HEIC files of a manifest with the JPG file of their .ConvertedFiles folder.
+    JPG files converted by an interrupted run are kept, only their incomplete files are deleted.
 
-    print_message(f"Conversion completed successfully. {num_converted} files converted from {heic_dir}")
-    return 'STATUS_SUCCESS'
+    Args:
+    manifest (Manifest): Files of the tree, by kind.
 
-def convert_heic_to_jpg_subfolders(pathin):
-    for root, _, _ in os.walk(pathin):
-        if not os.path.basename(root).startswith('.') or root == pathin:
-            # TODO: count total number of converted files
-            status = convert_heic_to_jpg(root)
-            if status != 'STATUS_SUCCESS':
-                return status
-    return 'STATUS_SUCCESS', fail_list
+    Returns:
+    list: (heic_path, jpg_path) tuples, one per file to convert.
+    """
+    for partial_path in manifest.get_files(KIND_PARTIAL):
+        os.remove(partial_path)
+    manifest.files[KIND_PARTIAL] = []
+    return [(heic_path, os.path.join(os.path.dirname(heic_path), ".ConvertedFiles",
+                                     os.path.splitext(os.path.basename(heic_path))[0] + ".jpg"))
+            for heic_path in manifest.get_files(KIND_HEIC)]
+
+def convert_heic_to_jpg_subfolders(pathin, output_quality=50, max_workers=None, destination_folder=None,
+                                   manifest=None, memory_budget=None):
+    """
+    Convert all HEIC images of a directory tree to JPG format.
+    The files of every folder are queued to the same pool of worker processes.
 
+    Args:
+    pathin (str): Root of the directory tree.
+    output_quality (int): Quality of the output JPG images (1-100).
+    max_workers (int): Number of worker processes, None to use all the cores.
+    destination_folder (str): If set, dated JPGs are written directly to their year folder in it,
+                              instead of the .ConvertedFiles folders.
+    manifest (Manifest): Scan of pathin shared by the stages, scanned here if not given.
+                         The JPGs left in .ConvertedFiles are added to its photos.
+    memory_budget (MemoryBudget): Memory shared by the conversions in flight, the default budget if None.
 
-def sort_other_files(root, motherland):
-    for filename in os.listdir(root):
-        if not os.path.isdir(os.path.join(root, filename)):
-            try:
-                print_message_d(f"Found file: {filename}")
-                if not os.path.exists(motherland):
-                    os.makedirs(motherland)
-                    print_message_d(f"Created directory: {motherland}")
-                shutil.move(os.path.join(root, filename), os.path.join(motherland, filename))
-            except Exception as e:
-                print_message(f"Error moving file {filename}: {e}")
-                return 'STATUS_ERROR'
-    return 'STATUS_SUCCESS'
+    Returns:
+    tuple: Status and list of ConversionResult.
+    """
+    if not os.path.isdir(pathin):
+        print_message(f"Directory '{pathin}' does not exist.")
+        return 'STATUS_NO_DIR', []
 
+    if manifest is None:
+        manifest = scan_tree(pathin)
+    try:
+        tasks = get_manifest_heic_tasks(manifest)
+    except Exception as e:
+        print_message(f"Error deleting incomplete conversions in {pathin}: {e}")
+        return 'STATUS_ERROR', []
+
+    print_message_d(f"Number of files to convert: {len(tasks)}")
+    tracker = ProgressTracker('heic')
+    tracker.plan(len(tasks))
+
+    def on_result(result):
+        if not result.success:
+            print_message_d(f"Error converting '{result.source}': {result.error}")
+        tracker.advance(result.success, result.bytes_read, result.bytes_written)
+
+    results = convert_heic_files(tasks, output_quality, max_workers, destination_folder,
+                                 memory_budget=memory_budget, on_result=on_result)
+    tracker.finish()
+    # Files for the next stages: HEIC files which failed, JPG files to sort
+    manifest.files[KIND_HEIC] = [result.source for result in results if not result.success]
+    manifest.files[KIND_PHOTO].extend(result.destination for result in results if result.success and not result.placed)
+
+    num_converted = sum(1 for result in results if result.success)
+    num_placed = sum(1 for result in results if result.placed)
+    print_message(f"Conversion completed successfully. {num_converted} files converted from {pathin}")
+    if destination_folder is not None:
+        print_message_d(f"{num_placed} converted files written directly to {destination_folder}")
+    return 'STATUS_SUCCESS', results
+
+
+def sort_all_other_files(pathin, pathout, manifest=None):
+    """
+    Move all the files left in a directory tree to pathout.
 
-def sort_all_other_files(pathin, pathout):
-    for root, _, _ in os.walk(pathin):
-        if os.path.basename(root) != '.metadata':
-            status = sort_other_files(root, pathout)
-            if status != 'STATUS_SUCCESS':
-                return status
+    Args:
+    pathin (str): Root of the directory tree.
+    pathout (str): Folder receiving the files.
+    manifest (Manifest): Scan of pathin shared by the stages, scanned here if not given.
+                         Its files already moved by the previous stages are skipped.
+    """
+    if manifest is None:
+        manifest = scan_tree(pathin)
+    tracker = ProgressTracker('other')
+    for file_path in manifest.get_files(KIND_HEIC, KIND_PHOTO, KIND_VIDEO, KIND_OTHER):
+        filename = os.path.basename(file_path)
+        try:
+            if not os.path.exists(pathout):
+                os.makedirs(pathout)
+                print_message_d(f"Created directory: {pathout}")
+            shutil.move(file_path, os.path.join(pathout, filename))
+        except FileNotFoundError:
+            # Converted or sorted by a previous stage
+            continue
+        except Exception as e:
+            print_message(f"Error moving file {filename}: {e}")
+            tracker.plan()
+            tracker.advance(False)
+            tracker.finish()
+            return 'STATUS_ERROR'
+        print_message_d(f"Found file: {filename}")
+        tracker.plan()
+        tracker.advance()
+    tracker.finish()
     return 'STATUS_SUCCESS'
-
@@ -0,0 +1,177 @@
+"""
+Multi-threaded copy of the files of a directory import source.
+
+Several files are copied at once, so that the device always has a read waiting while a file
+is written to the import folder. The data is copied by the kernel when possible (copy_file_range,
+then sendfile), without going through Python buffers. Each file is written with a temporary name,
+renamed once complete, and reported at once: the caller records it in the import history, so that
+an interrupted import only copies the remaining files again.
+"""
+
+import errno
+import os
+import pathlib
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from infoBoxMgmt import print_message, print_message_d
+from treeScanner import PARTIAL_COPY_SUFFIX, new_partial_name
+
+DEFAULT_COPY_WORKERS = 4
+# Files submitted at once: the copy starts while the source is still being listed
+COPY_BATCH_SIZE = 64
+# Bytes copied per system call
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Errors meaning that a kernel copy is not supported between these two files
+UNSUPPORTED_COPY_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+def kernel_copy(copy_function, source_fd, destination_fd, offset, size):
+    """
+    Copy from offset to size with copy_function(source_fd, destination_fd, offset, count).
+
+    Returns:
+    int: Offset reached, smaller than size when the kernel copy is not supported.
+    """
+    while offset < size:
+        try:
+            copied = copy_function(source_fd, destination_fd, offset, min(COPY_CHUNK_SIZE, size - offset))
+        except OSError as e:
+            if e.errno in UNSUPPORTED_COPY_ERRORS:
+                return offset
+            raise
+        if copied == 0:
+            # File truncated while being copied
+            break
+        offset += copied
+    return offset
+
+
+def copy_range(source_fd, destination_fd, offset, count):
+    return os.copy_file_range(source_fd, destination_fd, count, offset, offset)
+
+
+def send_range(source_fd, destination_fd, offset, count):
+    # sendfile writes at the current position of the destination
+    os.lseek(destination_fd, offset, os.SEEK_SET)
+    return os.sendfile(destination_fd, source_fd, offset, count)
+
+
+def copy_file_data(source_path, destination_path):
+    """
+    Copy the content of a file, by the kernel when possible.
+
+    Returns:
+    int: Number of bytes copied.
+    """
+    with open(source_path, 'rb') as source_file, open(destination_path, 'wb') as destination_file:
+        source_fd = source_file.fileno()
+        destination_fd = destination_file.fileno()
+        size = os.fstat(source_fd).st_size
+        offset = 0
+        if hasattr(os, 'copy_file_range'):
+            offset = kernel_copy(copy_range, source_fd, destination_fd, offset, size)
+        if offset < size and hasattr(os, 'sendfile'):
+            offset = kernel_copy(send_range, source_fd, destination_fd, offset, size)
+        # Not supported by the platform or the file systems: copy through user space
+        source_file.seek(offset)
+        destination_file.seek(offset)
+        shutil.copyfileobj(source_file, destination_file, COPY_CHUNK_SIZE)
+        return destination_file.tell()
+
+
+def copy_file(source_path, destination_path):
+    """
+    Copy a file and its modification time. The destination only gets its name once complete.
+
+    Returns:
+    int: Number of bytes copied.
+    """
+    temp_path = os.path.join(os.path.dirname(destination_path), new_partial_name(PARTIAL_COPY_SUFFIX))
+    try:
+        size = copy_file_data(source_path, temp_path)
+        shutil.copystat(source_path, temp_path)
+        os.replace(temp_path, destination_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return size
+
+
+def order_for_copy(tasks):
+    """
+    Largest files first in each batch: the batch does not end with a single big video keeping one worker
+    busy while the others wait. Files without size keep their order, after the others.
+
+    Args:
+    tasks (list): (item, source_path, destination_path) tuples, item having a size attribute.
+    """
+    return sorted(tasks, key=lambda task: -task[0].size if task[0].size is not None else 0)
+
+
+def get_batches(iterable, batch_size):
+    batch = []
+    for element in iterable:
+        batch.append(element)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+class CopyEngine:
+    def __init__(self, max_workers=None):
+        if max_workers is None or max_workers < 1:
+            max_workers = DEFAULT_COPY_WORKERS
+        self.max_workers = max_workers
+
+    def copy(self, tasks, on_copied=None):
+        """
+        Copy files with several threads.
+
+        The tasks are read by batches: a batch is copied while the next one is read, so that a generator
+        listing the source feeds the copy as it goes.
+
+        Args:
+        tasks (iterable): (item, source_path, destination_path) tuples.
+        on_copied (function): on_copied(item, destination_path) is called as soon as each file is copied,
+                              in the calling thread.
+
+        Returns:
+        list: Items which could not be copied.
+        """
+        failed = []
+        num_copied = 0
+        print_message_d(f"Copying files with {self.max_workers} threads")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            previous_batch = {}
+            for batch in get_batches(tasks, COPY_BATCH_SIZE):
+                current_batch = {executor.submit(self.copy_one, source_path, destination_path):
+                                 (item, source_path, destination_path)
+                                 for item, source_path, destination_path in order_for_copy(batch)}
+                num_copied += self.collect(previous_batch, on_copied, failed)
+                previous_batch = current_batch
+            num_copied += self.collect(previous_batch, on_copied, failed)
+        print_message_d(f"{num_copied} files copied, {len(failed)} errors")
+        return failed
+
+    def collect(self, future_to_task, on_copied, failed):
+        num_copied = 0
+        for future in as_completed(future_to_task):
+            item, source_path, destination_path = future_to_task[future]
+            try:
+                future.result()
+            except OSError as e:
+                print_message(f"Error copying '{source_path}': {e}")
+                failed.append(item)
+                continue
+            num_copied += 1
+            if on_copied is not None:
+                on_copied(item, destination_path)
+        return num_copied
+
+    def copy_one(self, source_path, destination_path):
+        pathlib.Path(os.path.dirname(destination_path)).mkdir(parents=True, exist_ok=True)
+        return copy_file(source_path, destination_path)
@@ -0,0 +1,90 @@
+"""
+Detection of files with identical content.
+
+Files are compared by size first, then by a hash of their first and last blocks,
+and only then by a hash of their whole content. Hashes of the files already in the
+destination are cached, as a burst of photos compares the same files several times.
+"""
+
+import hashlib
+import os
+import threading
+
+# Size of the blocks read at the start and at the end of a file for the partial hash
+PARTIAL_HASH_BLOCK_SIZE = 64 * 1024
+FULL_HASH_CHUNK_SIZE = 1024 * 1024
+
+# What to do with an incoming file identical to a file of the destination
+POLICY_KEEP = 'keep'    # Write it with a _N suffix anyway
+POLICY_SKIP = 'skip'    # Delete it, the destination already has it
+POLICY_LINK = 'link'    # Replace it by a hard link to the existing file
+DUPLICATE_POLICIES = [POLICY_SKIP, POLICY_LINK, POLICY_KEEP]
+
+
+def get_partial_hash(path, size):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_HASH_BLOCK_SIZE))
+        if size > 2 * PARTIAL_HASH_BLOCK_SIZE:
+            f.seek(size - PARTIAL_HASH_BLOCK_SIZE)
+            digest.update(f.read(PARTIAL_HASH_BLOCK_SIZE))
+    return digest.digest()
+
+
+def get_full_hash(path):
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(FULL_HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.digest()
+
+
+class FileHashCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # path -> (size, mtime, partial hash, full hash)
+        self.hashes = {}
+
+    def _get(self, path, full):
+        file_stat = os.stat(path)
+        with self.lock:
+            cached = self.hashes.get(path)
+        if cached is None or cached[:2] != (file_stat.st_size, file_stat.st_mtime_ns):
+            cached = (file_stat.st_size, file_stat.st_mtime_ns, get_partial_hash(path, file_stat.st_size), None)
+        if full and cached[3] is None:
+            cached = cached[:3] + (get_full_hash(path),)
+        with self.lock:
+            self.hashes[path] = cached
+        return cached
+
+    def get_size(self, path):
+        return os.path.getsize(path)
+
+    def get_partial_hash(self, path):
+        return self._get(path, False)[2]
+
+    def get_full_hash(self, path):
+        return self._get(path, True)[3]
+
+    def forget(self, path):
+        with self.lock:
+            self.hashes.pop(path, None)
+
+
+def files_identical(path_a, path_b, hash_cache=None):
+    """
+    Check if two files have the same content: size, then partial hash, then full hash.
+    """
+    if hash_cache is None:
+        hash_cache = FileHashCache()
+    if hash_cache.get_size(path_a) != hash_cache.get_size(path_b):
+        return False
+    if hash_cache.get_partial_hash(path_a) != hash_cache.get_partial_hash(path_b):
+        return False
+    # Small files are entirely covered by the partial hash
+    if hash_cache.get_size(path_a) <= 2 * PARTIAL_HASH_BLOCK_SIZE:
+        return True
+    return hash_cache.get_full_hash(path_a) == hash_cache.get_full_hash(path_b)
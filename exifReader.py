@@ -0,0 +1,172 @@
+"""
+Minimal EXIF reader, only looking for the capture date of a photo (JPEG, PNG or HEIC).
+
+Instead of parsing every IFD of the file (MakerNote, thumbnail...) like exifread does,
+only the TIFF header, IFD0 and the Exif IFD entries are read, seeking directly to them.
+"""
+
+import io
+import os
+import struct
+from heifReader import read_heif_exif
+
+# Tags used to find the capture date
+TAG_EXIF_IFD_POINTER = 0x8769
+TAG_DATE_TIME_ORIGINAL = 0x9003
+
+# Type ASCII of a TIFF entry
+TIFF_TYPE_ASCII = 2
+
+# Upper bound of the number of entries of an IFD, to stop on corrupted files
+MAX_IFD_ENTRIES = 1000
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class ExifFormatError(ValueError):
+    """
+    The file is not a well-formed JPEG, PNG or TIFF structure.
+    """
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ExifFormatError("Unexpected end of file")
+    return data
+
+
+def read_tiff_date(f, base):
+    """
+    Read DateTimeOriginal from a TIFF structure.
+
+    Args:
+    f (file): Binary file object.
+    base (int): Offset of the TIFF header in the file.
+
+    Returns:
+    str: Capture date in the format 'YYYY:MM:DD HH:MM:SS', None if the tag is absent.
+    """
+    f.seek(base)
+    header = _read_exact(f, 8)
+    if header[:4] == b'II*\x00':
+        endian = '<'
+    elif header[:4] == b'MM\x00*':
+        endian = '>'
+    else:
+        raise ExifFormatError("Invalid TIFF header")
+
+    def find_entry(ifd_offset, wanted_tag):
+        f.seek(base + ifd_offset)
+        num_entries = struct.unpack(endian + 'H', _read_exact(f, 2))[0]
+        if num_entries > MAX_IFD_ENTRIES:
+            raise ExifFormatError(f"Too many IFD entries: {num_entries}")
+        entries = _read_exact(f, 12 * num_entries)
+        for i in range(num_entries):
+            tag, tag_type, count, value = struct.unpack(endian + 'HHII', entries[12 * i:12 * i + 12])
+            if tag == wanted_tag:
+                return tag_type, count, value, entries[12 * i + 8:12 * i + 12]
+        return None
+
+    ifd0_offset = struct.unpack(endian + 'I', header[4:8])[0]
+    exif_pointer = find_entry(ifd0_offset, TAG_EXIF_IFD_POINTER)
+    if exif_pointer is None:
+        return None
+
+    date_entry = find_entry(exif_pointer[2], TAG_DATE_TIME_ORIGINAL)
+    if date_entry is None:
+        return None
+    tag_type, count, value_offset, raw_value = date_entry
+    if tag_type != TIFF_TYPE_ASCII:
+        raise ExifFormatError("DateTimeOriginal is not a string")
+
+    # Values of 4 bytes or less are stored in the entry itself
+    if count <= 4:
+        raw_date = raw_value[:count]
+    else:
+        f.seek(base + value_offset)
+        raw_date = _read_exact(f, count)
+    date = raw_date.split(b'\x00', 1)[0].decode('ascii', errors='replace').strip()
+    return date or None
+
+
+def read_jpeg_date(f):
+    """
+    Read the capture date of a JPEG file from its APP1 Exif segment.
+    """
+    if _read_exact(f, 2) != b'\xff\xd8':
+        raise ExifFormatError("Not a JPEG file")
+    while True:
+        marker = _read_exact(f, 2)
+        if marker[0] != 0xFF:
+            raise ExifFormatError("Invalid JPEG marker")
+        # Start of scan or end of image: no more metadata
+        if marker[1] in (0xDA, 0xD9):
+            return None
+        length = struct.unpack('>H', _read_exact(f, 2))[0]
+        segment_start = f.tell()
+        if marker[1] == 0xE1 and length >= 8 and _read_exact(f, 6) == b'Exif\x00\x00':
+            return read_tiff_date(f, segment_start + 6)
+        f.seek(segment_start + length - 2)
+
+
+def read_png_date(f):
+    """
+    Read the capture date of a PNG file from its eXIf chunk.
+    """
+    if _read_exact(f, 8) != PNG_SIGNATURE:
+        raise ExifFormatError("Not a PNG file")
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            return None
+        length, chunk_type = struct.unpack('>I4s', chunk_header)
+        chunk_start = f.tell()
+        if chunk_type == b'eXIf':
+            return read_tiff_date(f, chunk_start)
+        if chunk_type == b'IEND':
+            return None
+        # Skip chunk data and CRC
+        f.seek(chunk_start + length + 4)
+
+
+def read_exif_date(image_path):
+    """
+    Retrieve the capture date of a JPEG, PNG or HEIC file, reading only the bytes needed.
+    HEIC files are not decoded: the date is read from the Exif item of the HEIF container.
+
+    Args:
+    image_path (str): Path to the image.
+
+    Returns:
+    str: Capture date in the format 'YYYY:MM:DD HH:MM:SS', None if not found.
+
+    Raises:
+    ExifFormatError: The file structure is malformed or not supported.
+    """
+    with open(image_path, 'rb') as f:
+        signature = f.read(8)
+        f.seek(0)
+        if signature.startswith(b'\xff\xd8'):
+            return read_jpeg_date(f)
+        if signature == PNG_SIGNATURE:
+            return read_png_date(f)
+    if signature[4:8] == b'ftyp':
+        return parse_exif_date(read_heif_exif(image_path))
+    raise ExifFormatError(f"Unsupported file type: {os.path.basename(image_path)}")
+
+
+def parse_exif_date(exif_data):
+    """
+    Retrieve the capture date from a raw EXIF block, like the one stored in Pillow's image.info["exif"].
+
+    Args:
+    exif_data (bytes): EXIF block, with or without the 'Exif\\0\\0' prefix.
+
+    Returns:
+    str: Capture date in the format 'YYYY:MM:DD HH:MM:SS', None if not found.
+    """
+    if not exif_data:
+        return None
+    base = 6 if exif_data.startswith(b'Exif\x00\x00') else 0
+    return read_tiff_date(io.BytesIO(exif_data), base)
@@ -1 +1,3 @@
+rem Render the resized button images, shipped in Images\rendered
+python uiAssets.py Images
 pyinstaller iGetMyPhotosAndVideos_UI.spec
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""
+Minimal HEIF container reader.
+
+A HEIC file is an ISO base media file: a tree of boxes whose 'meta' box describes the items of the
+file (image tiles, grid, thumbnails, Exif block) and their properties. Only the boxes of the 'meta' box
+are read, seeking over the others: the image data itself is never read nor decoded.
+"""
+
+import struct
+
+# Upper bound of the number of boxes read in a container, to stop on corrupted files
+MAX_BOXES = 10000
+# Upper bound of the size of an Exif block
+MAX_EXIF_SIZE = 16 * 1024 * 1024
+
+
+class HeifFormatError(ValueError):
+    """
+    The file is not a well-formed HEIF structure.
+    """
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise HeifFormatError("Unexpected end of file")
+    return data
+
+
+def iter_boxes(f, start, end):
+    """
+    Yield (box type, payload start, payload end) of the boxes between start and end, end None meaning
+    the end of the file. The file position is undefined after each yield.
+    """
+    offset = start
+    for _ in range(MAX_BOXES):
+        if end is not None and offset + 8 > end:
+            return
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            if end is None and len(header) == 0:
+                return
+            raise HeifFormatError("Truncated box header")
+        size, box_type = struct.unpack('>I4s', header)
+        payload_start = offset + 8
+        if size == 1:
+            size = struct.unpack('>Q', _read_exact(f, 8))[0]
+            payload_start += 8
+        elif size == 0:
+            # Box extending to the end of its container
+            if end is None:
+                f.seek(0, 2)
+                size = f.tell() - offset
+            else:
+                size = end - offset
+        box_end = offset + size
+        if box_end < payload_start or (end is not None and box_end > end):
+            raise HeifFormatError(f"Invalid size of box {box_type!r}")
+        yield box_type, payload_start, box_end
+        offset = box_end
+    raise HeifFormatError("Too many boxes")
+
+
+def find_box(f, box_type, start, end):
+    for found_type, payload_start, payload_end in iter_boxes(f, start, end):
+        if found_type == box_type:
+            return payload_start, payload_end
+    return None
+
+
+def find_meta_box(f):
+    """
+    Returns:
+    tuple: Start and end of the children of the top-level 'meta' box.
+    """
+    f.seek(0)
+    header = f.read(12)
+    if len(header) < 12 or header[4:8] != b'ftyp':
+        raise HeifFormatError("Not a HEIF file")
+    meta = find_box(f, b'meta', 0, None)
+    if meta is None:
+        raise HeifFormatError("No meta box")
+    # Full box: version and flags before the children
+    return meta[0] + 4, meta[1]
+
+
+def read_image_sizes(f, meta_start, meta_end):
+    """
+    Returns:
+    list: (width, height) of every 'ispe' property: the full image, its tiles and its thumbnails.
+    """
+    iprp = find_box(f, b'iprp', meta_start, meta_end)
+    if iprp is None:
+        return []
+    ipco = find_box(f, b'ipco', *iprp)
+    if ipco is None:
+        return []
+    sizes = []
+    for box_type, payload_start, payload_end in iter_boxes(f, *ipco):
+        if box_type == b'ispe' and payload_end - payload_start >= 12:
+            f.seek(payload_start + 4)
+            sizes.append(struct.unpack('>II', _read_exact(f, 8)))
+    return sizes
+
+
+def _read_uint(f, size):
+    # Fields of 0, 2, 4 or 8 bytes
+    if size == 0:
+        return 0
+    return int.from_bytes(_read_exact(f, size), 'big')
+
+
+def find_exif_item(f, meta_start, meta_end):
+    """
+    Returns:
+    int: ID of the Exif item, None if the file has none.
+    """
+    iinf = find_box(f, b'iinf', meta_start, meta_end)
+    if iinf is None:
+        return None
+    f.seek(iinf[0])
+    version = _read_exact(f, 4)[0]
+    entries_start = iinf[0] + 4 + (2 if version == 0 else 4)
+    for box_type, payload_start, payload_end in iter_boxes(f, entries_start, iinf[1]):
+        if box_type != b'infe':
+            continue
+        f.seek(payload_start)
+        version = _read_exact(f, 4)[0]
+        if version < 2:
+            continue
+        item_id = _read_uint(f, 2 if version == 2 else 4)
+        # Skip item_protection_index
+        _read_exact(f, 2)
+        if _read_exact(f, 4) == b'Exif':
+            return item_id
+    return None
+
+
+def find_item_extents(f, meta_start, meta_end, item_id):
+    """
+    Returns:
+    list: (offset in the file, length) of the extents of an item.
+    """
+    iloc = find_box(f, b'iloc', meta_start, meta_end)
+    if iloc is None:
+        raise HeifFormatError("No item locations")
+    f.seek(iloc[0])
+    version = _read_exact(f, 4)[0]
+    sizes = _read_exact(f, 2)
+    offset_size, length_size = sizes[0] >> 4, sizes[0] & 0xF
+    base_offset_size = sizes[1] >> 4
+    index_size = sizes[1] & 0xF if version in (1, 2) else 0
+    item_count = _read_uint(f, 2 if version < 2 else 4)
+    for _ in range(item_count):
+        current_id = _read_uint(f, 2 if version < 2 else 4)
+        construction_method = _read_uint(f, 2) & 0xF if version in (1, 2) else 0
+        # Skip data_reference_index
+        _read_exact(f, 2)
+        base_offset = _read_uint(f, base_offset_size)
+        extents = []
+        for _ in range(_read_uint(f, 2)):
+            _read_uint(f, index_size)
+            extent_offset = _read_uint(f, offset_size)
+            extents.append((base_offset + extent_offset, _read_uint(f, length_size)))
+        if current_id != item_id:
+            continue
+        if construction_method == 1:
+            # Offsets in the 'idat' box of the meta box
+            idat = find_box(f, b'idat', meta_start, meta_end)
+            if idat is None:
+                raise HeifFormatError("No item data box")
+            return [(idat[0] + offset, length) for offset, length in extents]
+        if construction_method != 0:
+            raise HeifFormatError(f"Unsupported construction method {construction_method}")
+        return extents
+    raise HeifFormatError(f"No location for item {item_id}")
+
+
+def read_heif_exif(image_path):
+    """
+    Read the Exif block of a HEIF file, without reading the image data.
+
+    Args:
+    image_path (str): Path to the HEIC file.
+
+    Returns:
+    bytes: EXIF block, starting with its TIFF header, None if the file has none.
+
+    Raises:
+    HeifFormatError: The file structure is malformed.
+    """
+    with open(image_path, 'rb') as f:
+        meta_start, meta_end = find_meta_box(f)
+        item_id = find_exif_item(f, meta_start, meta_end)
+        if item_id is None:
+            return None
+        data = b''
+        for offset, length in find_item_extents(f, meta_start, meta_end, item_id):
+            if length <= 0 or len(data) + length > MAX_EXIF_SIZE:
+                raise HeifFormatError("Invalid size of the Exif item")
+            f.seek(offset)
+            data += _read_exact(f, length)
+    # The item starts with the offset of the TIFF header in the rest of the block
+    if len(data) < 4:
+        raise HeifFormatError("Truncated Exif item")
+    tiff_offset = 4 + int.from_bytes(data[:4], 'big')
+    if tiff_offset >= len(data):
+        raise HeifFormatError("Invalid Exif item header")
+    return data[tiff_offset:]
+
+
+def read_heif_size(image_path):
+    """
+    Retrieve the size of the largest image of a HEIF file, without decoding it.
+    Photos are stored as a grid of tiles: the size of the grid is the size of the decoded photo.
+
+    Args:
+    image_path (str): Path to the HEIC file.
+
+    Returns:
+    tuple: (width, height) in pixels.
+
+    Raises:
+    HeifFormatError: The file structure is malformed or has no image size.
+    """
+    with open(image_path, 'rb') as f:
+        sizes = read_image_sizes(f, *find_meta_box(f))
+    if not sizes:
+        raise HeifFormatError("No image size")
+    return max(sizes, key=lambda size: size[0] * size[1])
@@ -1,15 +1,21 @@
+import time
+# Reference time of the startup timing report
+startup_start_time = time.perf_counter()
 import os
 import tkinter as tk
 from tkinter import filedialog, Scrollbar, messagebox
 from tkinter import simpledialog
-from PIL import Image, ImageTk
-import iPhoneImport
-import convertAndSort
-import mov_to_mp4
-from infoBoxMgmt import set_info_box, print_message, print_message_d, display_status, clear_info_box, set_debug_mode
+import uiAssets
+import progress
+from infoBoxMgmt import set_info_box, print_message, print_message_d, display_status, clear_info_box, set_debug_mode, \
+    set_log_file
 from threading import Thread
+import multiprocessing
 import sys
 
+# (step, seconds since startup_start_time) of the UI startup
+startup_times = [('Python modules imported', time.perf_counter() - startup_start_time)]
+
 """
 ENVIRONMENT VARIABLES
 """
@@ -20,6 +26,8 @@ if os.getenv('__TEST__') == 'True':
     __TEST__ = True
 if os.getenv('__DEBUG__') == 'True':
     __DEBUG__ = True
+# Path of a rotating log file receiving the info box messages
+__LOG_FILE__ = os.getenv('__LOG_FILE__')
 
 """
 GLOBAL VARIABLES
@@ -33,6 +41,19 @@ sort_active = False
 action_running = False
 default_bg = None
 
+# Last progress event of each stage, and refresh period of the progress line
+progress_events = {}
+PROGRESS_REFRESH_MS = 500
+
+# Names of the pipeline stages in the status messages
+stage_names = {
+    'import': "Import",
+    'heic': "HEIC to JPG conversion",
+    'video': "MOV to MP4 conversion",
+    'sort': "Sort other files",
+    'cleanup': "Delete empty directories",
+}
+
 
 if getattr(sys, 'frozen', False):
     # If the script is run as executable
@@ -45,58 +66,68 @@ else:
 FUNCTIONS
 """
 
-def perform_actions(root, iPhoneFolder, filesFolder, mp4quality):
+def on_progress_event(event):
+    # Called from the worker threads: only store the event, the Tk main loop displays it
+    progress_events[event.stage] = event
+
+def mark_startup(step):
+    startup_times.append((step, time.perf_counter() - startup_start_time))
+
+def get_startup_report():
+    """
+    Duration of each startup step, as text.
+    """
+    lines = ["Startup timing:"]
+    previous = 0
+    for step, elapsed in startup_times:
+        lines.append(f"  {step:<30} {1000 * (elapsed - previous):8.1f} ms  (total {1000 * elapsed:8.1f} ms)")
+        previous = elapsed
+    return "\n".join(lines) + "\n"
+
+def show_startup_report():
+    print_message(get_startup_report())
+
+def perform_actions(root, iPhoneFolder, filesFolder, mp4quality, video_mode='transcode'):
     global action_running
     def run_action():
         global action_running
 
-        #While True loop, to exit the loop with a break, instead of a return so that the action_running variable is reset
-        while True:
-            if not (import_active or convert1_active or convert2_active or sort_active):
-                print_message("No actions selected. Please select an action to perform.")
-                break
-            if filesFolder == "":
-                print_message("Please select an output folder.")
-                break   
-            # Default import in filesFolder\.import --> Then conversion starts in this .import folder and sort in filesFolder
-            import_folder = filesFolder + '\\.import'
-            if import_active:
-                print_message("Performing actions: Import")
-                status = iPhoneImport.iPhoneImportFiles(iPhoneFolder, import_folder)
-                display_status(status, "Import")
-                if status != 'STATUS_SUCCESS':
-                    break
-            if convert1_active: 
-                print_message("Performing actions: convert heic to jpg")
-                status, fail_list = convertAndSort.convert_heic_to_jpg_subfolders(import_folder)
-                if status == 'STATUS_SUCCESS':
-                    if len(fail_list) > 0:
-                        print_message(f"Failed to convert {" ".join(map(str, fail_list))} files. Check the debug log for details.")
-                    status = convertAndSort.process_photos(import_folder,filesFolder)
-                if status == 'STATUS_SUCCESS':
-                    status = convertAndSort.delete_empty_directories(import_folder)
-                display_status(status, "HEIC to JPG conversion")
-                if status != 'STATUS_SUCCESS':
-                    break
-            if convert2_active:
-                print_message("Performing actions: convert mov to mp4")
-                status = mov_to_mp4.convert_all_mov_to_mp4(import_folder, filesFolder, mp4quality)
-                display_status(status, "MOV to MP4 conversion")
-                if status != 'STATUS_SUCCESS':
-                    break
-            if sort_active:
-                print_message("Performing actions: sort other files")
-                status = convertAndSort.sort_all_other_files(import_folder,filesFolder + '\\OtherFiles')
-                if status == 'STATUS_SUCCESS':
-                    print_message('Delete empty directories')
-                    status = convertAndSort.delete_empty_directories(filesFolder)
-                display_status(status, "Sort other files")
-                if status != 'STATUS_SUCCESS':
+        try:
+            #While True loop, to exit the loop with a break, instead of a return
+            while True:
+                if not (import_active or convert1_active or convert2_active or sort_active):
+                    print_message("No actions selected. Please select an action to perform.")
                     break
-            break
-
-        action_running = False
-        root.configure(bg=default_bg)
+                if filesFolder == "":
+                    print_message("Please select an output folder.")
+                    break   
+                # The conversion modules are only imported when an action starts, to keep the startup fast
+                import pipeline
+                # Default import in filesFolder\.import --> Then conversion starts in this .import folder and sort in filesFolder
+                import_folder = filesFolder + '\\.import'
+                stages = []
+                if import_active:
+                    stages.append(pipeline.STAGE_IMPORT)
+                if convert1_active:
+                    stages.append(pipeline.STAGE_HEIC)
+                if convert2_active:
+                    stages.append(pipeline.STAGE_VIDEO)
+                if sort_active:
+                    stages.append(pipeline.STAGE_SORT)
+                progress_events.clear()
+                # Imported files are converted and sorted as soon as they are copied
+                print_message(f"Performing actions: {', '.join(stages)}")
+                statuses = pipeline.Pipeline(import_folder, filesFolder, stages, mp4quality=mp4quality,
+                                             video_mode=video_mode).run(iPhoneFolder)
+                for stage, status in statuses.items():
+                    display_status(status, stage_names.get(stage, stage))
+                break
+        except Exception as e:
+            print_message(f"Action failed: {e}")
+        finally:
+            # Reset even if the action failed, so that the next actions can run
+            action_running = False
+            root.configure(bg=default_bg)
 
     if action_running == True:
         print_message("Action already running. Please wait.")
@@ -130,9 +161,10 @@ def toggle_image(image_button, color_image, gray_image, state_variable):
 
 # Custom dialog box for options
 class OptionDialogBox(simpledialog.Dialog):
-    def __init__(self, parent, title=None, initial_value=False, initial_entry_value=10):
+    def __init__(self, parent, title=None, initial_value=False, initial_entry_value=10, initial_remux_value=True):
         self.checkbox_var = tk.BooleanVar(value=initial_value)
         self.entry_var = tk.IntVar(value=initial_entry_value)
+        self.remux_var = tk.BooleanVar(value=initial_remux_value)
         super().__init__(parent, title)
 
     def body(self, master):
@@ -145,24 +177,22 @@ class OptionDialogBox(simpledialog.Dialog):
         self.qlabel.pack(padx=10, pady=0)
         self.entry = tk.Entry(master, textvariable=self.entry_var)
         self.entry.pack(padx=10, pady=0)
+
+        # Add the checkbox for stream copy of MP4 compatible videos
+        self.remux_checkbox = tk.Checkbutton(master, text="Copy H.264/HEVC videos without re-encoding",
+                                             variable=self.remux_var, anchor="w")
+        self.remux_checkbox.pack(padx=10, pady=15, anchor="w")
         
         # Return the Checkbutton widget for the initial focus
         return self.checkbox
 
     def apply(self):
-        self.result = (self.checkbox_var.get(), self.entry_var.get())
+        self.result = (self.checkbox_var.get(), self.entry_var.get(), self.remux_var.get())
 
 def show_help():
-    # Paths to the images
-    image_paths = [
-        '',
-        os.path.join(base_path, 'Images', 'Gooo.jpg'),
-        os.path.join(base_path, 'Images', 'imageImport.jpg'),
-        os.path.join(base_path, 'Images', 'HeicToJpg.jpg'),
-        os.path.join(base_path, 'Images', 'MovToMp4.jpg'),
-        os.path.join(base_path, 'Images', 'SortPhotos.jpg'),
-        os.path.join(base_path, 'Images', 'DeleteHistory.jpg')
-    ]   
+    # Pre-rendered thumbnails of the images
+    images_folder = os.path.join(base_path, 'Images')
+    image_names = ['', 'help_go', 'help_import', 'help_heic', 'help_mov', 'help_sort', 'help_delete']
 
     # Corresponding descriptions
     descriptions = [
@@ -201,24 +231,17 @@ def show_help():
     frame.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
 
     # Add images and descriptions
-    for i, (path, desc) in enumerate(zip(image_paths, descriptions)):
+    for i, (name, desc) in enumerate(zip(image_names, descriptions)):
         try:
             # Create a frame for each image-description pair
             row_frame = tk.Frame(frame)
             row_frame.pack(anchor='w', pady=5, fill=tk.X, expand=True)
 
-            # Load and resize the image if path is not empty
-            if path != "":
-                image = Image.open(path)
-                if i == len(image_paths) - 1:  # Last row
-                    image.thumbnail((50, 50))  # Smaller size for the last image
-                elif i == 1:
-                    image.thumbnail((200, 100))
-                else:
-                    image.thumbnail((100, 100))
-                photo = ImageTk.PhotoImage(image)
+            # Load the image if name is not empty
+            if name != "":
+                photo = uiAssets.load_photo_image(images_folder, name)
 
-                if i == len(image_paths) - 1 or i == 1:  # Last row
+                if i == len(image_names) - 1 or i == 1:  # Last row
                     # Add the description first
                     description_label = tk.Label(row_frame, text=desc, justify=tk.LEFT,)
                     description_label.pack(side=tk.LEFT, padx=10, fill=tk.X, expand=True)
@@ -240,15 +263,16 @@ def show_help():
                 description_label.pack(side=tk.LEFT, padx=10, fill=tk.X, expand=True)
 
         except Exception as e:
-            print(f"Unable to load image: {path}\nError: {e}")
+            print(f"Unable to load image: {name}\nError: {e}")
 
 
 def create_gui():
     def open_option_dialog():
-        dialog = OptionDialogBox(root, "Options", debug_state.get(), quality_state.get())
+        dialog = OptionDialogBox(root, "Options", debug_state.get(), quality_state.get(), remux_state.get())
         if dialog.result is not None:
             debug_state.set(dialog.result[0])
             quality_state.set(dialog.result[1])
+            remux_state.set(dialog.result[2])
             set_debug_mode(dialog.result[0])
 
     global import_active, convert1_active, convert2_active, sort_active, info_box, default_bg
@@ -264,6 +288,7 @@ def create_gui():
 
     debug_state = tk.BooleanVar()
     quality_state = tk.IntVar(value=8)
+    remux_state = tk.BooleanVar(value=True)
 
     # Set a fixed window size
     root.geometry("520x520")
@@ -286,6 +311,7 @@ def create_gui():
     # Create a Help menu
     help_menu = tk.Menu(menubar, tearoff=0)
     help_menu.add_command(label="Help", command=show_help)
+    help_menu.add_command(label="Startup timing", command=show_startup_report)
     menubar.add_cascade(label="About", menu=help_menu)
 
     # Configure grid weights for resizing
@@ -312,16 +338,17 @@ def create_gui():
         entry2.insert(0, "D:\\Projects\\iGetMyPhotos\\TestFolder\\TestUI")
     tk.Button(root, text="Browse", command=lambda: browse_folder(entry2)).grid(row=1, column=3, padx=10, pady=5, sticky="e")
 
-    # Load the images for the buttons
-    image_paths = [os.path.join(base_path, 'Images', 'imageImport.jpg'), os.path.join(base_path, 'Images', 'HeicToJpg.jpg'), os.path.join(base_path, 'Images', 'MovToMp4.jpg'), os.path.join(base_path, 'Images', 'SortPhotos.jpg'), os.path.join(base_path, 'Images', 'Gooo.jpg'), os.path.join(base_path, 'Images', 'DeleteHistory.jpg')]
-    images = [Image.open(path).resize((100, 100), Image.LANCZOS) for path in image_paths]
-    gray_images = [Image.open(path).convert("L").resize((100, 100), Image.LANCZOS) for path in image_paths]
+    mark_startup('Window and menus created')
 
-    photo_images = [ImageTk.PhotoImage(img) for img in images]
-    gray_photo_images = [ImageTk.PhotoImage(img) for img in gray_images]
+    # Load the pre-rendered images for the buttons
+    images_folder = os.path.join(base_path, 'Images')
+    photo_images = [uiAssets.load_photo_image(images_folder, name) for name in ['import', 'heic', 'mov', 'sort']]
+    gray_photo_images = [uiAssets.load_photo_image(images_folder, name + '_gray')
+                         for name in ['import', 'heic', 'mov', 'sort']]
 
-    go_image = ImageTk.PhotoImage(Image.open(image_paths[4]).resize((220, 100), Image.LANCZOS))
-    delete_image = ImageTk.PhotoImage(Image.open(image_paths[5]).resize((50, 50), Image.LANCZOS))
+    go_image = uiAssets.load_photo_image(images_folder, 'go')
+    delete_image = uiAssets.load_photo_image(images_folder, 'delete')
+    mark_startup('Button images loaded')
 
     # Create buttons with images and ensure uniform spacing
     import_button = tk.Button(root, image=gray_photo_images[0], command=lambda: toggle_image(import_button, photo_images[0], gray_photo_images[0], "import_active"))
@@ -337,7 +364,8 @@ def create_gui():
     sort_button.grid(row=2, column=3, padx=10, pady=10)
 
     # Create a "go" button to perform actions based on image states
-    tk.Button(root, image=go_image, command=lambda: perform_actions(root, entry1.get(), entry2.get(), quality_state.get())).grid(row=3, column=0, columnspan=3, pady=10)
+    tk.Button(root, image=go_image, command=lambda: perform_actions(root, entry1.get(), entry2.get(), quality_state.get(),
+                                                                         'auto' if remux_state.get() else 'transcode')).grid(row=3, column=0, columnspan=3, pady=10)
 
     # Create a "clear" button to clear the info box
     tk.Button(root, image=delete_image, command=lambda: clear_info_box()).grid(row=3, column=3, pady=10, sticky="se")
@@ -352,15 +380,38 @@ def create_gui():
         debug_state.set(False)
 
     set_info_box(info_box, debug_state.get())
+    if __LOG_FILE__:
+        set_log_file(__LOG_FILE__)
 
     scrollbar = Scrollbar(root, command=info_box.yview)
     scrollbar.grid(row=4, column=5, sticky="ns")
     info_box['yscrollcommand'] = scrollbar.set
 
+    # Live progress of the running stages
+    progress_text = tk.StringVar()
+    tk.Label(root, textvariable=progress_text, justify=tk.LEFT, anchor="w").grid(row=5, column=0, columnspan=5,
+                                                                                 padx=10, sticky="ew")
+    progress.add_listener(on_progress_event)
+
+    def refresh_progress():
+        progress_text.set("\n".join(progress.format_event(event) for event in list(progress_events.values())))
+        root.after(PROGRESS_REFRESH_MS, refresh_progress)
+    root.after(PROGRESS_REFRESH_MS, refresh_progress)
+
     default_bg = root.cget("bg")
+    mark_startup('Widgets created')
+
+    def on_window_shown():
+        mark_startup('Window shown')
+        print_message_d(get_startup_report())
+    root.after_idle(on_window_shown)
 
     # Run the main application loop
     root.mainloop()
 
-# Call the function to create the graphical user interface
-create_gui()
+if __name__ == '__main__':
+    # Conversion worker processes re-import this module: only the main process builds the UI
+    multiprocessing.freeze_support()
+    # Call the function to create the graphical user interface
+    create_gui()
+
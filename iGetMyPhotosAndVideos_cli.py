@@ -0,0 +1,198 @@
+"""
+Command line interface of iGetMyPhotosAndVideos, for unattended runs without display.
+
+Example:
+    python iGetMyPhotosAndVideos_cli.py --output D:\\Photos --import --heic --video --sort
+
+The same actions as the UI are available. Only the modules needed by the selected stages are imported,
+the progress is written to stderr and a JSON summary of the run is printed to stdout.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from infoBoxMgmt import set_console_output, set_log_file, print_message, display_status
+from dedup import DUPLICATE_POLICIES, POLICY_SKIP
+
+IPHONE_DEFAULT_PATH = "This PC\\Apple iPhone\\Internal Storage"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Import, convert and sort iPhone photos and videos")
+    parser.add_argument('--input', default=IPHONE_DEFAULT_PATH,
+                        help=f"Folder to import from: Windows shell path of the phone, or a directory such as a "
+                             f"mounted DCIM tree or an SD card (default: '{IPHONE_DEFAULT_PATH}')")
+    parser.add_argument('--output', help="Output folder, files are imported in its .import subfolder")
+
+    stages = parser.add_argument_group("stages")
+    stages.add_argument('--import', dest='import_stage', action='store_true', help="Import files from the input folder")
+    stages.add_argument('--heic', action='store_true', help="Convert HEIC to JPG and sort photos by year")
+    stages.add_argument('--video', action='store_true', help="Convert MOV to MP4 and sort videos by year")
+    stages.add_argument('--sort', action='store_true', help="Move all other files to OtherFiles")
+    stages.add_argument('--all', action='store_true', help="Run all the stages")
+
+    options = parser.add_argument_group("options")
+    options.add_argument('--jpg-quality', type=int, default=50, help="JPG quality [1-100] (default: 50)")
+    options.add_argument('--mp4-quality', type=int, default=8, help="MP4 quality [1-31], 1 is higher quality (default: 8)")
+    options.add_argument('--keep-heic', action='store_true',
+                         help="Sort the HEIC files by capture date without converting them to JPG")
+    options.add_argument('--video-mode', choices=['auto', 'transcode'], default='auto',
+                         help="'auto' copies H.264/HEVC videos without re-encoding (default: auto)")
+    options.add_argument('--live-photos', choices=['remux', 'archive', 'skip', 'convert'], default='remux',
+                         help="Motion clips of the Live Photos, named after their photo: remux to MP4 without "
+                              "transcoding, archive the MOV as is, skip them, or convert them like the other "
+                              "videos (default: remux)")
+    options.add_argument('--duplicates', choices=DUPLICATE_POLICIES, default=POLICY_SKIP,
+                         help="Files identical to a file of the output folder: 'skip' them, replace them by a hard "
+                              "'link', or 'keep' them with a _N suffix (default: skip)")
+    options.add_argument('--heic-workers', type=int, default=None,
+                         help="Number of HEIC conversion processes (default: number of cores)")
+    options.add_argument('--heic-memory', type=int, default=None, metavar='MB',
+                         help="Memory shared by the HEIC conversions in flight, in MB, 0 for no limit "
+                              "(default: half of the physical memory)")
+    options.add_argument('--video-jobs', type=int, default=None, help="Number of parallel ffmpeg processes")
+    options.add_argument('--video-threads', type=int, default=None,
+                         help="Total number of ffmpeg threads, shared by the jobs (default: number of cores)")
+    options.add_argument('--video-timeout', type=float, default=None, metavar='SECONDS',
+                         help="Seconds after which a hung ffmpeg job is killed, its video being left for the next "
+                              "run, 0 for no limit (default: 7200)")
+    options.add_argument('--copy-threads', type=int, default=None,
+                         help="Number of files copied at once when importing from a directory (default: 4)")
+    options.add_argument('--scan-threads', type=int, default=1,
+                         help="Number of threads scanning the import folder, for network or USB drives (default: 1)")
+    options.add_argument('--progress-interval', type=float, default=5.0,
+                         help="Seconds between two progress lines of a stage (default: 5)")
+    options.add_argument('--plan', metavar='PLAN_FILE', default=None,
+                         help="Do not modify any file: write the operations of the run, with their estimated "
+                              "duration, to this JSON file (files still on the phone are not planned)")
+    options.add_argument('--execute-plan', metavar='PLAN_FILE', default=None,
+                         help="Execute the operations of a plan written by --plan")
+    options.add_argument('--log-file', default=None, help="Also write the messages to this rotating log file")
+    options.add_argument('--profile', choices=['timing', 'cprofile'], default=None,
+                         help="Measure the time spent in each stage and file operation, cprofile also profiles "
+                              "a stage (default: __PROFILE__ environment variable)")
+    options.add_argument('--profile-stage', default=None,
+                         help="Stage profiled by --profile cprofile, one of scan, import, heic, photo, video, other, "
+                              "recover (default: the first stage to start)")
+    options.add_argument('--profile-dir', default=None,
+                         help="Folder of the profiling reports (default: .metadata/profile of the import folder)")
+    options.add_argument('--debug', action='store_true', default=os.getenv('__DEBUG__') == 'True',
+                         help="Print debug messages")
+    args = parser.parse_args(argv)
+    if args.output is None and args.execute_plan is None:
+        parser.error("--output is required")
+    return args
+
+
+def get_memory_budget(args):
+    # In bytes, None for the default budget
+    if args.heic_memory is None:
+        return None
+    return args.heic_memory * 1024 * 1024
+
+
+def write_plan(args, import_folder, stages):
+    import planner
+    import progress
+    import scanCache
+    print_message(f"Planning actions: {', '.join(stages)}")
+    with scanCache.open_scan_cache(os.path.join(import_folder, '.metadata')) as scan_cache:
+        plan = planner.Planner(import_folder, args.output, stages, args.video_mode, scan_cache,
+                               args.scan_threads, args.keep_heic, args.duplicates, args.live_photos).plan()
+    plan['jpg_quality'] = args.jpg_quality
+    plan['mp4_quality'] = args.mp4_quality
+    planner.save_plan(plan, args.plan)
+    print_message(f"{len(plan['operations'])} operations written to {args.plan}, "
+                  f"estimated duration {progress.format_duration(plan['estimated_s'])}")
+    print(json.dumps({'status': 'STATUS_SUCCESS', 'plan': args.plan, 'totals': plan['totals'],
+                      'skipped': len(plan['skipped']), 'estimated_s': plan['estimated_s']}, indent=2))
+    return 0
+
+
+def execute_plan(args):
+    import pipeline
+    import planner
+    from memoryBudget import MemoryBudget
+    plan = planner.load_plan(args.execute_plan)
+    print_message(f"Executing {len(plan['operations'])} operations of {args.execute_plan}")
+    start_time = time.time()
+    executor = planner.PlanExecutor(plan, plan.get('jpg_quality', args.jpg_quality),
+                                    plan.get('mp4_quality', args.mp4_quality), args.heic_workers, args.video_jobs,
+                                    args.video_threads, MemoryBudget(get_memory_budget(args)), args.video_timeout)
+    statuses = executor.run()
+    for kind, status in statuses.items():
+        display_status(status, kind)
+    pipeline.write_profile(args.profile_dir or os.path.join(executor.import_folder, '.metadata', 'profile'))
+    success = all(status == 'STATUS_SUCCESS' for status in statuses.values())
+    print(json.dumps({'status': 'STATUS_SUCCESS' if success else 'STATUS_ERROR', 'plan': args.execute_plan,
+                      'stages': statuses, 'failed': executor.failed,
+                      'duration_s': round(time.time() - start_time, 3)}, indent=2))
+    return 0 if success else 1
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    set_console_output(sys.stderr, args.debug)
+    if args.log_file:
+        set_log_file(args.log_file)
+    if args.profile:
+        import instrumentation
+        instrumentation.enable(args.profile, args.profile_stage)
+
+    # Imported lazily: the stage modules load their own dependencies only when used
+    import pipeline
+    import progress
+    progress.add_listener(progress.PeriodicPrinter(print_message, args.progress_interval))
+
+    if args.execute_plan:
+        return execute_plan(args)
+
+    stages = []
+    if args.import_stage or args.all:
+        stages.append(pipeline.STAGE_IMPORT)
+    if args.heic or args.all:
+        stages.append(pipeline.STAGE_HEIC)
+    if args.video or args.all:
+        stages.append(pipeline.STAGE_VIDEO)
+    if args.sort or args.all:
+        stages.append(pipeline.STAGE_SORT)
+    if len(stages) == 0:
+        print_message("No actions selected. Use --import, --heic, --video, --sort or --all.")
+        return 2
+
+    import_folder = os.path.join(args.output, '.import')
+    if args.plan:
+        return write_plan(args, import_folder, stages)
+    print_message(f"Performing actions: {', '.join(stages)}")
+    start_time = time.time()
+    run_pipeline = pipeline.Pipeline(import_folder, args.output, stages, output_quality=args.jpg_quality,
+                                     mp4quality=args.mp4_quality, video_mode=args.video_mode,
+                                     heic_workers=args.heic_workers, video_jobs=args.video_jobs,
+                                     video_thread_budget=args.video_threads, duplicate_policy=args.duplicates,
+                                     scan_workers=args.scan_threads, profile_folder=args.profile_dir,
+                                     copy_workers=args.copy_threads, heic_memory_budget=get_memory_budget(args),
+                                     live_photo_policy=args.live_photos, keep_heic=args.keep_heic,
+                                     video_timeout=args.video_timeout)
+    statuses = run_pipeline.run(args.input)
+    for stage, status in statuses.items():
+        display_status(status, stage)
+
+    success = all(status == 'STATUS_SUCCESS' for status in statuses.values())
+    summary = {
+        'status': 'STATUS_SUCCESS' if success else 'STATUS_ERROR',
+        'input': args.input,
+        'output': args.output,
+        'stages': statuses,
+        'files': run_pipeline.get_summary(),
+        'duration_s': round(time.time() - start_time, 3),
+    }
+    print(json.dumps(summary, indent=2))
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+On-disk ledger of the files already imported from the phone.
+
+The ledger is a SQLite database stored in the .metadata folder. Paths are normalized once,
+when they are inserted, and membership checks use the primary key index.
+The imported_*.txt files written by previous versions are imported automatically, once.
+"""
+
+import glob
+import os
+import pathlib
+import re
+from datetime import datetime
+from infoBoxMgmt import print_message_d
+from metadataDatabase import MetadataDatabase
+
+LEDGER_FILE_NAME = "imported.sqlite3"
+
+
+# changes "a" to "_" in "202301_a\IMG_1694.HEIC"
+def normalize_path(file_path):
+    return re.sub("_[a-z]\\\\", "__\\\\", file_path)
+
+
+class ImportLedger(MetadataDatabase):
+    file_name = LEDGER_FILE_NAME
+    schema = ["CREATE TABLE IF NOT EXISTS imported_files (path TEXT PRIMARY KEY, import_run TEXT) WITHOUT ROWID",
+              "CREATE TABLE IF NOT EXISTS migrated_lists (file_name TEXT PRIMARY KEY)"]
+
+    def migrate_text_files(self):
+        """
+        Import the imported_*.txt lists not already imported in the ledger.
+
+        Returns:
+        int: Number of lists imported.
+        """
+        num_migrated = 0
+        for filename in sorted(glob.glob(os.path.join(self.metadata_folder, "*.txt"))):
+            list_name = os.path.basename(filename)
+            with self.lock:
+                if self.connection.execute("SELECT 1 FROM migrated_lists WHERE file_name = ?",
+                                           (list_name,)).fetchone():
+                    continue
+            print_message_d(f"Importing imported file list '{filename}' into the ledger")
+            with open(filename, "r") as file:
+                paths = [line.strip() for line in file if line.strip()]
+            run = os.path.splitext(list_name)[0].replace("imported_", "")
+            with self.lock, self.connection:
+                self.connection.executemany("INSERT OR IGNORE INTO imported_files VALUES (?, ?)",
+                                            ((normalize_path(path), run) for path in paths))
+                self.connection.execute("INSERT INTO migrated_lists VALUES (?)", (list_name,))
+            num_migrated += 1
+        return num_migrated
+
+    def __contains__(self, file_path):
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM imported_files WHERE path = ?",
+                                           (normalize_path(file_path),)).fetchone() is not None
+
+    def __len__(self):
+        return self.count("imported_files")
+
+    def add_many(self, file_paths, run=None):
+        """
+        Record imported files, in a single transaction.
+
+        Args:
+        file_paths (iterable): Relative paths of the imported files.
+        run (str): Identifier of the import run, the current time by default.
+        """
+        if run is None:
+            run = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO imported_files VALUES (?, ?)",
+                                        ((normalize_path(path), run) for path in file_paths))
+
+    def add(self, file_path, run=None):
+        self.add_many([file_path], run)
+
+
+# Opens the ledger of a metadata folder, importing the legacy text lists
+def open_import_ledger(metadata_folder):
+    if not os.path.exists(metadata_folder):
+        pathlib.Path(metadata_folder).mkdir(parents=True, exist_ok=True)
+    if not os.path.isdir(metadata_folder):
+        raise Exception(f"{metadata_folder} is not a folder")
+    ledger = ImportLedger(metadata_folder)
+    ledger.migrate_text_files()
+    print_message_d(f"Import ledger contains {len(ledger)} files")
+    return ledger
@@ -0,0 +1,193 @@
+"""
+Sources of the files to import.
+
+An import source lists the files of a device with their size and modification time, and copies
+them to the import folder. Two backends are available:
+- ShellImportSource: the phone seen through the Windows shell ("This PC\\Apple iPhone\\Internal Storage"),
+- DirectoryImportSource: an ordinary directory, such as a DCIM tree mounted with ifuse or gphotofs,
+  an SD card or a local folder standing in for the phone.
+
+The relative paths of the items always use '\\' separators, like the shell paths of the phone, so that
+the import history is shared by both backends.
+"""
+
+import os
+import pathlib
+from dataclasses import dataclass
+from infoBoxMgmt import print_message_d
+from copyEngine import CopyEngine, get_batches
+
+# Separator of the relative paths of the items
+ITEM_SEPARATOR = '\\'
+
+# Files copied by each shell file operation: a failed operation only loses its own batch
+SHELL_COPY_BATCH_SIZE = 100
+
+
+class ImportSourceError(Exception):
+    """
+    The source cannot be opened: phone not connected, locked, or folder missing.
+    """
+
+
+@dataclass
+class ImportItem:
+    # Path relative to the source, e.g. "202301_a\IMG_1694.HEIC"
+    relative_path: str
+    # Size in bytes and modification time in seconds, None when the source does not give them
+    size: int = None
+    mtime: float = None
+    # Object of the backend used to read the file: shell item or absolute path
+    handle: object = None
+
+
+def get_destination_path(destination_folder, item):
+    return os.path.join(destination_folder, *item.relative_path.split(ITEM_SEPARATOR))
+
+
+class ImportSource:
+    """
+    Interface of the import sources.
+    """
+
+    def open(self):
+        """
+        Connect to the source. Raises ImportSourceError when it is not available.
+        """
+
+    def list_items(self):
+        """
+        Returns:
+        iterable: ImportItem of each file of the source, yielded as the source is listed.
+        """
+        raise NotImplementedError
+
+    def open_item(self, item):
+        """
+        Returns:
+        file: Binary file object reading the content of the item.
+        """
+        raise NotImplementedError
+
+    def copy_items(self, items, destination_folder, on_item_copied=None):
+        """
+        Copy items to destination_folder, keeping their relative paths.
+
+        Args:
+        items (iterable): ImportItem to copy, consumed while the first ones are copied.
+        destination_folder (str): Import folder.
+        on_item_copied (function): on_item_copied(item, destination_path) is called for each copied file.
+
+        Returns:
+        list: Items which could not be copied.
+        """
+        raise NotImplementedError
+
+
+class DirectoryImportSource(ImportSource):
+    def __init__(self, root, copy_workers=None):
+        self.root = root
+        self.copy_engine = CopyEngine(copy_workers)
+
+    def open(self):
+        if not os.path.isdir(self.root):
+            raise ImportSourceError(f"Cannot find folder {self.root}")
+
+    def list_items(self):
+        # Iterative: no recursion limit on deep trees
+        pending = [(self.root, '')]
+        while pending:
+            folder, relative_folder = pending.pop()
+            print_message_d(f"Listing folder '{folder}'")
+            child_folders = []
+            with os.scandir(folder) as entries:
+                for entry in sorted(entries, key=lambda entry: entry.name):
+                    relative_path = relative_folder + entry.name
+                    if entry.is_dir():
+                        child_folders.append((entry.path, relative_path + ITEM_SEPARATOR))
+                    elif entry.is_file():
+                        file_stat = entry.stat()
+                        yield ImportItem(relative_path, file_stat.st_size, file_stat.st_mtime, entry.path)
+            # Listed in name order: pushed in reverse order
+            pending.extend(reversed(child_folders))
+
+    def open_item(self, item):
+        return open(item.handle, 'rb')
+
+    def copy_items(self, items, destination_folder, on_item_copied=None):
+        return self.copy_engine.copy(((item, item.handle, get_destination_path(destination_folder, item))
+                                      for item in items), on_item_copied)
+
+
+class ShellImportSource(ImportSource):
+    def __init__(self, absolute_display_name):
+        self.absolute_display_name = absolute_display_name
+        self.shell_folder = None
+
+    def open(self):
+        import win32utils
+        if win32utils.shell is None:
+            raise ImportSourceError(f"Cannot find folder {self.absolute_display_name}, "
+                                    f"and the Windows shell is not available")
+        try:
+            self.shell_folder = win32utils.get_shell_folder_from_absolute_display_name(self.absolute_display_name)
+        except Exception as e:
+            raise ImportSourceError(str(e)) from e
+
+    def list_items(self):
+        import win32utils
+        for relative_path, shell_item in win32utils.iter_dcim(self.shell_folder, self.absolute_display_name):
+            size, mtime = win32utils.get_size_and_mtime(shell_item)
+            yield ImportItem(relative_path, size, mtime, shell_item)
+
+    def open_item(self, item):
+        import win32utils
+        return win32utils.open_shell_item(item.handle)
+
+    def copy_items(self, items, destination_folder, on_item_copied=None):
+        target_folder_shell_item_by_path = {}
+        failed = []
+        for batch in get_batches(items, SHELL_COPY_BATCH_SIZE):
+            failed += self.copy_batch(batch, destination_folder, target_folder_shell_item_by_path, on_item_copied)
+        return failed
+
+    def copy_batch(self, items, destination_folder, target_folder_shell_item_by_path, on_item_copied):
+        import win32utils
+        copy_params_list = []
+        destination_paths = []
+        for item in items:
+            destination_path = get_destination_path(destination_folder, item)
+            target_folder = os.path.dirname(destination_path)
+            if target_folder not in target_folder_shell_item_by_path:
+                pathlib.Path(target_folder).mkdir(parents=True, exist_ok=True)
+                target_folder_shell_item_by_path[target_folder] = win32utils.get_shell_item_from_path(target_folder)
+            copy_params_list.append(win32utils.CopyParams(item.handle, target_folder_shell_item_by_path[target_folder],
+                                                          os.path.basename(destination_path)))
+            destination_paths.append((item, destination_path))
+        win32utils.copy_multiple_files(copy_params_list)
+        failed = []
+        for item, destination_path in destination_paths:
+            # The shell copy can be aborted: only report the files which reached the destination
+            if not os.path.exists(destination_path):
+                failed.append(item)
+            elif on_item_copied is not None:
+                on_item_copied(item, destination_path)
+        return failed
+
+
+def get_import_source(source, copy_workers=None):
+    """
+    Backend of a source given as a path: a directory, or a Windows shell path of the phone.
+
+    Args:
+    source (str): Path of the source, or an ImportSource returned as is.
+    copy_workers (int): Number of files copied at once from a directory.
+
+    Returns:
+    ImportSource: Source, not opened yet.
+    """
+    if isinstance(source, ImportSource):
+        return source
+    if os.path.isdir(source):
+        return DirectoryImportSource(source, copy_workers)
+    return ShellImportSource(source)
@@ -1,5 +1,23 @@
-import tkinter as tk
+import logging
+import logging.handlers
+import queue
+import sys
 
+# Same value as tkinter.END: tkinter is not imported, so that headless runs do not load it
+TK_END = "end"
+
+# Info box refresh period and maximum number of messages displayed per refresh
+DEFAULT_POLL_INTERVAL_MS = 100
+MAX_BATCH_MESSAGES = 2000
+# Number of lines kept in the info box
+DEFAULT_MAX_LINES = 5000
+
+# Rotating log file, disabled by default
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 3
+file_logger = logging.getLogger('iGetMyPhotosAndVideos')
+file_logger.propagate = False
+file_logger.setLevel(logging.DEBUG)
 
 errors_dict = {
     'STATUS_SUCCESS': 'Success',
@@ -11,53 +29,127 @@ errors_dict = {
 global_info_box = None
 
 class MyInfoBox:
-    def __init__(self, text_box, debug_mode=False):
+    """
+    Info box displaying the messages in a Tk Text widget.
+
+    Worker threads only put messages in a queue: the Tk main loop drains it on a timer,
+    inserting each batch at once, and keeps at most max_lines lines in the widget.
+    """
+    def __init__(self, text_box, debug_mode=False, max_lines=DEFAULT_MAX_LINES, poll_interval_ms=DEFAULT_POLL_INTERVAL_MS):
         self.text_box = text_box
         self.debug = debug_mode
+        self.max_lines = max_lines
+        self.poll_interval_ms = poll_interval_ms
+        self.pending = queue.SimpleQueue()
         # Configure color tags
         self.text_box.tag_configure("green", foreground="#00FF00")
         self.text_box.tag_configure("red", foreground="#FF0000")
         self.text_box.tag_configure("gray", foreground="#666666")
+        self.text_box.after(self.poll_interval_ms, self.drain)
 
     def clear(self):
         """
         Erase all content form the text box.
         """
-        self.text_box.delete(1.0, tk.END)
+        self.text_box.delete(1.0, TK_END)
 
     def append(self, text, color=None):
-        if color:
-            self.text_box.insert(tk.END, text, color)
-        else:
-            self.text_box.insert(tk.END, text)
-        self.text_box.update_idletasks()
-        self.text_box.see(tk.END)  # Scroll to the end to show the latest text    
+        # Can be called from any thread: the widget is only updated by drain, in the Tk main loop
+        self.pending.put((text, color))
 
     def set_text(self, text):
         """
         Replace text box content with new content
         """
         self.clear()
-        self.text_box.insert(tk.END, text)
-        self.text_box.update_idletasks()
-        self.text_box.see(tk.END)  # Scroll to the end to show the latest text   
+        self.text_box.insert(TK_END, text)
+        self.text_box.see(TK_END)  # Scroll to the end to show the latest text   
+
+    def drain(self):
+        """
+        Display the pending messages, then schedule the next call.
+        """
+        batch = []
+        try:
+            while len(batch) < MAX_BATCH_MESSAGES:
+                text, color = self.pending.get_nowait()
+                # Consecutive messages of the same color are inserted at once
+                if batch and batch[-1][1] == color:
+                    batch[-1][0].append(text)
+                else:
+                    batch.append(([text], color))
+        except queue.Empty:
+            pass
+
+        if batch:
+            for texts, color in batch:
+                if color:
+                    self.text_box.insert(TK_END, "".join(texts), color)
+                else:
+                    self.text_box.insert(TK_END, "".join(texts))
+            # Bounded scrollback: remove the oldest lines
+            num_lines = int(self.text_box.index('end-1c').split('.')[0])
+            if num_lines > self.max_lines:
+                self.text_box.delete(1.0, f"{num_lines - self.max_lines + 1}.0")
+            self.text_box.see(TK_END)  # Scroll to the end to show the latest text
+        self.text_box.after(self.poll_interval_ms, self.drain)
+
+
+class ConsoleBox:
+    """
+    Info box writing to a text stream, for the command line interface.
+    """
+    def __init__(self, stream=sys.stderr, debug_mode=False):
+        self.stream = stream
+        self.debug = debug_mode
+
+    def clear(self):
+        pass
+
+    def append(self, text, color=None):
+        self.stream.write(text)
+        self.stream.flush()
+
+    def set_text(self, text):
+        self.append(text)
 
 
 def print_message(msg, end='\n'):
     global global_info_box
     if global_info_box:
         global_info_box.append(msg + end)
+    if file_logger.handlers:
+        file_logger.info(msg)
 
 def print_message_d(msg, end='\n'):
     global global_info_box
     if global_info_box and global_info_box.debug:
         global_info_box.append(msg + end, 'gray')        
+        if file_logger.handlers:
+            file_logger.debug(msg)
+
+def set_log_file(path, max_bytes=LOG_FILE_MAX_BYTES, backup_count=LOG_FILE_BACKUP_COUNT):
+    """
+    Also write the messages to a rotating log file. Debug messages are written in debug mode only.
+    """
+    for handler in list(file_logger.handlers):
+        file_logger.removeHandler(handler)
+        handler.close()
+    if path:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                       encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(threadName)s: %(message)s'))
+        file_logger.addHandler(handler)
 
 def set_info_box(ib, dm):
     global global_info_box
     gib = MyInfoBox(ib, dm)
     global_info_box = gib
 
+def set_console_output(stream=sys.stderr, dm=False):
+    global global_info_box
+    global_info_box = ConsoleBox(stream, dm)
+
 def display_status(status, msg=None):
     if status == 'STATUS_SUCCESS':
         color = 'green'
@@ -67,6 +159,8 @@ def display_status(status, msg=None):
         msg = 'Action'
     if global_info_box:
         global_info_box.append(f'{msg} ended with status: {errors_dict[status]} \n', color)
+    if file_logger.handlers:
+        file_logger.info(f'{msg} ended with status: {errors_dict[status]}')
 
 def clear_info_box():
     global global_info_box
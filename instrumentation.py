@@ -0,0 +1,248 @@
+"""
+Opt-in timing and profiling of the stages and of the operations done on each file.
+
+Enabled by the __PROFILE__ environment variable, like __DEBUG__:
+    __PROFILE__=True        wall and CPU time of each stage and file operation (decode, encode, exif read...)
+    __PROFILE__=cprofile    same, plus a cProfile of a stage, saved as a .prof file
+or by enable() (--profile option of the command line interface).
+
+A single stage is profiled at a time: from Python 3.12 the profiler uses sys.monitoring, which is
+shared by the whole process, so that a second profiler cannot be enabled and the profile also includes
+the other threads. The stage profiled is chosen with enable(), the first stage to start by default;
+the stages which could not be profiled are listed in the report.
+
+When it is disabled, measure() and stage() return a shared no-op context manager: the cost is a
+function call per operation. The worker processes inherit the setting through the environment and
+send their records back with take_records(), to be merged by the parent with merge_records().
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+MODE_TIMING = 'timing'
+MODE_CPROFILE = 'cprofile'
+PROFILE_MODES = [MODE_TIMING, MODE_CPROFILE]
+
+SUMMARY_FILE_NAME = "profile_summary.json"
+
+NO_OP = nullcontext()
+
+mode = {'True': MODE_TIMING, MODE_TIMING: MODE_TIMING, MODE_CPROFILE: MODE_CPROFILE}.get(os.getenv('__PROFILE__'))
+lock = threading.Lock()
+# operation -> [count, wall time, CPU time, longest wall time]
+operations = {}
+# stage -> [wall time, CPU time]
+stages = {}
+# stage -> list of cProfile.Profile
+profiles = {}
+# Stage profiled in cprofile mode, None for the first stage to start
+profiled_stage = None
+# Profile being recorded, None when the profiler is free
+active_profile = None
+# Stages not profiled because another stage was
+unprofiled_stages = set()
+
+
+def enable(profile_mode=MODE_TIMING, stage_name=None):
+    global mode, profiled_stage
+    mode = profile_mode
+    profiled_stage = stage_name
+    # Inherited by the worker processes
+    os.environ['__PROFILE__'] = profile_mode
+
+
+def is_enabled():
+    return mode is not None
+
+
+class OperationTimer:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.thread_time() - self.start_cpu
+        with lock:
+            record = operations.setdefault(self.name, [0, 0.0, 0.0, 0.0])
+            record[0] += 1
+            record[1] += wall
+            record[2] += cpu
+            record[3] = max(record[3], wall)
+
+
+def start_profile():
+    """
+    Returns:
+    cProfile.Profile: Profile started, None if another stage is being profiled.
+    """
+    global active_profile
+    with lock:
+        if active_profile is not None:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Profiler enabled by another tool
+            return None
+        active_profile = profile
+    return profile
+
+
+def stop_profile(profile):
+    global active_profile
+    profile.disable()
+    with lock:
+        active_profile = None
+
+
+class StageTimer:
+    def __init__(self, name):
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        if mode == MODE_CPROFILE and profiled_stage in (None, self.name):
+            self.profile = start_profile()
+            if self.profile is None:
+                with lock:
+                    unprofiled_stages.add(self.name)
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.thread_time() - self.start_cpu
+        if self.profile is not None:
+            stop_profile(self.profile)
+        with lock:
+            record = stages.setdefault(self.name, [0.0, 0.0])
+            record[0] += wall
+            record[1] += cpu
+            if self.profile is not None:
+                profiles.setdefault(self.name, []).append(self.profile)
+
+
+def measure(name):
+    """
+    Time a file operation: with measure('decode'): ...
+    """
+    if mode is None:
+        return NO_OP
+    return OperationTimer(name)
+
+
+def stage(name):
+    """
+    Time a stage, and profile it in cprofile mode. A stage runs in a single thread.
+    """
+    if mode is None:
+        return NO_OP
+    return StageTimer(name)
+
+
+def init_worker():
+    """
+    Start a worker process with empty records. A forked process inherits the records of its parent:
+    they would be sent back, and counted again, by every worker.
+    """
+    global lock, active_profile
+    # The lock may have been held by another thread of the parent when it forked
+    lock = threading.Lock()
+    active_profile = None
+    operations.clear()
+    stages.clear()
+    profiles.clear()
+    unprofiled_stages.clear()
+
+
+def take_records():
+    """
+    Records of the operations of this process since the last call, to send them to the parent process.
+    """
+    if mode is None:
+        return None
+    global operations
+    with lock:
+        records, operations = operations, {}
+    return records
+
+
+def merge_records(records):
+    if not records:
+        return
+    with lock:
+        for name, (count, wall, cpu, max_wall) in records.items():
+            record = operations.setdefault(name, [0, 0.0, 0.0, 0.0])
+            record[0] += count
+            record[1] += wall
+            record[2] += cpu
+            record[3] = max(record[3], max_wall)
+
+
+def get_summary():
+    with lock:
+        return {
+            'stages': {name: {'wall_s': round(wall, 3), 'cpu_s': round(cpu, 3)}
+                       for name, (wall, cpu) in stages.items()},
+            'operations': {name: {'count': count, 'wall_s': round(wall, 3), 'cpu_s': round(cpu, 3),
+                                  'mean_ms': round(wall * 1000 / count, 2), 'max_ms': round(max_wall * 1000, 2)}
+                           for name, (count, wall, cpu, max_wall) in operations.items()},
+            'not_profiled': sorted(unprofiled_stages),
+        }
+
+
+def format_summary(summary):
+    lines = [f"{'stage':24} {'wall s':>10} {'cpu s':>10}"]
+    for name, record in sorted(summary['stages'].items(), key=lambda item: -item[1]['wall_s']):
+        lines.append(f"{name:24} {record['wall_s']:10.2f} {record['cpu_s']:10.2f}")
+    lines.append(f"{'operation':24} {'count':>8} {'wall s':>10} {'cpu s':>10} {'mean ms':>10} {'max ms':>10}")
+    for name, record in sorted(summary['operations'].items(), key=lambda item: -item[1]['wall_s']):
+        lines.append(f"{name:24} {record['count']:8} {record['wall_s']:10.2f} {record['cpu_s']:10.2f} "
+                     f"{record['mean_ms']:10.2f} {record['max_ms']:10.2f}")
+    if summary['not_profiled']:
+        lines.append(f"Stages not profiled, another stage being profiled: {', '.join(summary['not_profiled'])}")
+    return lines
+
+
+def write_report(folder):
+    """
+    Write the summary, and the cProfile statistics of each stage, in a new sub-folder of folder.
+
+    Returns:
+    tuple: Folder of the report and lines of the summary table.
+    """
+    report_folder = os.path.join(folder, datetime.now().strftime("%Y-%m-%d_%H%M%S"))
+    os.makedirs(report_folder, exist_ok=True)
+    summary = get_summary()
+    with open(os.path.join(report_folder, SUMMARY_FILE_NAME), 'w') as f:
+        json.dump(summary, f, indent=2)
+    with lock:
+        stage_profiles = {name: list(stage_list) for name, stage_list in profiles.items()}
+    for name, stage_list in stage_profiles.items():
+        stats = pstats.Stats(stage_list[0])
+        for profile in stage_list[1:]:
+            stats.add(profile)
+        # Read with: python -m pstats profile_<stage>.prof
+        stats.dump_stats(os.path.join(report_folder, f"profile_{name}.prof"))
+    return report_folder, format_summary(summary)
+
+
+def reset():
+    with lock:
+        operations.clear()
+        stages.clear()
+        profiles.clear()
+        unprofiled_stages.clear()
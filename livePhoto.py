@@ -0,0 +1,200 @@
+"""
+Live Photos: the 2-3 s motion clip recorded with a photo.
+
+The phone stores a Live Photo as two files with the same name in the same folder, IMG_1234.HEIC and
+IMG_1234.MOV. The clips are paired with their photo as the files arrive, and placed next to the photo,
+with its name, once the photo is sorted, instead of being transcoded and named like a normal video:
+    2023-01-01_10-00-00.jpg
+    2023-01-01_10-00-00.mp4
+Policies of the clips:
+    remux    the streams are copied to an MP4 file, without transcoding. Clips which cannot be remuxed are archived
+    archive  the MOV file is moved as is
+    skip     the clip is not kept: it is deleted from the import folder, the original stays on the phone
+    convert  no pairing, the clips are converted like the other videos
+"""
+
+import os
+import threading
+import convertAndSort
+import mov_to_mp4
+from infoBoxMgmt import print_message_d
+from nameIndex import DestinationNameIndex
+from runJournal import OPERATION_VIDEO, STATE_PLACED
+from scanCache import FIELD_PROBE
+
+LIVE_POLICY_REMUX = 'remux'
+LIVE_POLICY_ARCHIVE = 'archive'
+LIVE_POLICY_SKIP = 'skip'
+LIVE_POLICY_CONVERT = 'convert'
+LIVE_POLICIES = [LIVE_POLICY_REMUX, LIVE_POLICY_ARCHIVE, LIVE_POLICY_SKIP, LIVE_POLICY_CONVERT]
+
+# Larger MOV files are never Live Photo clips: they are converted at once without waiting for a photo
+LIVE_CLIP_MAX_SIZE = 20 * 1024 * 1024
+
+
+def get_pair_key(file_path):
+    # Same folder and same name, whatever the extension and its case
+    return os.path.dirname(file_path), os.path.splitext(os.path.basename(file_path))[0].lower()
+
+
+class LivePhotoPairer:
+    """
+    Pairs the clips with their photo as the files arrive, in any order.
+
+    A clip is held until its photo is sorted. A small MOV file without photo is held until every
+    photo is sorted, as its photo may still arrive: it is then released by flush as a normal video.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Key -> final path of the photo, None while it is not sorted yet
+        self.photos = {}
+        # Key -> path of the clip waiting for its photo
+        self.held_clips = {}
+
+    def add_photo(self, photo_path):
+        with self.lock:
+            self.photos.setdefault(get_pair_key(photo_path), None)
+
+    def add_clip(self, mov_path, size=None):
+        """
+        Returns:
+        tuple: (clip path, final path of its photo) to place at once, (clip path, None) to convert it
+               as a normal video, None when it is held.
+        """
+        key = get_pair_key(mov_path)
+        with self.lock:
+            if key in self.photos:
+                if self.photos[key] is not None:
+                    return mov_path, self.photos[key]
+                self.held_clips[key] = mov_path
+                return None
+            if size is None:
+                try:
+                    size = os.path.getsize(mov_path)
+                except OSError:
+                    size = 0
+            if size > LIVE_CLIP_MAX_SIZE:
+                return mov_path, None
+            self.held_clips[key] = mov_path
+            return None
+
+    def photo_done(self, photo_path, placed_path):
+        """
+        Record where a photo was sorted, None if it was not sorted (failed or without capture date).
+
+        Returns:
+        tuple: (clip path, placed_path) of its held clip, None if the clip did not arrive yet.
+        """
+        key = get_pair_key(photo_path)
+        with self.lock:
+            if placed_path is None:
+                # The clip is converted as a normal video
+                self.photos.pop(key, None)
+            else:
+                self.photos[key] = placed_path
+            clip_path = self.held_clips.pop(key, None)
+        if clip_path is None:
+            return None
+        return clip_path, placed_path
+
+    def flush(self):
+        """
+        Release the clips still held once every photo is sorted: their photo did not arrive.
+
+        Returns:
+        list: Paths of the clips, to convert as normal videos.
+        """
+        with self.lock:
+            released = list(self.held_clips.values())
+            self.held_clips.clear()
+        return released
+
+
+def remux_clip(mov_path, mp4_path, runner, scan_cache=None):
+    """
+    Copy the streams of a clip to an MP4 file, if MP4 can hold their codecs.
+
+    Returns:
+    bool: True if the MP4 file was written.
+    """
+    try:
+        if scan_cache is None:
+            codecs = mov_to_mp4.probe_streams(mov_path)
+        else:
+            codecs = scan_cache.lookup(mov_path, FIELD_PROBE, mov_to_mp4.probe_streams)
+    except Exception as e:
+        print_message_d(f"Cannot probe {mov_path}: {e}")
+        return False
+    if not mov_to_mp4.can_remux_to_mp4(codecs):
+        return False
+    return mov_to_mp4.run_ffmpeg(mov_to_mp4.build_remux_command(mov_path, mp4_path, codecs['video'][0]),
+                                 mov_path, runner)
+
+
+def place_clip(mov_path, photo_path, policy, runner=None, name_index=None, journal=None, scan_cache=None):
+    """
+    Place a Live Photo clip next to its sorted photo, with the name of the photo.
+
+    Args:
+    mov_path (str): Path of the clip in the import folder.
+    photo_path (str): Final path of its photo.
+    policy (str): LIVE_POLICY_REMUX, LIVE_POLICY_ARCHIVE or LIVE_POLICY_SKIP.
+
+    Returns:
+    tuple: Status, method used ('remux', 'archive' or 'skip') and path of the placed clip.
+    """
+    if policy == LIVE_POLICY_SKIP:
+        os.remove(mov_path)
+        return 'STATUS_SUCCESS', LIVE_POLICY_SKIP, None
+
+    if name_index is None:
+        name_index = DestinationNameIndex()
+    folder = os.path.dirname(photo_path)
+    base_name = os.path.splitext(os.path.basename(photo_path))[0]
+    if policy == LIVE_POLICY_REMUX:
+        if runner is None:
+            runner = mov_to_mp4.FfmpegJobRunner(max_jobs=1)
+        mp4_name = base_name + '.mp4'
+        mp4_path = name_index.reserve(folder, mp4_name)
+        operation_id = journal.begin(OPERATION_VIDEO, mov_path, mp4_path) if journal is not None else None
+        if remux_clip(mov_path, mp4_path, runner, scan_cache):
+            duplicate_path = name_index.place_if_duplicate(mp4_path, folder, mp4_name, reserved_path=mp4_path)
+            if duplicate_path is not None:
+                mp4_path = duplicate_path
+            else:
+                name_index.commit(mp4_path)
+            if journal is not None:
+                journal.update(operation_id, STATE_PLACED, destination=mp4_path)
+            os.remove(mov_path)
+            if journal is not None:
+                journal.finish(operation_id)
+            return 'STATUS_SUCCESS', LIVE_POLICY_REMUX, mp4_path
+        # Remux only: a clip which cannot be remuxed is kept as is
+        if os.path.exists(mp4_path):
+            os.remove(mp4_path)
+        name_index.release(mp4_path)
+        if journal is not None:
+            journal.finish(operation_id)
+        print_message_d(f"Cannot remux {mov_path}, archiving it")
+
+    clip_path = convertAndSort.move_file_with_unique_name(mov_path, folder, name_index, journal,
+                                                          filename=base_name + os.path.splitext(mov_path)[1].lower())
+    return 'STATUS_SUCCESS', LIVE_POLICY_ARCHIVE, clip_path
+
+
+def place_clip_with_size(mov_path, photo_path, policy, runner=None, name_index=None, journal=None, scan_cache=None):
+    """
+    Same as place_clip, also returning the sizes of the clip and of the placed file for the progress report.
+    """
+    try:
+        bytes_read = os.path.getsize(mov_path)
+    except OSError:
+        bytes_read = 0
+    try:
+        result = place_clip(mov_path, photo_path, policy, runner, name_index, journal, scan_cache)
+    except Exception as e:
+        print_message_d(f"Error placing Live Photo clip {mov_path}: {e}")
+        return ('STATUS_ERROR', None, None), bytes_read, 0
+    bytes_written = os.path.getsize(result[2]) if result[2] is not None else 0
+    return result, bytes_read, bytes_written
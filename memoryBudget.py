@@ -0,0 +1,100 @@
+"""
+Memory budget of the HEIC conversions.
+
+A decoded photo takes width x height x bytes per pixel: about 40 MB for a 12 MP photo, but 150 MB
+and more for a 48 MP one, plus the buffers of the decoder and the JPEG encoder. The size of each
+photo is read from its HEIF header before it is submitted, and a conversion is only started when
+its estimated memory fits in the budget with the ones already running: big photos run with fewer
+neighbours, small ones are packed densely.
+"""
+
+import os
+import threading
+from heifReader import read_heif_size
+
+# Estimated peak memory per pixel: YCbCr planes of the decoder, RGB image and JPEG encoder buffers
+BYTES_PER_PIXEL = 8
+# Size assumed when the header cannot be read: a 12 MP photo
+DEFAULT_PIXELS = 4032 * 3024
+# Default budget: part of the physical memory
+DEFAULT_BUDGET_RATIO = 0.5
+
+
+def estimate_decode_memory(heic_path):
+    """
+    Estimated peak memory of the conversion of a HEIC file, in bytes.
+    """
+    try:
+        width, height = read_heif_size(heic_path)
+        pixels = width * height
+    except (OSError, ValueError):
+        pixels = DEFAULT_PIXELS
+    return pixels * BYTES_PER_PIXEL
+
+
+def get_physical_memory():
+    """
+    Returns:
+    int: Physical memory in bytes, None when it cannot be read.
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        # Windows
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys
+    except (AttributeError, OSError):
+        pass
+    return None
+
+
+def get_default_budget():
+    physical_memory = get_physical_memory()
+    if physical_memory is None:
+        return None
+    return int(physical_memory * DEFAULT_BUDGET_RATIO)
+
+
+class MemoryBudget:
+    def __init__(self, budget_bytes=None):
+        """
+        Args:
+        budget_bytes (int): Memory shared by the conversions in flight, the default budget if None,
+                            no limit if 0 or if the physical memory is unknown.
+        """
+        if budget_bytes is None:
+            budget_bytes = get_default_budget()
+        self.budget_bytes = budget_bytes or None
+        self.used_bytes = 0
+        self.peak_bytes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, cost):
+        """
+        Wait until cost bytes fit in the budget. A conversion bigger than the whole budget
+        is admitted alone.
+        """
+        with self.condition:
+            if self.budget_bytes is not None:
+                self.condition.wait_for(lambda: self.used_bytes == 0
+                                        or self.used_bytes + cost <= self.budget_bytes)
+            self.used_bytes += cost
+            self.peak_bytes = max(self.peak_bytes, self.used_bytes)
+
+    def release(self, cost):
+        with self.condition:
+            self.used_bytes -= cost
+            self.condition.notify_all()
@@ -0,0 +1,46 @@
+"""
+Base of the SQLite databases of the .metadata folder: import ledger, run journal and scan cache.
+
+Each database has a single connection, shared by the threads of a run and serialized by a lock.
+It is opened in WAL mode, and its tables are created the first time it is opened.
+"""
+
+import os
+import sqlite3
+import threading
+
+
+class MetadataDatabase:
+    # Name of the database file in the metadata folder
+    file_name = None
+    # Statements creating the tables, if they do not exist
+    schema = []
+    # PRAGMA synchronous value, None for the SQLite default (FULL)
+    synchronous = None
+
+    def __init__(self, metadata_folder):
+        self.metadata_folder = metadata_folder
+        self.db_path = os.path.join(metadata_folder, self.file_name)
+        # Connection shared by the threads, serialized by the lock
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            if self.synchronous is not None:
+                self.connection.execute(f"PRAGMA synchronous={self.synchronous}")
+            for statement in self.schema:
+                self.connection.execute(statement)
+
+    def count(self, table):
+        with self.lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
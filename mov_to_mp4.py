@@ -1,8 +1,17 @@
 import subprocess
+import json
 import re
 import os
-import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from infoBoxMgmt import print_message, print_message_d
+from progress import ProgressTracker
+from nameIndex import DestinationNameIndex
+from runJournal import OPERATION_VIDEO, STATE_PLACED
+from scanCache import FIELD_CAPTURE_DATE, FIELD_PROBE
+from treeScanner import scan_tree, KIND_VIDEO
+from instrumentation import measure
 
 # def convert_mov_to_mp4(mov_file_path):
 
@@ -11,93 +20,413 @@ from infoBoxMgmt import print_message, print_message_d
 #     mov_file_path = 'D:\\Projects\\iGetMyPhotos\\TestFolder\\FilesIn\\202405__\\IMG_7153.MOV'  # Specify the path to your .MOV file
 #     convert_mov_to_mp4(mov_file_path)
 
-def convert_one_file(mov_file_path, output_quality, mp4_path):
-    command = f"ffmpeg -i {mov_file_path} -c:v mpeg4 -q:v {output_quality} -c:a aac -n {mp4_path}"
-    # command = f"ffmpeg -i {mov_file_path} -vcodec libx264 -crf {output_quality} -acodec aac -n {mp4_path}"
-    print_message_d(f'Convert file {mov_file_path}, with quality {output_quality}, to {mp4_path}')
-    try:
-        e = subprocess.run(command, 
+# Default number of parallel ffmpeg processes and of threads shared between them
+DEFAULT_THREAD_BUDGET = os.cpu_count() or 1
+DEFAULT_MAX_JOBS = max(1, DEFAULT_THREAD_BUDGET // 2)
+
+# Seconds after which an ffmpeg job is killed: far above the conversion of the longest phone videos,
+# it only stops a hung ffmpeg process, whose video is then converted again by the next run
+DEFAULT_JOB_TIMEOUT = 2 * 3600
+# Seconds after which reading the streams or the creation time of a video is given up
+PROBE_TIMEOUT = 60
+
+# Number of stderr lines kept to report a failed job
+STDERR_TAIL_LINES = 20
+
+# Codecs that can be copied from a MOV to an MP4 container without re-encoding
+MP4_VIDEO_CODECS = ['h264', 'hevc', 'mpeg4', 'av1']
+MP4_AUDIO_CODECS = ['aac', 'mp3', 'alac', 'ac3', 'eac3']
+
+
+class FfmpegJobRunner:
+    """
+    Runs several ffmpeg processes at once, splitting a thread budget between them.
+    """
+    def __init__(self, max_jobs=None, thread_budget=None, timeout=None):
+        self.max_jobs = max_jobs if max_jobs else DEFAULT_MAX_JOBS
+        self.thread_budget = thread_budget if thread_budget else DEFAULT_THREAD_BUDGET
+        # jobs x threads stays within the budget
+        self.threads_per_job = max(1, self.thread_budget // self.max_jobs)
+        # None: default timeout, 0: no timeout
+        self.timeout = timeout if timeout is not None else DEFAULT_JOB_TIMEOUT
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.processes = set()
+
+    def run_command(self, command, timeout=None):
+        """
+        Run a command, streaming its stderr to the debug log.
+
+        Args:
+        command (list): Command and arguments.
+        timeout (float): Seconds after which the process is killed, None to use the runner timeout.
+
+        Returns:
+        tuple: Return code (None if killed or cancelled) and the last lines of stderr.
+        """
+        if self.stopped.is_set():
+            return None, ['Cancelled']
+        with measure('ffmpeg'):
+            return self._run_process(command, timeout)
+
+    def _run_process(self, command, timeout):
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE, text=True, errors='replace')
+        with self.lock:
+            self.processes.add(process)
+        timeout = timeout if timeout is not None else self.timeout
+        timed_out = threading.Event()
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, lambda: (timed_out.set(), process.kill()))
+            timer.start()
+        stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        try:
+            for line in process.stderr:
+                line = line.rstrip()
+                if line:
+                    stderr_tail.append(line)
+                    print_message_d('ffmpeg: ' + line)
+            process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with self.lock:
+                self.processes.discard(process)
+        if timed_out.is_set():
+            stderr_tail.append(f"Timeout after {timeout} s")
+            return None, list(stderr_tail)
+        if process.returncode != 0 and self.stopped.is_set():
+            return None, list(stderr_tail)
+        return process.returncode, list(stderr_tail)
+
+    def map(self, function, items):
+        """
+        Call function on each item with max_jobs worker threads.
+
+        Yields:
+        tuple: Item and result of the call, in completion order.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+            future_to_item = {executor.submit(self._call_if_running, function, item): item for item in items}
+            try:
+                for future in as_completed(future_to_item):
+                    yield future_to_item[future], future.result()
+            except BaseException:
+                # Ctrl-C or error of the caller: do not leave ffmpeg processes behind
+                self.cancel()
+                raise
+
+    def _call_if_running(self, function, item):
+        if self.stopped.is_set():
+            return 'STATUS_CANCELLED'
+        return function(item)
+
+    def stop(self):
+        """
+        Do not start new jobs, running ones end normally.
+        """
+        self.stopped.set()
+
+    def cancel(self):
+        """
+        Do not start new jobs and kill the running ffmpeg processes.
+        """
+        self.stopped.set()
+        with self.lock:
+            for process in self.processes:
+                process.kill()
+
+
+def build_ffmpeg_command(mov_file_path, output_quality, mp4_path, threads=None):
+    command = ['ffmpeg', '-nostdin', '-hide_banner', '-i', mov_file_path,
+               '-c:v', 'mpeg4', '-q:v', str(output_quality), '-c:a', 'aac']
+    # command = ['ffmpeg', '-i', mov_file_path, '-vcodec', 'libx264', '-crf', str(output_quality), '-acodec', 'aac']
+    if threads:
+        command += ['-threads', str(threads)]
+    # The destination name is reserved in the name index before the conversion
+    command += ['-y', mp4_path]
+    return command
+
+
+def build_remux_command(mov_file_path, mp4_path, video_codec):
+    # Only the main video and the audio streams: MP4 cannot hold the QuickTime metadata/timecode tracks
+    command = ['ffmpeg', '-nostdin', '-hide_banner', '-i', mov_file_path,
+               '-map', '0:v:0', '-map', '0:a?', '-c', 'copy', '-map_metadata', '0']
+    if video_codec == 'hevc':
+        # Tag HEVC as hvc1 so that Apple and Windows players recognize it
+        command += ['-tag:v', 'hvc1']
+    command += ['-y', mp4_path]
+    return command
+
+
+def probe_streams(mov_file_path):
+    """
+    List the codecs of a video file with ffprobe.
+
+    Returns:
+    dict: codec_type ('video', 'audio'...) -> list of codec names.
+    """
+    with measure('ffprobe'):
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'stream=codec_type,codec_name', '-of', 'json', mov_file_path],
+            stdin=subprocess.DEVNULL,
             stderr=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            text=True)
-    except subprocess.CalledProcessError as e:
-        print_message(f"Error executing command : {e}")
+            text=True,
+            timeout=PROBE_TIMEOUT
+        )
+    if result.returncode != 0:
+        raise Exception(f"ffprobe failed: {result.stderr.strip()}")
+    codecs = {}
+    for stream in json.loads(result.stdout).get('streams', []):
+        codecs.setdefault(stream.get('codec_type'), []).append(stream.get('codec_name'))
+    return codecs
 
-    print_message_d('stderr: ' + e.stderr)
-    print_message_d('stdout: ' + e.stdout)
 
-def get_creation_time(file_path):
+def can_remux_to_mp4(codecs):
+    """
+    Check if the main video stream and the audio streams can be copied as-is into an MP4 file.
+    """
+    video_codecs = codecs.get('video', [])
+    if len(video_codecs) == 0 or video_codecs[0] not in MP4_VIDEO_CODECS:
+        return False
+    return all(codec in MP4_AUDIO_CODECS for codec in codecs.get('audio', []))
+
+
+def run_ffmpeg(command, mov_file_path, runner):
     try:
-        # Exécuter la commande ffmpeg pour obtenir les informations du fichier
+        returncode, stderr_tail = runner.run_command(command)
+    except OSError as e:
+        print_message(f"Error executing command : {e}")
+        return False
+    if returncode != 0:
+        status = 'killed' if returncode is None else f'exit code {returncode}'
+        print_message(f"ffmpeg failed on {mov_file_path} ({status}): " + ' | '.join(stderr_tail[-3:]))
+        return False
+    return True
+
+
+def convert_one_file(mov_file_path, output_quality, mp4_path, runner=None, video_mode='transcode', scan_cache=None):
+    """
+    Convert a MOV file to MP4.
+
+    Args:
+    video_mode (str): 'transcode' always re-encodes the video,
+                      'auto' copies the streams when MP4 can hold their codecs, and transcodes otherwise.
+    scan_cache (ScanCache): Codecs of the files already probed by a previous run.
+
+    Returns:
+    str: 'remux' or 'transcode', the method used, None if the conversion failed.
+    """
+    if runner is None:
+        runner = FfmpegJobRunner(max_jobs=1)
+    if video_mode == 'auto':
+        try:
+            if scan_cache is None:
+                codecs = probe_streams(mov_file_path)
+            else:
+                codecs = scan_cache.lookup(mov_file_path, FIELD_PROBE, probe_streams)
+        except Exception as e:
+            print_message_d(f"Cannot probe {mov_file_path}, transcoding it: {e}")
+            codecs = {}
+        if can_remux_to_mp4(codecs):
+            print_message_d(f'Remux file {mov_file_path} ({codecs}) to {mp4_path}')
+            if run_ffmpeg(build_remux_command(mov_file_path, mp4_path, codecs['video'][0]), mov_file_path, runner):
+                return 'remux'
+            print_message_d(f'Remux failed, transcoding {mov_file_path}')
+    command = build_ffmpeg_command(mov_file_path, output_quality, mp4_path, runner.threads_per_job)
+    print_message_d(f'Convert file {mov_file_path}, with quality {output_quality}, to {mp4_path}')
+    if run_ffmpeg(command, mov_file_path, runner):
+        return 'transcode'
+    return None
+
+
+def read_creation_time(file_path):
+    """
+    Read the creation time of a video with ffmpeg. Raises an exception if ffmpeg cannot be run,
+    or does not end within PROBE_TIMEOUT seconds.
+
+    Returns:
+    list: Date and time of the creation, None if the video has none.
+    """
+    # Exécuter la commande ffmpeg pour obtenir les informations du fichier
+    with measure('ffmpeg_info'):
         result = subprocess.run(
-            ['ffmpeg', '-i', file_path],
+            ['ffmpeg', '-nostdin', '-i', file_path],
+            stdin=subprocess.DEVNULL,
             stderr=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            text=True
+            text=True,
+            timeout=PROBE_TIMEOUT
         )
 
-        print_message_d('stderr: ' + result.stderr)
-        print_message_d('stdout: ' + result.stdout)
-        
-        creation_time_match = re.search(r'creationdate\s*: (\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})', result.stderr)
+    print_message_d('stderr: ' + result.stderr)
+    print_message_d('stdout: ' + result.stdout)
 
-        if not creation_time_match:
-            creation_time_match = re.search(r'creation_time\s*: (\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})', result.stderr)
+    creation_time_match = re.search(r'creationdate\s*: (\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})', result.stderr)
 
-        if creation_time_match:
-            creation_time = creation_time_match.group(1)
-            print_message_d(f"Creation Time: {creation_time}")
-            return creation_time[:19].split('T')
-        else:
-            print_message_d("Creation time not found in the output.")
-            return None
+    if not creation_time_match:
+        creation_time_match = re.search(r'creation_time\s*: (\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})', result.stderr)
 
+    if creation_time_match:
+        creation_time = creation_time_match.group(1)
+        print_message_d(f"Creation Time: {creation_time}")
+        return creation_time[:19].split('T')
+    else:
+        print_message_d("Creation time not found in the output.")
+        return None
+
+def get_creation_time(file_path, scan_cache=None):
+    try:
+        if scan_cache is None:
+            return read_creation_time(file_path)
+        return scan_cache.lookup(file_path, FIELD_CAPTURE_DATE, read_creation_time)
     except Exception as e:
         print_message(f"Erreur lors de la récupération des informations du fichier : {e}")
 
-def convert_mov_to_mp4(mov_file_path, destination_folder, output_quality ):
+def get_dated_video_path(destination_folder, video_info):
+    """
+    Build the sorted path of a video from its creation time: <destination>/<year>/<YYYY-MM-DD_HH-MM-SS>.mp4.
+
+    Returns:
+    tuple: Year folder and file name.
+    """
+    year = video_info[0][:4]
+    new_filename = f"{video_info[0]}_{video_info[1].replace(':', '-')}.mp4"
+    return os.path.join(destination_folder, year), new_filename
+
+def convert_mov_to_mp4(mov_file_path, destination_folder, output_quality, runner=None, video_mode='transcode'):
+    status, _, _ = convert_mov_file(mov_file_path, destination_folder, output_quality, runner, video_mode)
+    return status
+
+
+def convert_mov_file(mov_file_path, destination_folder, output_quality, runner=None, video_mode='transcode',
+                     name_index=None, journal=None, scan_cache=None):
+    """
+    Convert a MOV file to MP4, named and sorted by its creation time.
+    With a journal, an MP4 left incomplete by an interrupted run is deleted by the next run.
+    With a scan cache, a MOV already probed by a previous run is not probed again.
+
+    Returns:
+    tuple: Status, method used ('remux' or 'transcode', None on error) and path of the MP4 file.
+    """
     try:
-        video_info = get_creation_time(mov_file_path)
+        video_info = get_creation_time(mov_file_path, scan_cache)
     except Exception as e:
         print_message(f"Error while getting video info : {e}")
-        return 'STATUS_ERROR'
-    
+        return 'STATUS_ERROR', None, None
+    if video_info is None:
+        print_message(f"Creation time not found for {mov_file_path}")
+        return 'STATUS_ERROR', None, None
+
     print_message_d(video_info[0] + video_info[1])
     # output_path = video_info[0] + '_' + video_info[1].replace(':', '-') + '.mp4'
 
-    year = video_info[0][:4]
-    new_filename = f"{video_info[0]}_{video_info[1].replace(':', '-')}.mp4"
-
-    year_folder = os.path.join(destination_folder, year)
+    year_folder, new_filename = get_dated_video_path(destination_folder, video_info)
     try:
-        if not os.path.exists(year_folder):
-            os.makedirs(year_folder)
+        os.makedirs(year_folder, exist_ok=True)
+        if name_index is None:
+            name_index = DestinationNameIndex()
+        mp4_path = name_index.reserve(year_folder, new_filename)
     except Exception as e:
         print_message(f"Error while creating directory : {e}")
-        return 'STATUS_ERROR'
-
-    mp4_path = os.path.join(year_folder, new_filename)
-    base_name, extension = os.path.splitext(os.path.basename(mp4_path))
-    # Check if the file already exists in the destination directory
-    counter = 1
-    while os.path.exists(mp4_path):
-        mp4_path = os.path.join(year_folder, f"{base_name}_{counter}{extension}")
-        counter += 1
+        return 'STATUS_ERROR', None, None
 
+    operation_id = None
+    placed = False
     try:
-        convert_one_file(mov_file_path, output_quality, mp4_path)
+        if journal is not None:
+            operation_id = journal.begin(OPERATION_VIDEO, mov_file_path, mp4_path)
+        method = convert_one_file(mov_file_path, output_quality, mp4_path, runner, video_mode, scan_cache)
+        if method is None:
+            if os.path.exists(mp4_path):
+                os.remove(mp4_path)
+            name_index.release(mp4_path)
+            if journal is not None:
+                journal.finish(operation_id)
+            return 'STATUS_ERROR', None, None
+        print_message_d(f"{os.path.basename(mov_file_path)}: {method} to {mp4_path}")
+        # Same video converted by a previous run
+        duplicate_path = name_index.place_if_duplicate(mp4_path, year_folder, new_filename, reserved_path=mp4_path)
+        if duplicate_path is not None:
+            print_message_d(f"{mp4_path} is identical to {duplicate_path}")
+            mp4_path = duplicate_path
+        else:
+            name_index.commit(mp4_path)
+        placed = True
+        if journal is not None:
+            journal.update(operation_id, STATE_PLACED, destination=mp4_path)
         os.remove(mov_file_path)
+        if journal is not None:
+            journal.finish(operation_id)
     except Exception as e:  
         print_message(f"Error while converting file : {e}")
-        return 'STATUS_ERROR'
-    return 'STATUS_SUCCESS'
+        if not placed:
+            # Same as a failed conversion: the MOV is converted again by the next run
+            try:
+                if os.path.exists(mp4_path):
+                    os.remove(mp4_path)
+            except OSError as remove_error:
+                print_message_d(f"Cannot delete {mp4_path}: {remove_error}")
+            name_index.release(mp4_path)
+        return 'STATUS_ERROR', None, None
+    return 'STATUS_SUCCESS', method, mp4_path
+
+
+def convert_mov_file_with_size(mov_file_path, destination_folder, output_quality, runner=None, video_mode='transcode',
+                               name_index=None, journal=None, scan_cache=None):
+    """
+    Same as convert_mov_file, also returning the sizes of the MOV and MP4 files for the progress report.
+    """
+    try:
+        bytes_read = os.path.getsize(mov_file_path)
+    except OSError:
+        bytes_read = 0
+    result = convert_mov_file(mov_file_path, destination_folder, output_quality, runner, video_mode, name_index, journal,
+                              scan_cache)
+    bytes_written = os.path.getsize(result[2]) if result[0] == 'STATUS_SUCCESS' else 0
+    return result, bytes_read, bytes_written
+
 
+def convert_mov_files(mov_files, destination_folder, output_quality, runner, video_mode='transcode'):
+    """
+    Convert MOV files in parallel. After the first error, no new conversion is started.
+
+    Returns:
+    tuple: Number of converted files and status.
+    """
+    num_converted = 0
+    methods = {'remux': 0, 'transcode': 0}
+    status = 'STATUS_SUCCESS'
+    tracker = ProgressTracker('video')
+    tracker.plan(len(mov_files))
+    name_index = DestinationNameIndex()
+    for mov_file, result in runner.map(
+            lambda path: convert_mov_file_with_size(path, destination_folder, output_quality, runner, video_mode,
+                                                    name_index),
+            mov_files):
+        if result == 'STATUS_CANCELLED':
+            continue
+        (file_status, method, _), bytes_read, bytes_written = result
+        tracker.advance(file_status == 'STATUS_SUCCESS', bytes_read, bytes_written)
+        if file_status == 'STATUS_SUCCESS':
+            num_converted += 1
+            methods[method] += 1
+        else:
+            print_message(f"Error converting file {mov_file}")
+            status = 'STATUS_ERROR'
+            runner.stop()
+    tracker.finish()
+    if video_mode == 'auto':
+        print_message(f"{methods['remux']} videos remuxed, {methods['transcode']} videos transcoded")
+    return num_converted, status
 
 
-def convert_folder_mov_to_mp4(input_folder, destination_folder, output_quality=10):
+def convert_folder_mov_to_mp4(input_folder, destination_folder, output_quality=10, runner=None, video_mode='transcode'):
     
     if not os.path.isdir(input_folder):
-        print_message("Directory '%s' does not exist.", input_folder)
+        print_message(f"Directory '{input_folder}' does not exist.")
         return 0, 'STATUS_NO_DIR'
 
     mov_files = [file for file in os.listdir(input_folder) if file.lower().endswith(".mov")]
@@ -110,24 +439,41 @@ def convert_folder_mov_to_mp4(input_folder, destination_folder, output_quality=1
         print_message_d(f"Number of files to convert: {total_files}")
 
     # Convert files
-    num_converted = 0
-    for mov_file in mov_files:
-        if convert_mov_to_mp4(os.path.join(input_folder, mov_file), destination_folder, output_quality) != 'STATUS_SUCCESS':
-            print_message(f"Error converting file {mov_file}")
-            return num_converted, 'STATUS_ERROR' 
-        num_converted += 1
+    if runner is None:
+        runner = FfmpegJobRunner()
+    num_converted, status = convert_mov_files([os.path.join(input_folder, mov_file) for mov_file in mov_files],
+                                              destination_folder, output_quality, runner, video_mode)
+    if status != 'STATUS_SUCCESS':
+        return num_converted, status
 
     print_message(f"Conversion completed successfully. {num_converted} files converted from {input_folder}")
     return num_converted, 'STATUS_SUCCESS'
 
-def convert_all_mov_to_mp4(in_folder, out_folder, mp4quality):
-    total_num_converted = 0
-    for root, _, _ in os.walk(in_folder):
-        if not os.path.basename(root).startswith('.') or root == in_folder:
-            num_converted, status = convert_folder_mov_to_mp4(root, out_folder, mp4quality)
-            total_num_converted += num_converted
-            if status != 'STATUS_SUCCESS':
-                print_message(f"Error converting files in {root}. {total_num_converted} files converted")
-                return status
+def convert_all_mov_to_mp4(in_folder, out_folder, mp4quality, max_jobs=None, thread_budget=None, timeout=None,
+                           video_mode='transcode', manifest=None):
+    """
+    Convert all MOV files of a directory tree, running several ffmpeg processes at once.
+
+    Args:
+    in_folder (str): Root of the directory tree.
+    out_folder (str): Destination folder, the videos are sorted in year subfolders.
+    mp4quality (int): ffmpeg -q:v value (1-31, 1 is higher quality).
+    max_jobs (int): Number of parallel ffmpeg processes.
+    thread_budget (int): Total number of ffmpeg threads, split between the jobs.
+    timeout (float): Seconds after which a single conversion is killed, None for the default, 0 for no limit.
+    video_mode (str): 'transcode' re-encodes every video, 'auto' copies the streams when MP4 can hold them.
+    manifest (Manifest): Scan of in_folder shared by the stages, scanned here if not given.
+    """
+    if manifest is None:
+        manifest = scan_tree(in_folder)
+    mov_files = manifest.get_files(KIND_VIDEO)
+    print_message_d(f"Number of files to convert: {len(mov_files)}")
+
+    runner = FfmpegJobRunner(max_jobs, thread_budget, timeout)
+    print_message_d(f"Running {runner.max_jobs} ffmpeg jobs with {runner.threads_per_job} threads each")
+    total_num_converted, status = convert_mov_files(mov_files, out_folder, mp4quality, runner, video_mode)
+    if status != 'STATUS_SUCCESS':
+        print_message(f"Error converting files in {in_folder}. {total_num_converted} files converted")
+        return status
     print_message(f'Operation completed. {total_num_converted} files converted')
     return 'STATUS_SUCCESS'
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+In-memory index of the file names of the destination folders.
+
+Each folder is listed once, the first time a name is needed in it. Unique names
+(name.ext, name_1.ext, name_2.ext...) are then reserved in memory, under a lock, so that
+parallel workers never choose the same name and no stat call is made per candidate name.
+
+The index is created for one run: files added to the destination by other programs
+during the run are not seen.
+
+When the wanted name is already used, the incoming file is compared with the files named
+name.ext, name_1.ext... and, depending on the duplicate policy, an identical file is
+skipped or hard linked instead of being written again.
+"""
+
+import os
+import threading
+from dedup import FileHashCache, files_identical, POLICY_KEEP, POLICY_SKIP, POLICY_LINK
+from instrumentation import measure
+
+
+class DestinationNameIndex:
+    def __init__(self, duplicate_policy=POLICY_SKIP):
+        self.lock = threading.Lock()
+        # folder -> set of normalized names
+        self.names_by_folder = {}
+        # (folder, normalized base name, extension) -> next suffix to try
+        self.next_suffix = {}
+        # Reserved names whose file is not completely written yet
+        self.pending = set()
+        self.duplicate_policy = duplicate_policy
+        self.hash_cache = FileHashCache()
+        self.duplicates = {POLICY_SKIP: 0, POLICY_LINK: 0}
+
+    def _get_folder_names(self, folder):
+        names = self.names_by_folder.get(folder)
+        if names is None:
+            names = set()
+            if os.path.isdir(folder):
+                with os.scandir(folder) as entries:
+                    names = {os.path.normcase(entry.name) for entry in entries}
+            self.names_by_folder[folder] = names
+        return names
+
+    def reserve(self, folder, filename):
+        """
+        Reserve a unique name in a folder, adding _1, _2... to filename if it is already used.
+
+        Args:
+        folder (str): Destination folder.
+        filename (str): Wanted file name.
+
+        Returns:
+        str: Path of the reserved name. The file itself is not created.
+        """
+        base_name, extension = os.path.splitext(filename)
+        with self.lock:
+            names = self._get_folder_names(folder)
+            key = os.path.normcase(filename)
+            if key not in names:
+                names.add(key)
+                self.pending.add(os.path.join(folder, filename))
+                return os.path.join(folder, filename)
+            # Burst photos share the same name: start from the last suffix given for this name
+            suffix_key = (folder, os.path.normcase(base_name), extension)
+            counter = self.next_suffix.get(suffix_key, 1)
+            while True:
+                new_filename = f"{base_name}_{counter}{extension}"
+                counter += 1
+                key = os.path.normcase(new_filename)
+                if key not in names:
+                    names.add(key)
+                    self.next_suffix[suffix_key] = counter
+                    self.pending.add(os.path.join(folder, new_filename))
+                    return os.path.join(folder, new_filename)
+
+    def release(self, path):
+        """
+        Free a reserved name, when the file could not be written.
+        """
+        folder, filename = os.path.split(path)
+        with self.lock:
+            self.pending.discard(path)
+            names = self.names_by_folder.get(folder)
+            if names is not None:
+                names.discard(os.path.normcase(filename))
+
+    def commit(self, path):
+        """
+        Mark a reserved name as completely written: it can be compared with incoming files.
+        """
+        with self.lock:
+            self.pending.discard(path)
+
+    def get_variants(self, folder, filename):
+        """
+        Paths of the complete files named filename, or filename with a _N suffix, in a folder.
+        """
+        base_name, extension = os.path.splitext(filename)
+        variants = []
+        with self.lock:
+            names = self._get_folder_names(folder)
+            if os.path.normcase(filename) not in names:
+                return variants
+            candidate, counter = filename, 1
+            max_counter = self.next_suffix.get((folder, os.path.normcase(base_name), extension), 1)
+            # Released names can leave holes below the last suffix given
+            while os.path.normcase(candidate) in names or counter < max_counter:
+                path = os.path.join(folder, candidate)
+                if os.path.normcase(candidate) in names and path not in self.pending:
+                    variants.append(path)
+                candidate = f"{base_name}_{counter}{extension}"
+                counter += 1
+        return variants
+
+    def find_duplicate(self, file_path, folder, filename, content_paths=None):
+        """
+        Find a file of the folder with the same content as file_path, among the variants of filename.
+
+        Args:
+        content_paths (dict): Path in the folder -> file holding its content, for the names of files
+                              not moved there yet (dry run).
+
+        Returns:
+        str: Path of the identical file, None if there is none or if the policy keeps duplicates.
+        """
+        if self.duplicate_policy == POLICY_KEEP:
+            return None
+        for variant in self.get_variants(folder, filename):
+            content_path = content_paths.get(variant, variant) if content_paths else variant
+            if content_path == file_path:
+                continue
+            try:
+                with measure('dedup_hash'):
+                    identical = files_identical(file_path, content_path, self.hash_cache)
+                if identical:
+                    return variant
+            except OSError:
+                # Deleted or unreadable: not a duplicate
+                continue
+        return None
+
+    def place_if_duplicate(self, file_path, folder, filename, reserved_path=None):
+        """
+        If file_path is identical to a file of the folder, skip or link it according to the policy.
+
+        Args:
+        file_path (str): Incoming file, deleted if it is a duplicate.
+        folder (str): Destination folder.
+        filename (str): Wanted file name.
+        reserved_path (str): Name already reserved for the incoming file, if any.
+
+        Returns:
+        str: Path where the content is in the destination, None if file_path is not a duplicate.
+        """
+        duplicate = self.find_duplicate(file_path, folder, filename)
+        if duplicate is None:
+            return None
+        if self.duplicate_policy == POLICY_LINK:
+            link_path = reserved_path if reserved_path is not None else self.reserve(folder, filename)
+            try:
+                # Link under a temporary name first: the reserved file may be the incoming file itself
+                os.link(duplicate, link_path + '.link')
+                os.replace(link_path + '.link', link_path)
+            except OSError:
+                # No hard links on this file system (FAT, exFAT...): keep the copy
+                if reserved_path is None:
+                    self.release(link_path)
+                return None
+            self.commit(link_path)
+            result_path = link_path
+        else:
+            if reserved_path is not None:
+                if os.path.exists(reserved_path) and reserved_path != file_path:
+                    os.remove(reserved_path)
+                self.release(reserved_path)
+            result_path = duplicate
+        if os.path.exists(file_path) and file_path != result_path:
+            os.remove(file_path)
+        self.hash_cache.forget(file_path)
+        with self.lock:
+            self.duplicates[self.duplicate_policy] += 1
+        return result_path
+
+    def get_duplicate_counts(self):
+        with self.lock:
+            return dict(self.duplicates)
@@ -0,0 +1,404 @@
+"""
+Staged pipeline running import, conversions and sort at the same time.
+
+Files flow through bounded queues as soon as they are ready:
+    import -> dispatch -> HEIC conversion (process pool) -> sort of undated files
+                       -> photo sort ----------------------> sort of undated files
+                       -> MOV conversion (ffmpeg jobs)
+                       -> sort of other files
+so that CPU-bound photo and video conversions overlap with the copy from the phone.
+
+Conversions and moves are recorded in the run journal of the import folder: a run interrupted by
+a crash, a sleep or Ctrl-C is completed by the next one, which only processes the remaining files.
+"""
+
+import os
+import queue
+import threading
+import convertAndSort
+import instrumentation
+import livePhoto
+import mov_to_mp4
+from infoBoxMgmt import print_message, print_message_d
+from progress import ProgressTracker, save_throughput
+from nameIndex import DestinationNameIndex
+from dedup import POLICY_SKIP
+from runJournal import open_run_journal, recover, OPERATION_HEIC
+from scanCache import open_scan_cache
+from memoryBudget import MemoryBudget
+from treeScanner import scan_tree, expand_directories, get_media_kind, KIND_PARTIAL
+
+# Stages which can be selected
+STAGE_IMPORT = 'import'
+STAGE_HEIC = 'heic'
+STAGE_VIDEO = 'video'
+STAGE_SORT = 'sort'
+
+# Maximum number of files waiting between two stages
+DEFAULT_QUEUE_SIZE = 256
+
+# Marks the end of a queue
+END_OF_QUEUE = None
+
+
+def write_profile(folder):
+    """
+    Write the timings of the run to a new report in folder and print them, when profiling is enabled.
+    """
+    if not instrumentation.is_enabled():
+        return
+    try:
+        report_folder, lines = instrumentation.write_report(folder)
+    except OSError as e:
+        print_message(f"Cannot write the profiling report: {e}")
+        return
+    for line in lines:
+        print_message(line)
+    print_message(f"Profiling report saved to {report_folder}")
+
+
+class Pipeline:
+    def __init__(self, import_folder, destination_folder, stages, output_quality=50, mp4quality=8,
+                 video_mode='transcode', heic_workers=None, video_jobs=None, video_thread_budget=None,
+                 queue_size=DEFAULT_QUEUE_SIZE, duplicate_policy=POLICY_SKIP, scan_workers=1, profile_folder=None,
+                 copy_workers=None, heic_memory_budget=None, live_photo_policy=livePhoto.LIVE_POLICY_REMUX,
+                 keep_heic=False, video_timeout=None):
+        self.import_folder = import_folder
+        self.destination_folder = destination_folder
+        self.other_folder = os.path.join(destination_folder, 'OtherFiles')
+        self.stages = set(stages)
+        self.output_quality = output_quality
+        self.mp4quality = mp4quality
+        self.video_mode = video_mode
+        # HEIC files sorted as they are, like the other photos, instead of being converted to JPG
+        self.keep_heic = keep_heic
+        # A hung ffmpeg job is killed after video_timeout seconds (None: default timeout, 0: no timeout)
+        self.video_runner = mov_to_mp4.FfmpegJobRunner(video_jobs, video_thread_budget, video_timeout)
+
+        self.heic_queue = queue.Queue(maxsize=queue_size)
+        self.photo_queue = queue.Queue(maxsize=queue_size)
+        self.video_queue = queue.Queue(maxsize=queue_size)
+        self.other_queue = queue.Queue(maxsize=queue_size)
+        # Queues whose readers were sent END_OF_QUEUE
+        self.closed_queues = set()
+        # Memory of the decoded images of the HEIC files being converted, in bytes
+        # (None: part of the physical memory, 0: no limit)
+        self.heic_pool = convertAndSort.HeicConversionPool(heic_workers, MemoryBudget(heic_memory_budget))
+
+        self.lock = threading.Lock()
+        self.done = {'heic': 0, 'photo': 0, 'video': 0, 'other': 0}
+        self.failed = {'heic': 0, 'photo': 0, 'video': 0, 'other': 0}
+        self.trackers = {kind: ProgressTracker(kind) for kind in self.done}
+        # Names used in the destination folders, shared by all the stages
+        self.name_index = DestinationNameIndex(duplicate_policy)
+        self.journal = None
+        self.scan_cache = None
+        self.scan_workers = scan_workers
+        # Files copied at once when importing from a directory
+        self.copy_workers = copy_workers
+        # Folders of the files processed by the run, deleted at the end when they are empty
+        self.directories = set()
+        self.import_status = 'STATUS_SUCCESS'
+        # Report of the timings, when profiling is enabled (default: .metadata/profile of the import folder)
+        self.profile_folder = profile_folder
+        # Live Photo clips are placed next to their photo when both are processed by the run
+        self.live_photo_policy = live_photo_policy
+        self.live_photos = None
+        if (live_photo_policy != livePhoto.LIVE_POLICY_CONVERT and STAGE_HEIC in self.stages
+                and STAGE_VIDEO in self.stages):
+            self.live_photos = livePhoto.LivePhotoPairer()
+        self.live_clips = 0
+
+    def count(self, kind, success, bytes_read=0, bytes_written=0):
+        with self.lock:
+            if success:
+                self.done[kind] += 1
+            else:
+                self.failed[kind] += 1
+        self.trackers[kind].advance(success, bytes_read, bytes_written)
+
+    def dispatch(self, file_path):
+        """
+        Send a file to the stage which handles its kind. Blocks while that stage is full.
+        """
+        kind = get_media_kind(file_path)
+        self.directories.add(os.path.dirname(file_path))
+        if kind == 'heic' and self.keep_heic:
+            kind = 'photo'
+        if kind == 'heic':
+            # Folder of the JPG files converted without capture date
+            self.directories.add(os.path.join(os.path.dirname(file_path), '.ConvertedFiles'))
+        if kind in ('heic', 'photo') and STAGE_HEIC in self.stages and self.live_photos is not None:
+            self.live_photos.add_photo(file_path)
+        if kind == 'heic' and STAGE_HEIC in self.stages:
+            self.trackers['heic'].plan()
+            self.heic_queue.put(file_path)
+        elif kind == 'photo' and STAGE_HEIC in self.stages:
+            self.trackers['photo'].plan()
+            self.photo_queue.put(file_path)
+        elif kind == 'video' and STAGE_VIDEO in self.stages:
+            if self.live_photos is None:
+                self.send_to_video(file_path)
+            else:
+                # Held while it may be the clip of a photo not sorted yet
+                clip = self.live_photos.add_clip(file_path)
+                if clip is not None:
+                    self.send_to_video(*clip)
+        else:
+            self.send_to_other(file_path)
+
+    def send_to_video(self, mov_path, photo_path=None):
+        # Live Photo clips are sent with the path of their sorted photo
+        self.trackers['video'].plan()
+        self.video_queue.put(mov_path if photo_path is None else (mov_path, photo_path))
+
+    def photo_done(self, photo_path, placed_path):
+        # placed_path: where the photo was sorted, None if it was not
+        if self.live_photos is not None:
+            clip = self.live_photos.photo_done(photo_path, placed_path)
+            if clip is not None:
+                self.send_to_video(*clip)
+
+    def send_to_other(self, file_path):
+        # Files not handled by a selected stage are left in the import folder, unless sort is selected
+        if STAGE_SORT in self.stages:
+            self.trackers['other'].plan()
+            self.other_queue.put(file_path)
+
+    def produce(self, iphone_folder):
+        # Files left in the import folder by a previous run, listed before the stages write new files to it
+        with instrumentation.stage('scan'):
+            manifest = scan_tree(self.import_folder, self.scan_workers)
+        self.directories.update(manifest.directories)
+        for partial_path in manifest.get_files(KIND_PARTIAL):
+            # Incomplete conversion or copy: its HEIC file is still there and is converted again,
+            # and the copied files are only recorded in the import history once complete
+            os.remove(partial_path)
+        leftovers = manifest.get_files('heic', 'photo', 'video', 'other')
+        evicted = self.scan_cache.evict_missing(leftovers)
+        print_message_d(f"{len(leftovers)} files left in the import folder, {evicted} scan cache entries evicted")
+        for file_path in leftovers:
+            self.dispatch(file_path)
+
+        if STAGE_IMPORT in self.stages:
+            import iPhoneImport
+            print_message("Performing actions: Import")
+            with instrumentation.stage(STAGE_IMPORT):
+                self.import_status = iPhoneImport.iPhoneImportFiles(iphone_folder, self.import_folder,
+                                                                    on_file_imported=self.dispatch,
+                                                                    copy_workers=self.copy_workers)
+
+    def iter_heic_queue(self):
+        while True:
+            heic_path = self.heic_queue.get()
+            if heic_path is END_OF_QUEUE:
+                return
+            yield heic_path, None
+
+    def run_heic_stage(self):
+        self.heic_pool.run(self.iter_heic_queue(), self.start_heic, self.heic_done)
+
+    def start_heic(self, heic_path, _):
+        jpg_path = os.path.join(os.path.dirname(heic_path), ".ConvertedFiles",
+                                os.path.splitext(os.path.basename(heic_path))[0] + ".jpg")
+        temp_name = convertAndSort.new_partial_name()
+        operation_id = self.journal.begin(OPERATION_HEIC, heic_path, self.destination_folder, temp_name)
+        return (convertAndSort.convert_and_place_file,
+                (heic_path, jpg_path, self.output_quality, self.destination_folder, temp_name), operation_id)
+
+    def heic_done(self, heic_path, _, operation_id, result):
+        try:
+            result = convertAndSort.place_converted_file(result, self.name_index, self.journal, operation_id)
+        except Exception as e:
+            result = convertAndSort.ConversionResult(heic_path, None, False, str(e))
+        if not result.success:
+            print_message_d(f"Error converting '{result.source}': {result.error}")
+        elif not result.placed:
+            # No capture date: the JPG is sorted with the other files
+            self.send_to_other(result.destination)
+        self.photo_done(heic_path, result.destination if result.success and result.placed else None)
+        self.count('heic', result.success, result.bytes_read, result.bytes_written)
+
+    def run_photo_stage(self):
+        while True:
+            photo_path = self.photo_queue.get()
+            if photo_path is END_OF_QUEUE:
+                break
+            placed_path = None
+            try:
+                placed_path = convertAndSort.sort_photo(photo_path, self.destination_folder, self.name_index,
+                                                        self.scan_cache)
+                if placed_path is None:
+                    self.send_to_other(photo_path)
+                self.count('photo', True)
+            except Exception as e:
+                print_message(f"Error processing {photo_path}: {e}")
+                self.count('photo', False)
+            self.photo_done(photo_path, placed_path)
+
+    def run_video_stage(self):
+        while True:
+            mov_path = self.video_queue.get()
+            if mov_path is END_OF_QUEUE:
+                break
+            if isinstance(mov_path, tuple):
+                mov_path, photo_path = mov_path
+                (status, _, _), bytes_read, bytes_written = livePhoto.place_clip_with_size(
+                    mov_path, photo_path, self.live_photo_policy, self.video_runner, self.name_index, self.journal,
+                    self.scan_cache)
+                if status == 'STATUS_SUCCESS':
+                    with self.lock:
+                        self.live_clips += 1
+            else:
+                (status, _, _), bytes_read, bytes_written = mov_to_mp4.convert_mov_file_with_size(
+                    mov_path, self.destination_folder, self.mp4quality, self.video_runner, self.video_mode,
+                    self.name_index, self.journal, self.scan_cache)
+            if status != 'STATUS_SUCCESS':
+                print_message(f"Error converting file {mov_path}")
+            self.count('video', status == 'STATUS_SUCCESS', bytes_read, bytes_written)
+
+    def run_other_stage(self):
+        while True:
+            file_path = self.other_queue.get()
+            if file_path is END_OF_QUEUE:
+                break
+            try:
+                os.makedirs(self.other_folder, exist_ok=True)
+                convertAndSort.move_file_with_unique_name(file_path, self.other_folder, self.name_index, self.journal)
+                self.count('other', True)
+            except Exception as e:
+                print_message(f"Error moving file {file_path}: {e}")
+                self.count('other', False)
+
+    def run(self, iphone_folder=None):
+        """
+        Run all the selected stages until every file is processed.
+
+        Returns:
+        dict: Status of each selected stage.
+        """
+        metadata_folder = os.path.join(self.import_folder, '.metadata')
+        self.journal = open_run_journal(metadata_folder)
+        self.scan_cache = open_scan_cache(metadata_folder)
+        try:
+            with instrumentation.stage('recover'):
+                recover(self.journal, self.name_index)
+            return self.run_stages(iphone_folder)
+        finally:
+            print_message_d(f"Scan cache: {self.scan_cache.hits} hits, {self.scan_cache.misses} misses")
+            self.scan_cache.close()
+            self.journal.close()
+            write_profile(self.profile_folder or os.path.join(metadata_folder, 'profile'))
+
+    def run_timed(self, stage_name, target):
+        with instrumentation.stage(stage_name):
+            target()
+
+    def run_stages(self, iphone_folder):
+        heic_thread = threading.Thread(target=self.run_timed, args=('heic', self.run_heic_stage))
+        photo_thread = threading.Thread(target=self.run_timed, args=('photo', self.run_photo_stage))
+        other_thread = threading.Thread(target=self.run_timed, args=('other', self.run_other_stage))
+        # The video threads add up their times in a single stage
+        video_threads = [threading.Thread(target=self.run_timed, args=('video', self.run_video_stage))
+                         for _ in range(self.video_runner.max_jobs)]
+        for thread in [heic_thread, photo_thread, other_thread] + video_threads:
+            thread.start()
+
+        try:
+            self.produce(iphone_folder)
+        except BaseException:
+            # Failed or interrupted: the ffmpeg jobs are killed and the HEIC conversions not started are
+            # cancelled, their files are converted by the next run
+            self.cancel_conversions()
+            raise
+        finally:
+            interruption = None
+            while True:
+                try:
+                    self.close_stages(heic_thread, photo_thread, other_thread, video_threads)
+                    break
+                except BaseException as e:
+                    # Interrupted while waiting for the stages: closing them is resumed, or their threads would
+                    # keep the process alive. Once the conversions are cancelled, they end quickly
+                    self.cancel_conversions()
+                    interruption = interruption or e
+            if interruption is not None:
+                raise interruption
+        return self.get_statuses()
+
+    def cancel_conversions(self):
+        self.video_runner.cancel()
+        self.heic_pool.cancel()
+
+    def close_queue(self, stage_queue, readers=1):
+        # Only once, when closing the stages is resumed after an interruption
+        if stage_queue in self.closed_queues:
+            return
+        for _ in range(readers):
+            stage_queue.put(END_OF_QUEUE)
+        self.closed_queues.add(stage_queue)
+
+    def close_stages(self, heic_thread, photo_thread, other_thread, video_threads):
+        # Close the stages in the order they feed each other
+        self.close_queue(self.heic_queue)
+        if self.live_photos is None:
+            self.close_queue(self.video_queue, len(video_threads))
+        heic_thread.join()
+        self.close_queue(self.photo_queue)
+        photo_thread.join()
+        if self.live_photos is not None and self.video_queue not in self.closed_queues:
+            # Every photo is sorted: the clips still held have no photo, they are normal videos
+            for mov_path in self.live_photos.flush():
+                self.send_to_video(mov_path)
+            self.close_queue(self.video_queue, len(video_threads))
+        self.close_queue(self.other_queue)
+        other_thread.join()
+        for thread in video_threads:
+            thread.join()
+        for tracker in self.trackers.values():
+            if tracker.planned > 0:
+                tracker.finish()
+        try:
+            save_throughput(os.path.join(self.import_folder, '.metadata'),
+                            [tracker.snapshot() for tracker in self.trackers.values()])
+        except OSError as e:
+            print_message_d(f"Cannot save the measured throughput: {e}")
+
+    def get_statuses(self):
+        statuses = {}
+        if STAGE_IMPORT in self.stages:
+            statuses[STAGE_IMPORT] = self.import_status
+        if STAGE_HEIC in self.stages:
+            statuses[STAGE_HEIC] = self.stage_status('heic', 'photo')
+            print_message(f"{self.done['heic']} HEIC files converted, {self.done['photo']} photos sorted")
+        if STAGE_VIDEO in self.stages:
+            statuses[STAGE_VIDEO] = self.stage_status('video')
+            print_message(f"{self.done['video']} videos converted")
+            if self.live_clips > 0:
+                print_message(f"{self.live_clips} of them are Live Photo clips placed next to their photo "
+                              f"({self.live_photo_policy})")
+        if STAGE_SORT in self.stages:
+            statuses[STAGE_SORT] = self.stage_status('other')
+            print_message(f"{self.done['other']} other files sorted")
+        convertAndSort.print_duplicate_counts(self.name_index)
+
+        status = convertAndSort.delete_empty_directories(self.import_folder,
+                                                         expand_directories(self.import_folder, self.directories))
+        if status == 'STATUS_SUCCESS' and STAGE_SORT in self.stages:
+            status = convertAndSort.delete_empty_directories(self.destination_folder)
+        if status != 'STATUS_SUCCESS':
+            statuses['cleanup'] = status
+        return statuses
+
+    def get_summary(self):
+        """
+        Number of processed and failed files per kind, and of duplicates skipped or linked.
+        """
+        with self.lock:
+            return {'done': dict(self.done), 'failed': dict(self.failed),
+                    'duplicates': self.name_index.get_duplicate_counts()}
+
+    def stage_status(self, *kinds):
+        if any(self.failed[kind] > 0 for kind in kinds):
+            return 'STATUS_ERROR'
+        return 'STATUS_SUCCESS'
@@ -0,0 +1,531 @@
+"""
+Dry-run planning of a run.
+
+Planner reads the files of the import folder (headers and stat only) and lists every operation
+a run would do, with its destination, the name collisions and the bytes to read and write,
+without modifying any file: only the scan cache is filled, which also speeds up the next run.
+The duration is estimated from the throughput measured by the previous runs.
+The plan can be saved as JSON and executed later, as-is, by PlanExecutor.
+
+Files still on the phone are not planned: the import stage is not part of a plan.
+"""
+
+import json
+import os
+import shutil
+import threading
+from dataclasses import dataclass, asdict
+import convertAndSort
+import instrumentation
+import livePhoto
+import mov_to_mp4
+from infoBoxMgmt import print_message, print_message_d
+from progress import ProgressTracker, load_throughput
+from nameIndex import DestinationNameIndex
+from dedup import POLICY_SKIP
+from runJournal import open_run_journal, recover, OPERATION_HEIC, OPERATION_VIDEO, OPERATION_MOVE, STATE_PLACED
+from scanCache import FIELD_CAPTURE_DATE, FIELD_PROBE
+from treeScanner import scan_tree, expand_directories, KIND_HEIC, KIND_PHOTO, KIND_VIDEO, KIND_OTHER
+from pipeline import STAGE_HEIC, STAGE_VIDEO, STAGE_SORT
+
+PLAN_VERSION = 1
+
+# Operations
+ACTION_CONVERT_HEIC = 'convert_heic'    # HEIC converted to JPG at the destination, then deleted
+ACTION_CONVERT_VIDEO = 'convert_video'  # MOV remuxed or transcoded to MP4 at the destination, then deleted
+ACTION_MOVE = 'move'                    # File renamed, or copied then deleted on another drive
+ACTION_PLACE_CLIP = 'place_clip'        # Live Photo clip placed next to its photo, per the Live Photo policy
+
+# Throughput used when no run measured it yet
+DEFAULT_THROUGHPUT = {
+    KIND_HEIC: {'bytes_per_s': 20e6, 'files_per_s': 8.0, 'write_ratio': 1.0},
+    KIND_PHOTO: {'bytes_per_s': 1e9, 'files_per_s': 500.0, 'write_ratio': 0.0},
+    KIND_VIDEO: {'bytes_per_s': 10e6, 'files_per_s': 0.2, 'write_ratio': 0.5},
+    KIND_OTHER: {'bytes_per_s': 1e9, 'files_per_s': 500.0, 'write_ratio': 0.0},
+}
+
+
+@dataclass
+class PlannedOperation:
+    kind: str
+    action: str
+    source: str
+    destination: str
+    # Name wanted at the destination, before a _N suffix was added to avoid a collision
+    wanted_name: str
+    collision: bool
+    bytes_read: int
+    bytes_written: int
+    # 'remux' or 'transcode' for videos, 'remux', 'archive' or 'skip' for Live Photo clips
+    method: str = None
+    # File of the destination with the same content: the file is skipped or linked to it, per the duplicate policy
+    duplicate_of: str = None
+
+
+def get_existing_device(path):
+    # Device of the closest existing parent: the destination may not exist yet
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    return os.stat(path).st_dev
+
+
+class Planner:
+    def __init__(self, import_folder, destination_folder, stages, video_mode='transcode', scan_cache=None,
+                 scan_workers=1, keep_heic=False, duplicate_policy=POLICY_SKIP,
+                 live_photo_policy=livePhoto.LIVE_POLICY_REMUX):
+        self.import_folder = import_folder
+        self.destination_folder = destination_folder
+        self.other_folder = os.path.join(destination_folder, 'OtherFiles')
+        self.stages = set(stages)
+        self.video_mode = video_mode
+        self.scan_cache = scan_cache
+        self.scan_workers = scan_workers
+        self.keep_heic = keep_heic
+        # Live Photo clips are paired with their photo as in a run of the pipeline
+        self.live_photo_policy = live_photo_policy
+        self.live_photos = None
+        if (live_photo_policy != livePhoto.LIVE_POLICY_CONVERT and STAGE_HEIC in self.stages
+                and STAGE_VIDEO in self.stages):
+            self.live_photos = livePhoto.LivePhotoPairer()
+        # Names are only reserved in memory: nothing is written
+        self.name_index = DestinationNameIndex(duplicate_policy)
+        # Planned destination -> source file, compared with the next files planned to the same name
+        self.planned_sources = {}
+        # A move on the same drive is a rename: nothing is written
+        self.same_drive = get_existing_device(import_folder) == get_existing_device(destination_folder)
+        self.throughput = load_throughput(os.path.join(import_folder, '.metadata'))
+        self.operations = []
+        # (source, reason) of the files the run would leave in the import folder
+        self.skipped = []
+
+    def lookup(self, file_path, field, compute):
+        if self.scan_cache is None:
+            return compute(file_path)
+        return self.scan_cache.lookup(file_path, field, compute)
+
+    def add(self, kind, action, source, folder, wanted_name, method=None):
+        # Same content already in the destination, or planned to be written there, as a run would find it.
+        # Converted files are only compared with the sources of the planned conversions.
+        duplicate = self.name_index.find_duplicate(source, folder, wanted_name, self.planned_sources)
+        if duplicate is not None and self.name_index.duplicate_policy == POLICY_SKIP:
+            destination = duplicate
+        else:
+            destination = self.name_index.reserve(folder, wanted_name)
+            # Complete for the comparisons of the next files
+            self.name_index.commit(destination)
+            self.planned_sources[destination] = source
+        bytes_read = os.path.getsize(source)
+        if duplicate is not None:
+            bytes_written = 0
+        elif action == ACTION_MOVE or (action == ACTION_PLACE_CLIP and method == livePhoto.LIVE_POLICY_ARCHIVE):
+            bytes_written = 0 if self.same_drive else bytes_read
+        elif action == ACTION_PLACE_CLIP:
+            # The streams are copied
+            bytes_written = bytes_read
+        else:
+            bytes_written = int(bytes_read * self.get_throughput(kind)['write_ratio'])
+        self.operations.append(PlannedOperation(kind, action, source, destination, wanted_name,
+                                                duplicate is None and os.path.basename(destination) != wanted_name,
+                                                bytes_read, bytes_written, method, duplicate))
+        return destination
+
+    def skip(self, source, reason):
+        self.skipped.append((source, reason))
+
+    def get_throughput(self, kind):
+        return self.throughput.get(kind, DEFAULT_THROUGHPUT[kind])
+
+    def plan_heic(self, heic_path):
+        """
+        Returns:
+        str: Planned path of the JPG in its year folder, None if it has no capture date.
+        """
+        try:
+            date_taken = self.lookup(heic_path, FIELD_CAPTURE_DATE, convertAndSort.get_exif_date)
+        except Exception as e:
+            print_message_d(f"Cannot read the capture date of {heic_path}: {e}")
+            date_taken = None
+        jpg_name = os.path.splitext(os.path.basename(heic_path))[0] + ".jpg"
+        if date_taken:
+            year_folder, new_filename = convertAndSort.get_dated_path(self.destination_folder, date_taken, ".jpg")
+            return self.add(KIND_HEIC, ACTION_CONVERT_HEIC, heic_path, year_folder, new_filename)
+        if STAGE_SORT in self.stages:
+            self.add(KIND_HEIC, ACTION_CONVERT_HEIC, heic_path, self.other_folder, jpg_name)
+        else:
+            self.add(KIND_HEIC, ACTION_CONVERT_HEIC, heic_path,
+                     os.path.join(os.path.dirname(heic_path), ".ConvertedFiles"), jpg_name)
+        return None
+
+    def plan_photo(self, photo_path):
+        """
+        Returns:
+        str: Planned path of the photo in its year folder, None if it has no capture date.
+        """
+        try:
+            date_taken = self.lookup(photo_path, FIELD_CAPTURE_DATE, convertAndSort.get_exif_date)
+        except Exception as e:
+            print_message_d(f"Cannot read the capture date of {photo_path}: {e}")
+            date_taken = None
+        if date_taken:
+            file_ext = os.path.splitext(photo_path)[1].lower()
+            year_folder, new_filename = convertAndSort.get_dated_path(self.destination_folder, date_taken, file_ext)
+            return self.add(KIND_PHOTO, ACTION_MOVE, photo_path, year_folder, new_filename)
+        self.plan_other(photo_path, "no capture date")
+        return None
+
+    def plan_video(self, mov_path):
+        video_info = mov_to_mp4.get_creation_time(mov_path, self.scan_cache)
+        if video_info is None:
+            self.skip(mov_path, "no creation time")
+            return
+        method = 'transcode'
+        if self.video_mode == 'auto':
+            try:
+                if mov_to_mp4.can_remux_to_mp4(self.lookup(mov_path, FIELD_PROBE, mov_to_mp4.probe_streams)):
+                    method = 'remux'
+            except Exception as e:
+                print_message_d(f"Cannot probe {mov_path}: {e}")
+        year_folder, new_filename = mov_to_mp4.get_dated_video_path(self.destination_folder, video_info)
+        self.add(KIND_VIDEO, ACTION_CONVERT_VIDEO, mov_path, year_folder, new_filename, method)
+
+    def plan_clip(self, mov_path, photo_path):
+        # Same name as its planned photo, in the same folder
+        if self.live_photo_policy == livePhoto.LIVE_POLICY_SKIP:
+            self.operations.append(PlannedOperation(KIND_VIDEO, ACTION_PLACE_CLIP, mov_path, None, None, False,
+                                                    os.path.getsize(mov_path), 0, livePhoto.LIVE_POLICY_SKIP))
+            return
+        method = livePhoto.LIVE_POLICY_ARCHIVE
+        if self.live_photo_policy == livePhoto.LIVE_POLICY_REMUX:
+            try:
+                if mov_to_mp4.can_remux_to_mp4(self.lookup(mov_path, FIELD_PROBE, mov_to_mp4.probe_streams)):
+                    method = livePhoto.LIVE_POLICY_REMUX
+            except Exception as e:
+                print_message_d(f"Cannot probe {mov_path}: {e}")
+        base_name = os.path.splitext(os.path.basename(photo_path))[0]
+        extension = '.mp4' if method == livePhoto.LIVE_POLICY_REMUX else os.path.splitext(mov_path)[1].lower()
+        self.add(KIND_VIDEO, ACTION_PLACE_CLIP, mov_path, os.path.dirname(photo_path), base_name + extension,
+                 method)
+
+    def plan_other(self, file_path, reason="not handled by the selected stages"):
+        if STAGE_SORT in self.stages:
+            self.add(KIND_OTHER, ACTION_MOVE, file_path, self.other_folder, os.path.basename(file_path))
+        else:
+            self.skip(file_path, reason)
+
+    def plan(self):
+        """
+        List the operations of a run on the files of the import folder.
+
+        Returns:
+        dict: Plan, with its operations, skipped files, totals and estimated duration.
+        """
+        manifest = scan_tree(self.import_folder, self.scan_workers)
+        for heic_path in manifest.get_files(KIND_HEIC):
+            if STAGE_HEIC in self.stages and self.keep_heic:
+                self.photo_planned(heic_path, self.plan_photo(heic_path))
+            elif STAGE_HEIC in self.stages:
+                self.photo_planned(heic_path, self.plan_heic(heic_path))
+            else:
+                self.plan_other(heic_path)
+        for photo_path in manifest.get_files(KIND_PHOTO):
+            if STAGE_HEIC in self.stages:
+                self.photo_planned(photo_path, self.plan_photo(photo_path))
+            else:
+                self.plan_other(photo_path)
+        for mov_path in manifest.get_files(KIND_VIDEO):
+            if STAGE_VIDEO not in self.stages:
+                self.plan_other(mov_path)
+            elif self.live_photos is None:
+                self.plan_video(mov_path)
+            else:
+                clip = self.live_photos.add_clip(mov_path)
+                if clip is not None and clip[1] is not None:
+                    self.plan_clip(*clip)
+                elif clip is not None:
+                    self.plan_video(mov_path)
+        if self.live_photos is not None:
+            # Every photo is planned: the clips still held have no photo, they are normal videos
+            for mov_path in self.live_photos.flush():
+                self.plan_video(mov_path)
+        for file_path in manifest.get_files(KIND_OTHER):
+            self.plan_other(file_path)
+        return self.get_plan()
+
+    def photo_planned(self, photo_path, placed_path):
+        # placed_path: planned path of the photo in its year folder, None if it is not sorted there
+        if self.live_photos is not None:
+            self.live_photos.add_photo(photo_path)
+            self.live_photos.photo_done(photo_path, placed_path)
+
+    def get_plan(self):
+        totals = {}
+        for operation in self.operations:
+            kind_totals = totals.setdefault(operation.kind, {'files': 0, 'collisions': 0, 'duplicates': 0,
+                                                            'bytes_read': 0, 'bytes_written': 0})
+            kind_totals['files'] += 1
+            kind_totals['collisions'] += int(operation.collision)
+            kind_totals['duplicates'] += int(operation.duplicate_of is not None)
+            kind_totals['bytes_read'] += operation.bytes_read
+            kind_totals['bytes_written'] += operation.bytes_written
+        for kind, kind_totals in totals.items():
+            throughput = self.get_throughput(kind)
+            kind_totals['estimated_s'] = round(max(kind_totals['bytes_read'] / throughput['bytes_per_s'],
+                                                   kind_totals['files'] / throughput['files_per_s']), 1)
+        return {
+            'version': PLAN_VERSION,
+            'import_folder': self.import_folder,
+            'destination_folder': self.destination_folder,
+            'stages': sorted(self.stages),
+            'video_mode': self.video_mode,
+            'keep_heic': self.keep_heic,
+            'duplicate_policy': self.name_index.duplicate_policy,
+            'live_photo_policy': self.live_photo_policy,
+            'operations': [asdict(operation) for operation in self.operations],
+            'skipped': [{'source': source, 'reason': reason} for source, reason in self.skipped],
+            'totals': totals,
+            # The stages run at the same time: the slowest one gives the duration
+            'estimated_s': max((kind_totals['estimated_s'] for kind_totals in totals.values()), default=0.0),
+        }
+
+
+def save_plan(plan, plan_path):
+    with open(plan_path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=2)
+
+
+def load_plan(plan_path):
+    with open(plan_path, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version {plan.get('version')} in {plan_path}")
+    return plan
+
+
+class PlanExecutor:
+    """
+    Execute the operations of a plan: HEIC conversions in a process pool, video conversions
+    in parallel ffmpeg jobs, and moves, all at the same time.
+    A destination taken since the plan was made gets a _N suffix instead of being overwritten.
+    The files identical to a file of the destination are handled by the duplicate policy of the plan,
+    and the operations are recorded in the run journal, like in a run of the pipeline.
+    Live Photo clips are placed next to their photo, per the Live Photo policy of the plan,
+    once the photos are sorted.
+    """
+    def __init__(self, plan, output_quality=50, mp4quality=8, heic_workers=None, video_jobs=None,
+                 video_thread_budget=None, memory_budget=None, video_timeout=None):
+        self.import_folder = plan['import_folder']
+        self.operations = [PlannedOperation(**operation) for operation in plan['operations']]
+        self.output_quality = output_quality
+        self.mp4quality = mp4quality
+        self.video_runner = mov_to_mp4.FfmpegJobRunner(video_jobs, video_thread_budget, video_timeout)
+        self.heic_pool = convertAndSort.HeicConversionPool(heic_workers, memory_budget)
+        self.name_index = DestinationNameIndex(plan.get('duplicate_policy', POLICY_SKIP))
+        self.live_photo_policy = plan.get('live_photo_policy', livePhoto.LIVE_POLICY_REMUX)
+        # Pair key of each sorted photo -> its final path, where its Live Photo clip is placed
+        self.placed_photos = {}
+        self.journal = None
+        self.lock = threading.Lock()
+        self.failed = {KIND_HEIC: 0, KIND_PHOTO: 0, KIND_VIDEO: 0, KIND_OTHER: 0}
+        self.trackers = {kind: ProgressTracker(kind) for kind in self.failed}
+
+    def reserve(self, operation):
+        # Same names as planned, unless the destination changed since
+        if operation.destination == operation.duplicate_of:
+            # Planned to be skipped, but its duplicate is not there anymore
+            filename = operation.wanted_name
+        else:
+            filename = os.path.basename(operation.destination)
+        destination = self.name_index.reserve(os.path.dirname(operation.destination), filename)
+        if destination != operation.destination:
+            print_message_d(f"{operation.destination} exists, using {destination}")
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        return destination
+
+    def count(self, kind, success, bytes_read=0, bytes_written=0):
+        if not success:
+            with self.lock:
+                self.failed[kind] += 1
+        self.trackers[kind].advance(success, bytes_read, bytes_written)
+
+    def place_if_duplicate(self, operation, file_path, reserved_path=None):
+        # Checked again: the destination may have changed since the plan was made
+        return self.name_index.place_if_duplicate(file_path, os.path.dirname(operation.destination),
+                                                  operation.wanted_name, reserved_path=reserved_path)
+
+    def convert_video(self, operation):
+        try:
+            destination = self.reserve(operation)
+        except OSError as e:
+            print_message_d(f"Cannot create the folder of {operation.destination}: {e}")
+            return False, 0
+        operation_id = self.journal.begin(OPERATION_VIDEO, operation.source, destination)
+        video_mode = 'auto' if operation.method == 'remux' else 'transcode'
+        try:
+            method = mov_to_mp4.convert_one_file(operation.source, self.mp4quality, destination, self.video_runner,
+                                                 video_mode)
+            if method is None:
+                if os.path.exists(destination):
+                    os.remove(destination)
+                self.name_index.release(destination)
+                self.journal.finish(operation_id)
+                return False, 0
+            duplicate_path = self.place_if_duplicate(operation, destination, reserved_path=destination)
+            if duplicate_path is not None:
+                destination = duplicate_path
+            else:
+                self.name_index.commit(destination)
+            self.journal.update(operation_id, STATE_PLACED, destination=destination)
+            os.remove(operation.source)
+            self.journal.finish(operation_id)
+        except OSError as e:
+            # Left in the journal: completed or rolled back by the next run
+            print_message_d(f"Error converting {operation.source}: {e}")
+            return False, 0
+        return True, os.path.getsize(destination)
+
+    def run_videos(self, operations):
+        for operation, result in self.video_runner.map(self.convert_video, operations):
+            if result == 'STATUS_CANCELLED':
+                continue
+            success, bytes_written = result
+            if not success:
+                print_message(f"Error converting file {operation.source}")
+            self.count(KIND_VIDEO, success, operation.bytes_read, bytes_written)
+
+    def run_moves(self, operations):
+        for operation in operations:
+            self.move(operation)
+
+    def move(self, operation):
+        try:
+            destination = self.place_if_duplicate(operation, operation.source)
+            if destination is None:
+                destination = self.reserve(operation)
+                operation_id = self.journal.begin(OPERATION_MOVE, operation.source, destination)
+                try:
+                    shutil.move(operation.source, destination)
+                except BaseException:
+                    # Left in the journal: a partial copy is deleted by the next run
+                    self.name_index.release(destination)
+                    raise
+                self.name_index.commit(destination)
+                self.journal.finish(operation_id)
+            if operation.kind == KIND_PHOTO:
+                self.photo_placed(operation.source, destination)
+            self.count(operation.kind, True, operation.bytes_read, operation.bytes_written)
+        except Exception as e:
+            print_message(f"Error moving file {operation.source}: {e}")
+            self.count(operation.kind, False)
+
+    def photo_placed(self, photo_path, placed_path):
+        with self.lock:
+            self.placed_photos[livePhoto.get_pair_key(photo_path)] = placed_path
+
+    def run_clips(self, operations):
+        for operation in operations:
+            photo_path = self.placed_photos.get(livePhoto.get_pair_key(operation.source))
+            if photo_path is None:
+                print_message(f"The photo of {operation.source} was not sorted, "
+                              "the clip is left in the import folder")
+                self.count(KIND_VIDEO, False)
+                continue
+            (status, _, _), bytes_read, bytes_written = livePhoto.place_clip_with_size(
+                operation.source, photo_path, self.live_photo_policy, self.video_runner, self.name_index,
+                self.journal)
+            if status != 'STATUS_SUCCESS':
+                print_message(f"Error placing Live Photo clip {operation.source}")
+            self.count(KIND_VIDEO, status == 'STATUS_SUCCESS', bytes_read, bytes_written)
+
+    def run_timed_videos(self, operations):
+        with instrumentation.stage('video'):
+            self.run_videos(operations)
+
+    def start_heic(self, heic_path, operation):
+        destination = self.reserve(operation)
+        temp_name = convertAndSort.new_partial_name()
+        try:
+            operation_id = self.journal.begin(OPERATION_HEIC, heic_path, destination,
+                                              os.path.join(os.path.dirname(destination), temp_name))
+        except BaseException:
+            self.name_index.release(destination)
+            raise
+        return (convertAndSort.convert_single_file, (heic_path, destination, self.output_quality, temp_name),
+                (destination, operation_id))
+
+    def heic_done(self, heic_path, operation, context, result):
+        if context is not None:
+            destination, operation_id = context
+            # The HEIC file is deleted by the worker once its JPG is complete
+            if result.success:
+                duplicate_path = self.place_if_duplicate(operation, destination, reserved_path=destination)
+                if duplicate_path is not None:
+                    result.destination = duplicate_path
+                else:
+                    self.name_index.commit(destination)
+                self.photo_placed(heic_path, result.destination)
+            else:
+                self.name_index.release(destination)
+            self.journal.finish(operation_id)
+        if not result.success:
+            print_message_d(f"Error converting '{heic_path}': {result.error}")
+        self.count(KIND_HEIC, result.success, result.bytes_read, result.bytes_written)
+
+    def run(self):
+        """
+        Returns:
+        dict: Status of each kind of files of the plan.
+        """
+        metadata_folder = os.path.join(self.import_folder, '.metadata')
+        self.journal = open_run_journal(metadata_folder)
+        try:
+            # Completes or rolls back the operations of an interrupted run, or execution of the plan
+            with instrumentation.stage('recover'):
+                recover(self.journal, self.name_index)
+            return self.run_operations()
+        finally:
+            self.journal.close()
+
+    def run_operations(self):
+        done = [operation for operation in self.operations if not os.path.exists(operation.source)]
+        if len(done) > 0:
+            print_message(f"{len(done)} files of the plan already processed, or deleted since the plan was made")
+        operations = [operation for operation in self.operations if os.path.exists(operation.source)]
+        heic_operations = [operation for operation in operations if operation.action == ACTION_CONVERT_HEIC]
+        video_operations = [operation for operation in operations if operation.action == ACTION_CONVERT_VIDEO]
+        move_operations = [operation for operation in operations if operation.action == ACTION_MOVE]
+        clip_operations = [operation for operation in operations if operation.action == ACTION_PLACE_CLIP]
+        for operation in operations:
+            self.trackers[operation.kind].plan()
+
+        video_thread = threading.Thread(target=self.run_timed_videos, args=(video_operations,))
+        video_thread.start()
+        # Moves run while the workers convert
+        move_thread = threading.Thread(target=self.run_moves, args=(move_operations,))
+        move_thread.start()
+        try:
+            self.heic_pool.run(((operation.source, operation) for operation in heic_operations),
+                               self.start_heic, self.heic_done)
+            # The clips are placed next to their photo, once every photo is sorted
+            move_thread.join()
+            with instrumentation.stage('video'):
+                self.run_clips(clip_operations)
+        except BaseException:
+            # Failed or interrupted: the ffmpeg jobs are killed and the HEIC conversions not started are
+            # cancelled, their files are left in the import folder
+            self.video_runner.cancel()
+            self.heic_pool.cancel()
+            raise
+        finally:
+            move_thread.join()
+            video_thread.join()
+            for tracker in self.trackers.values():
+                if tracker.planned > 0:
+                    tracker.finish()
+
+        convertAndSort.delete_empty_directories(self.import_folder, expand_directories(
+            self.import_folder, {os.path.dirname(operation.source) for operation in self.operations}))
+        kinds = {operation.kind for operation in operations}
+        return {kind: 'STATUS_ERROR' if self.failed[kind] > 0 else 'STATUS_SUCCESS' for kind in sorted(kinds)}
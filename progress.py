@@ -0,0 +1,234 @@
+"""
+Progress and throughput events of the processing stages.
+
+Each stage owns a ProgressTracker and reports every planned and processed file to it.
+Listeners (UI progress line, periodic CLI/log lines) receive ProgressEvent snapshots,
+at most every EVENT_INTERVAL_S seconds per stage, so that reporting a file stays cheap.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+# Minimum time between two events of a stage
+EVENT_INTERVAL_S = 0.25
+# Duration over which the throughput is computed
+THROUGHPUT_WINDOW_S = 10.0
+
+# Throughput measured by the previous runs, used to estimate the duration of a plan
+THROUGHPUT_FILE_NAME = "throughput.json"
+# Weight of the last run in the stored throughput
+THROUGHPUT_SMOOTHING = 0.5
+# Runs shorter than this are not representative
+MIN_MEASURE_S = 2.0
+
+listeners = []
+listeners_lock = threading.Lock()
+
+
+@dataclass
+class ProgressEvent:
+    stage: str
+    planned: int
+    done: int
+    failed: int
+    bytes_read: int
+    bytes_written: int
+    elapsed_s: float
+    files_per_s: float
+    bytes_per_s: float
+    eta_s: float = None
+    finished: bool = False
+    # Time with files planned and not processed yet: the stage alone, without its waits for files
+    busy_s: float = 0.0
+
+
+class ProgressTracker:
+    def __init__(self, stage):
+        self.stage = stage
+        self.lock = threading.Lock()
+        self.planned = 0
+        self.done = 0
+        self.failed = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        # Started by the first file planned or processed: the trackers are created before their stage starts
+        self.start_time = None
+        self.busy_s = 0.0
+        # Start of the current busy period, None while every planned file is processed
+        self.busy_since = None
+        self.finished = False
+        # (time, processed files, bytes read) samples of the throughput window
+        self.samples = deque()
+        self.last_event_time = 0
+
+    def start_clock(self, now):
+        if self.start_time is None:
+            self.start_time = now
+            self.samples.append((now, 0, 0))
+
+    def end_busy_period(self, now):
+        if self.busy_since is not None:
+            self.busy_s += now - self.busy_since
+            self.busy_since = None
+
+    def plan(self, count=1):
+        """
+        Add files to process.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.start_clock(now)
+            if self.busy_since is None and count > 0:
+                self.busy_since = now
+            self.planned += count
+        self.emit()
+
+    def advance(self, success=True, bytes_read=0, bytes_written=0):
+        """
+        Report a processed file.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.start_clock(now)
+            if success:
+                self.done += 1
+            else:
+                self.failed += 1
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+            if self.done + self.failed >= self.planned:
+                self.end_busy_period(now)
+        self.emit()
+
+    def finish(self):
+        with self.lock:
+            self.end_busy_period(time.monotonic())
+            self.finished = True
+        self.emit(force=True)
+
+    def snapshot(self):
+        with self.lock:
+            now = time.monotonic()
+            processed = self.done + self.failed
+            busy_s = self.busy_s + (now - self.busy_since if self.busy_since is not None else 0.0)
+            if self.start_time is None:
+                return ProgressEvent(self.stage, self.planned, 0, 0, 0, 0, 0.0, 0.0, 0.0, None, self.finished)
+            if now - self.samples[-1][0] >= EVENT_INTERVAL_S:
+                self.samples.append((now, processed, self.bytes_read))
+            while len(self.samples) > 2 and now - self.samples[1][0] > THROUGHPUT_WINDOW_S:
+                self.samples.popleft()
+            window_start, window_processed, window_bytes = self.samples[0]
+            window_s = now - window_start
+            files_per_s = (processed - window_processed) / window_s if window_s > 0 else 0.0
+            bytes_per_s = (self.bytes_read - window_bytes) / window_s if window_s > 0 else 0.0
+            remaining = max(0, self.planned - processed)
+            eta_s = remaining / files_per_s if files_per_s > 0 else None
+            return ProgressEvent(self.stage, self.planned, self.done, self.failed, self.bytes_read,
+                                 self.bytes_written, now - self.start_time, files_per_s, bytes_per_s, eta_s,
+                                 self.finished, busy_s)
+
+    def emit(self, force=False):
+        now = time.monotonic()
+        # Unlocked check: at worst an event is sent twice, never a lock per file for nothing
+        if not force and now - self.last_event_time < EVENT_INTERVAL_S:
+            return
+        self.last_event_time = now
+        event = self.snapshot()
+        with listeners_lock:
+            current_listeners = list(listeners)
+        for listener in current_listeners:
+            listener(event)
+
+
+def add_listener(listener):
+    """
+    Call listener(ProgressEvent) on the progress of every stage. It is called from the worker threads.
+    """
+    with listeners_lock:
+        listeners.append(listener)
+
+
+def remove_listener(listener):
+    with listeners_lock:
+        if listener in listeners:
+            listeners.remove(listener)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def format_event(event):
+    failed = f", {event.failed} failed" if event.failed else ""
+    state = "done in " + format_duration(event.elapsed_s) if event.finished else "ETA " + format_duration(event.eta_s)
+    return (f"{event.stage}: {event.done + event.failed}/{event.planned}{failed}, "
+            f"{event.files_per_s:.1f} files/s, {event.bytes_per_s / 1e6:.1f} MB/s, {state}")
+
+
+class PeriodicPrinter:
+    """
+    Listener printing one line per stage every interval_s seconds, and when the stage ends.
+    """
+    def __init__(self, print_function, interval_s=5.0):
+        self.print_function = print_function
+        self.interval_s = interval_s
+        self.last_print_time = {}
+
+    def __call__(self, event):
+        now = time.monotonic()
+        if event.finished or now - self.last_print_time.get(event.stage, 0) >= self.interval_s:
+            self.last_print_time[event.stage] = now
+            self.print_function(format_event(event))
+
+
+def load_throughput(metadata_folder):
+    """
+    Throughput measured by the previous runs.
+
+    Returns:
+    dict: stage -> {'bytes_per_s', 'files_per_s', 'write_ratio'}, empty if nothing was measured.
+    """
+    try:
+        with open(os.path.join(metadata_folder, THROUGHPUT_FILE_NAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_throughput(metadata_folder, events):
+    """
+    Blend the average throughput of the stages of a run into the stored throughput.
+    The stages run at the same time: the throughput of each one is measured over its busy time only.
+
+    Args:
+    metadata_folder (str): Folder of the throughput file.
+    events (list): Last ProgressEvent of each stage.
+    """
+    throughput = load_throughput(metadata_folder)
+    for event in events:
+        processed = event.done + event.failed
+        if event.busy_s < MIN_MEASURE_S or processed == 0:
+            continue
+        measured = {
+            'bytes_per_s': event.bytes_read / event.busy_s,
+            'files_per_s': processed / event.busy_s,
+            'write_ratio': event.bytes_written / event.bytes_read if event.bytes_read > 0 else 0.0,
+        }
+        previous = throughput.get(event.stage)
+        if previous is not None:
+            measured = {key: THROUGHPUT_SMOOTHING * value + (1 - THROUGHPUT_SMOOTHING) * previous.get(key, value)
+                        for key, value in measured.items()}
+        throughput[event.stage] = measured
+    temp_path = os.path.join(metadata_folder, THROUGHPUT_FILE_NAME + '.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(throughput, f, indent=2)
+    os.replace(temp_path, os.path.join(metadata_folder, THROUGHPUT_FILE_NAME))
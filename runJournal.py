@@ -0,0 +1,165 @@
+"""
+Write-ahead journal of the operations of a run, to continue an interrupted run.
+
+Every conversion or move which can be interrupted half-way is recorded in a SQLite database
+of the .metadata folder before it starts, and each step is recorded as soon as it is done:
+    planned -> renaming -> placed -> (source deleted, operation removed)
+On the next run, recover() rolls the unfinished operations forward when their output is complete,
+and back otherwise: the output is deleted and the source, still in place, is processed again.
+
+Renames in the same folder and file system (sort of the photos) are atomic and need no journal.
+"""
+
+import glob
+import os
+from datetime import datetime
+from infoBoxMgmt import print_message, print_message_d
+from metadataDatabase import MetadataDatabase
+
+JOURNAL_FILE_NAME = "run_journal.sqlite3"
+
+# Kinds of operations
+OPERATION_HEIC = 'heic'     # HEIC converted to a temporary JPG, then renamed in its year folder
+OPERATION_VIDEO = 'video'   # MOV converted to its reserved MP4 name
+OPERATION_MOVE = 'move'     # File moved, maybe copied then deleted, to its reserved name
+
+# States of an operation
+STATE_PLANNED = 'planned'       # Started, the output may be incomplete
+STATE_RENAMING = 'renaming'     # Temporary output complete, being renamed to its final name
+STATE_PLACED = 'placed'         # Final output complete, the source may still exist
+
+
+class RunJournal(MetadataDatabase):
+    file_name = JOURNAL_FILE_NAME
+    schema = ["CREATE TABLE IF NOT EXISTS operations (id INTEGER PRIMARY KEY, kind TEXT, source TEXT, temp TEXT, "
+              "destination TEXT, state TEXT, run TEXT)"]
+    # Every state can be recovered: losing the last transactions on power loss is harmless
+    synchronous = 'NORMAL'
+
+    def __init__(self, metadata_folder):
+        super().__init__(metadata_folder)
+        self.run = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+
+    def begin(self, kind, source, destination=None, temp=None):
+        """
+        Record an operation before it starts.
+
+        Args:
+        kind (str): OPERATION_HEIC, OPERATION_VIDEO or OPERATION_MOVE.
+        source (str): File deleted when the operation ends.
+        destination (str): Output file, or destination folder while the output name is unknown.
+        temp (str): Temporary output file, or its name while its folder is unknown.
+
+        Returns:
+        int: Identifier of the operation.
+        """
+        with self.lock, self.connection:
+            cursor = self.connection.execute("INSERT INTO operations (kind, source, temp, destination, state, run) "
+                                             "VALUES (?, ?, ?, ?, ?, ?)",
+                                             (kind, source, temp, destination, STATE_PLANNED, self.run))
+            return cursor.lastrowid
+
+    def update(self, operation_id, state, temp=None, destination=None):
+        """
+        Record a step of an operation. temp and destination are kept when None.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE operations SET state = ?, temp = COALESCE(?, temp), "
+                                    "destination = COALESCE(?, destination) WHERE id = ?",
+                                    (state, temp, destination, operation_id))
+
+    def finish(self, operation_id):
+        """
+        Forget an operation which ended, successfully or not.
+        """
+        if operation_id is None:
+            return
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM operations WHERE id = ?", (operation_id,))
+
+    def get_unfinished(self):
+        """
+        Returns:
+        list: (id, kind, source, temp, destination, state) of the operations of the previous runs.
+        """
+        with self.lock:
+            return self.connection.execute("SELECT id, kind, source, temp, destination, state FROM operations "
+                                           "WHERE run != ? ORDER BY id", (self.run,)).fetchall()
+
+
+def remove_if_exists(file_path):
+    if file_path and os.path.isfile(file_path):
+        os.remove(file_path)
+
+
+def recover_operation(kind, source, temp, destination, state, name_index):
+    """
+    Roll an unfinished operation forward or back.
+
+    Returns:
+    bool: True if it was rolled forward, False if its source will be processed again.
+    """
+    if state == STATE_PLANNED:
+        if kind == OPERATION_HEIC and temp and not os.path.dirname(temp):
+            # The year folder of the temporary JPG was unknown: temp is its name and destination the sorted folder
+            for partial_path in glob.glob(os.path.join(glob.escape(destination), '*', glob.escape(temp))):
+                os.remove(partial_path)
+            return False
+        # Temporary output written to a known folder
+        remove_if_exists(temp)
+        if os.path.exists(source):
+            # Interrupted conversion or copy: the output is incomplete
+            remove_if_exists(destination)
+            if destination:
+                name_index.release(destination)
+            return False
+        # Renamed by os.rename, which is atomic: the move is complete
+        return True
+
+    if state == STATE_RENAMING:
+        if os.path.exists(temp):
+            if os.path.exists(destination):
+                # The name reserved by the interrupted run was taken since
+                destination = name_index.reserve(os.path.dirname(destination), os.path.basename(destination))
+            os.rename(temp, destination)
+        elif not os.path.exists(destination):
+            return False
+    remove_if_exists(source)
+    return True
+
+
+def recover(journal, name_index):
+    """
+    Roll forward or back the operations left unfinished by interrupted runs.
+
+    Args:
+    journal (RunJournal): Journal of the runs.
+    name_index (DestinationNameIndex): Names used in the destination, shared by the run.
+
+    Returns:
+    tuple: Number of operations rolled forward and rolled back.
+    """
+    rolled_forward = 0
+    rolled_back = 0
+    for operation_id, kind, source, temp, destination, state in journal.get_unfinished():
+        try:
+            if recover_operation(kind, source, temp, destination, state, name_index):
+                rolled_forward += 1
+            else:
+                rolled_back += 1
+            print_message_d(f"Recovered {kind} of {source} ({state})")
+        except OSError as e:
+            # Kept in the journal, to be tried again by the next run
+            print_message(f"Error recovering {kind} of {source}: {e}")
+            continue
+        journal.finish(operation_id)
+    if rolled_forward + rolled_back > 0:
+        print_message(f"Interrupted run recovered: {rolled_forward} files completed, "
+                      f"{rolled_back} files to process again")
+    return rolled_forward, rolled_back
+
+
+# Opens the journal of a metadata folder
+def open_run_journal(metadata_folder):
+    os.makedirs(metadata_folder, exist_ok=True)
+    return RunJournal(metadata_folder)
@@ -0,0 +1,94 @@
+"""
+Persistent cache of the metadata read from the files of the import folder.
+
+Capture dates and ffprobe results are stored in a SQLite database of the .metadata folder,
+with the size and modification time of the file they were read from. A file left in the import
+folder by a previous run is then answered from the cache with a single stat call, without opening it.
+Entries of files which are no longer in the import folder are evicted when it is scanned.
+
+The media kind is not cached: it is derived from the extension, which costs less than a lookup.
+"""
+
+import json
+import os
+from metadataDatabase import MetadataDatabase
+
+CACHE_FILE_NAME = "scan_cache.sqlite3"
+
+# Cached values
+FIELD_CAPTURE_DATE = 'capture_date'
+FIELD_PROBE = 'probe'
+FIELDS = [FIELD_CAPTURE_DATE, FIELD_PROBE]
+
+
+class ScanCache(MetadataDatabase):
+    file_name = CACHE_FILE_NAME
+    # Values are stored as JSON: NULL means not read yet, 'null' means read and absent
+    schema = ["CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+              "capture_date TEXT, probe TEXT) WITHOUT ROWID"]
+    # A lost entry is only read again from its file
+    synchronous = 'NORMAL'
+
+    def __init__(self, metadata_folder):
+        super().__init__(metadata_folder)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, file_path, field, compute, file_stat=None):
+        """
+        Value of a field for the current version of a file, computed and stored on a miss.
+
+        Args:
+        file_path (str): Path of the file.
+        field (str): FIELD_CAPTURE_DATE or FIELD_PROBE.
+        compute (function): compute(file_path) reads the value from the file. Exceptions are not cached.
+        file_stat (os.stat_result): Stat of the file, if already known.
+
+        Returns:
+        Value of the field, as returned by compute (tuples are returned as lists).
+        """
+        if field not in FIELDS:
+            raise ValueError(f"Unknown scan cache field {field}")
+        if file_stat is None:
+            file_stat = os.stat(file_path)
+        signature = (file_stat.st_size, file_stat.st_mtime_ns)
+        with self.lock:
+            row = self.connection.execute(f"SELECT size, mtime_ns, {field} FROM files WHERE path = ?",
+                                          (file_path,)).fetchone()
+        if row is not None and row[:2] == signature and row[2] is not None:
+            self.hits += 1
+            return json.loads(row[2])
+
+        self.misses += 1
+        value = compute(file_path)
+        with self.lock, self.connection:
+            if row is not None and row[:2] == signature:
+                self.connection.execute(f"UPDATE files SET {field} = ? WHERE path = ?", (json.dumps(value), file_path))
+            else:
+                # New or modified file: the other values are read again when needed
+                self.connection.execute(f"INSERT OR REPLACE INTO files (path, size, mtime_ns, {field}) "
+                                        "VALUES (?, ?, ?, ?)", (file_path, *signature, json.dumps(value)))
+        return value
+
+    def evict_missing(self, existing_paths):
+        """
+        Remove the entries of the files which are not in existing_paths.
+
+        Returns:
+        int: Number of evicted entries.
+        """
+        existing_paths = set(existing_paths)
+        with self.lock, self.connection:
+            cached_paths = [row[0] for row in self.connection.execute("SELECT path FROM files")]
+            vanished = [(path,) for path in cached_paths if path not in existing_paths]
+            self.connection.executemany("DELETE FROM files WHERE path = ?", vanished)
+        return len(vanished)
+
+    def __len__(self):
+        return self.count("files")
+
+
+# Opens the scan cache of a metadata folder
+def open_scan_cache(metadata_folder):
+    os.makedirs(metadata_folder, exist_ok=True)
+    return ScanCache(metadata_folder)
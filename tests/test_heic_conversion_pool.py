@@ -0,0 +1,42 @@
+import threading
+import time
+
+from convertAndSort import ConversionResult, HeicConversionPool
+from memoryBudget import MemoryBudget
+
+
+def slow_conversion(heic_path):
+    time.sleep(0.5)
+    return ConversionResult(heic_path, heic_path + '.jpg', True)
+
+
+def interrupted_conversion(heic_path):
+    raise KeyboardInterrupt
+
+
+def run_pool(pool, function, count):
+    results = []
+    tasks = ((f'IMG_{i:04}.HEIC', None) for i in range(count))
+    thread = threading.Thread(target=pool.run, args=(tasks, lambda heic_path, _: (function, (heic_path,), None),
+                                                     lambda heic_path, data, context, result: results.append(result)))
+    thread.start()
+    return thread, results
+
+
+def test_cancel_returns_without_converting_every_file():
+    pool = HeicConversionPool(2, MemoryBudget(0))
+    thread, results = run_pool(pool, slow_conversion, 100)
+    time.sleep(1)
+    pool.cancel()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert 0 < sum(result.success for result in results) < 100
+
+
+def test_interrupted_workers_end_their_conversions():
+    pool = HeicConversionPool(2, MemoryBudget(0))
+    thread, results = run_pool(pool, interrupted_conversion, 10)
+    thread.join(10)
+    assert not thread.is_alive()
+    assert len(results) == 10
+    assert not any(result.success for result in results)
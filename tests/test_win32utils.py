@@ -0,0 +1,56 @@
+import pytest
+
+import win32utils
+
+ROOT = 'This PC\\Apple iPhone\\Internal Storage'
+
+
+class FakeShellItem:
+    def __init__(self, absolute_name):
+        self.absolute_name = absolute_name
+
+    def GetDisplayName(self, sigdn):
+        return self.absolute_name
+
+
+class FakeShellFolder:
+    def __init__(self, absolute_name, files=(), folders=()):
+        self.absolute_name = absolute_name
+        # In-folder editing names hide the extensions, unlike the absolute names
+        self.files = list(files)
+        self.folders = {name: FakeShellFolder(absolute_name + '\\' + name, *content)
+                        for name, content in folders}
+
+    def EnumObjects(self, hwnd, flags):
+        if flags == win32utils.SHCONTF_FOLDERS:
+            return list(self.folders)
+        return list(self.files)
+
+    def GetDisplayNameOf(self, pidl, flags):
+        return pidl.rsplit('.', 1)[0]
+
+    def BindToObject(self, pidl, bind_context, interface):
+        return self.folders[pidl]
+
+
+def list_fake_dcim(shell_folder):
+    return [(relative_path, shell_item.absolute_name) for relative_path, shell_item in win32utils.iter_dcim(
+        shell_folder, ROOT, create_shell_item=lambda folder, parent, pidl: FakeShellItem(folder + '\\' + pidl),
+        get_id_list=lambda folder: folder.absolute_name, get_name=lambda shell_item: shell_item.absolute_name)]
+
+
+def test_relative_paths_are_the_absolute_names_without_the_folder():
+    dcim = FakeShellFolder(ROOT, ['IMG_0001.HEIC'], [('202302_a', (['IMG_0003.MOV'],)),
+                                                     ('202301_a', (['IMG_0002.JPG', 'IMG_0002.AAE'],))])
+    assert list_fake_dcim(dcim) == [
+        ('IMG_0001.HEIC', ROOT + '\\IMG_0001.HEIC'),
+        ('202301_a\\IMG_0002.JPG', ROOT + '\\202301_a\\IMG_0002.JPG'),
+        ('202301_a\\IMG_0002.AAE', ROOT + '\\202301_a\\IMG_0002.AAE'),
+        ('202302_a\\IMG_0003.MOV', ROOT + '\\202302_a\\IMG_0003.MOV'),
+    ]
+
+
+def test_file_outside_the_folder_is_an_error():
+    dcim = FakeShellFolder('This PC\\Other', ['IMG_0001.HEIC'])
+    with pytest.raises(Exception):
+        list_fake_dcim(dcim)
@@ -0,0 +1,160 @@
+"""
+Single pass scan of the import folder.
+
+The tree is read once with os.scandir, which gives the type of each entry without a stat call
+on Windows, and its files are classified by kind in a Manifest shared by all the stages.
+The directories are listed deepest first, so that the empty ones can be deleted at the end
+of the run without listing them again.
+"""
+
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+PHOTO_EXTENSIONS = ['.jpg', '.jpeg', '.png']
+
+# Suffix of the JPG files being written, before they get their final name
+PARTIAL_SUFFIX = '.partial.jpg'
+# Suffix of the files being copied from the phone
+PARTIAL_COPY_SUFFIX = '.partial.copy'
+# Temporary files are named '.<random hex><suffix>': a file of the user is never taken for one
+PARTIAL_NAME_PATTERN = re.compile(r'\.[0-9a-f]{32}(%s|%s)' % (re.escape(PARTIAL_SUFFIX), re.escape(PARTIAL_COPY_SUFFIX)))
+
+# Kinds of files
+KIND_HEIC = 'heic'
+KIND_PHOTO = 'photo'
+KIND_VIDEO = 'video'
+KIND_OTHER = 'other'
+KIND_PARTIAL = 'partial'    # Incomplete conversion or copy of an interrupted run
+KINDS = [KIND_HEIC, KIND_PHOTO, KIND_VIDEO, KIND_OTHER, KIND_PARTIAL]
+
+# Folders never scanned
+SKIPPED_FOLDERS = ['.metadata']
+
+
+def new_partial_name(suffix=PARTIAL_SUFFIX):
+    """
+    Returns:
+    str: Unique name of a temporary file, recognized by is_partial_file.
+    """
+    return f".{uuid.uuid4().hex}{suffix}"
+
+
+def is_partial_file(file_path):
+    return PARTIAL_NAME_PATTERN.fullmatch(os.path.basename(file_path)) is not None
+
+
+def get_media_kind(file_path):
+    """
+    Classify a file by its extension.
+
+    Returns:
+    str: 'heic', 'photo', 'video', 'other' or 'partial'.
+    """
+    if is_partial_file(file_path):
+        return KIND_PARTIAL
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.heic':
+        return KIND_HEIC
+    if extension in PHOTO_EXTENSIONS:
+        return KIND_PHOTO
+    if extension == '.mov':
+        return KIND_VIDEO
+    return KIND_OTHER
+
+
+class Manifest:
+    def __init__(self, root):
+        self.root = root
+        # kind -> list of file paths
+        self.files = {kind: [] for kind in KINDS}
+        # Sub-directories of root, deepest first
+        self.directories = []
+
+    def add_file(self, file_path):
+        self.files[get_media_kind(file_path)].append(file_path)
+
+    def sort_directories(self):
+        self.directories.sort(key=lambda directory: directory.count(os.sep), reverse=True)
+
+    def get_files(self, *kinds):
+        return [file_path for kind in kinds for file_path in self.files[kind]]
+
+    def get_all_files(self):
+        return self.get_files(*KINDS)
+
+    def merge(self, other):
+        for kind in KINDS:
+            self.files[kind].extend(other.files[kind])
+        self.directories.extend(other.directories)
+
+    def __len__(self):
+        return sum(len(files) for files in self.files.values())
+
+
+def scan_directory(directory, manifest):
+    # Iterative: no recursion limit on deep trees
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIPPED_FOLDERS:
+                        manifest.directories.append(entry.path)
+                        pending.append(entry.path)
+                else:
+                    manifest.add_file(entry.path)
+
+
+def scan_tree(root, max_workers=1):
+    """
+    Scan a directory tree once and classify its files.
+
+    Args:
+    root (str): Root of the tree, usually the import folder.
+    max_workers (int): Number of threads scanning the top-level sub-directories at once,
+                       useful on network and USB drives where each directory read waits for the device.
+
+    Returns:
+    Manifest: Files by kind and directories of the tree.
+    """
+    manifest = Manifest(root)
+    if not os.path.isdir(root):
+        return manifest
+    subdirectories = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIPPED_FOLDERS:
+                    subdirectories.append(entry.path)
+            else:
+                manifest.add_file(entry.path)
+
+    sub_manifests = [Manifest(directory) for directory in subdirectories]
+    if max_workers is not None and max_workers > 1 and len(subdirectories) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(scan_directory, subdirectories, sub_manifests))
+    else:
+        for directory, sub_manifest in zip(subdirectories, sub_manifests):
+            scan_directory(directory, sub_manifest)
+    manifest.directories.extend(subdirectories)
+    for sub_manifest in sub_manifests:
+        manifest.merge(sub_manifest)
+    manifest.sort_directories()
+    return manifest
+
+
+def expand_directories(root, directories):
+    """
+    Directories and their parents under root, root excluded, deepest first.
+    """
+    root = os.path.normpath(root)
+    expanded = set()
+    for directory in directories:
+        directory = os.path.normpath(directory)
+        while directory.startswith(root + os.sep) and directory not in expanded:
+            expanded.add(directory)
+            directory = os.path.dirname(directory)
+    return sorted(expanded, key=lambda directory: directory.count(os.sep), reverse=True)
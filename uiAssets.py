@@ -0,0 +1,113 @@
+"""
+Pre-rendered images of the user interface.
+
+The button and help images are resized (and converted to grayscale for inactive buttons) once,
+and saved as PNG files that Tk loads directly, without Pillow:
+- at build time, in Images/rendered, by running this file before PyInstaller (see generateExe.bat),
+- otherwise on first run, in the user cache folder.
+"""
+
+import os
+import sys
+
+RENDERED_FOLDER_NAME = 'rendered'
+
+# Rendered assets: name -> (source image, (width, height), grayscale, keep aspect ratio)
+ASSETS = {
+    'import': ('imageImport.jpg', (100, 100), False, False),
+    'import_gray': ('imageImport.jpg', (100, 100), True, False),
+    'heic': ('HeicToJpg.jpg', (100, 100), False, False),
+    'heic_gray': ('HeicToJpg.jpg', (100, 100), True, False),
+    'mov': ('MovToMp4.jpg', (100, 100), False, False),
+    'mov_gray': ('MovToMp4.jpg', (100, 100), True, False),
+    'sort': ('SortPhotos.jpg', (100, 100), False, False),
+    'sort_gray': ('SortPhotos.jpg', (100, 100), True, False),
+    'go': ('Gooo.jpg', (220, 100), False, False),
+    'delete': ('DeleteHistory.jpg', (50, 50), False, False),
+    # Help window thumbnails
+    'help_go': ('Gooo.jpg', (200, 100), False, True),
+    'help_import': ('imageImport.jpg', (100, 100), False, True),
+    'help_heic': ('HeicToJpg.jpg', (100, 100), False, True),
+    'help_mov': ('MovToMp4.jpg', (100, 100), False, True),
+    'help_sort': ('SortPhotos.jpg', (100, 100), False, True),
+    'help_delete': ('DeleteHistory.jpg', (50, 50), False, True),
+}
+
+
+def get_user_cache_folder():
+    if sys.platform == 'win32':
+        base = os.getenv('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.getenv('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'iGetMyPhotosAndVideos', RENDERED_FOLDER_NAME)
+
+
+def get_rendered_file_name(images_folder, name):
+    """
+    Name of the rendered file of an asset.
+    It contains the size of the source image, so that a modified image is rendered again.
+    The modification time is not used: PyInstaller resets it each time the executable is extracted.
+    """
+    source, _, _, _ = ASSETS[name]
+    source_size = os.path.getsize(os.path.join(images_folder, source))
+    return f"{name}_{source_size}.png"
+
+
+def render_asset(images_folder, name, output_path):
+    from PIL import Image
+    source, size, gray, keep_ratio = ASSETS[name]
+    with Image.open(os.path.join(images_folder, source)) as image:
+        if gray:
+            image = image.convert("L")
+        if keep_ratio:
+            image.thumbnail(size)
+        else:
+            image = image.resize(size, Image.LANCZOS)
+        # Write to a temporary file first: another instance may read the cache at the same time
+        temp_path = output_path + '.tmp'
+        image.save(temp_path, "PNG")
+    os.replace(temp_path, output_path)
+
+
+def render_all(images_folder, output_folder):
+    """
+    Render every asset in output_folder.
+
+    Returns:
+    int: Number of rendered assets.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    for name in ASSETS:
+        render_asset(images_folder, name, os.path.join(output_folder, get_rendered_file_name(images_folder, name)))
+    return len(ASSETS)
+
+
+def get_asset_path(images_folder, name):
+    """
+    Path of a rendered asset, rendering it in the user cache folder if it does not exist yet.
+    """
+    file_name = get_rendered_file_name(images_folder, name)
+    prebuilt_path = os.path.join(images_folder, RENDERED_FOLDER_NAME, file_name)
+    if os.path.exists(prebuilt_path):
+        return prebuilt_path
+    cache_folder = get_user_cache_folder()
+    cached_path = os.path.join(cache_folder, file_name)
+    if not os.path.exists(cached_path):
+        os.makedirs(cache_folder, exist_ok=True)
+        render_asset(images_folder, name, cached_path)
+    return cached_path
+
+
+def load_photo_image(images_folder, name):
+    """
+    Load an asset as a Tk image. Tk reads PNG files itself: Pillow is only needed to render missing assets.
+    """
+    import tkinter as tk
+    return tk.PhotoImage(file=get_asset_path(images_folder, name))
+
+
+if __name__ == '__main__':
+    # Build time rendering: python uiAssets.py [Images folder]
+    images_folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Images')
+    output_folder = os.path.join(images_folder, RENDERED_FOLDER_NAME)
+    print(f"Rendered {render_all(images_folder, output_folder)} assets in {output_folder}")
@@ -4,10 +4,20 @@ From https://github.com/adam-nemeth/iPhoneImport
 
 from dataclasses import dataclass
 
-import pythoncom
-from win32comext.shell import shell, shellcon
+try:
+    import pythoncom
+    from win32comext.propsys import pscon
+    from win32comext.shell import shell, shellcon
+except ImportError:
+    # Not on Windows: only iter_dcim can be used, with shell folder objects given by the caller
+    pythoncom = pscon = shell = shellcon = None
 from infoBoxMgmt import print_message, print_message_d
 
+# Flags of IShellFolder.EnumObjects and GetDisplayNameOf, defined here to be usable without pywin32
+SHCONTF_FOLDERS = 0x20
+SHCONTF_NONFOLDERS = 0x40
+SHGDN_FORADDRESSBAR = 0x4000
+
 @dataclass
 class CopyParams:
     sourcefile_shell_item: object
@@ -47,23 +57,42 @@ def get_shell_item_from_path(path):
         raise Exception(f"Cannot get shell item for {path}") from exception
 
 
-# returns a dictionary of (file name -> shell item) of files in shell folder
-def walk_dcim(shell_folder):
-    result = {}
-
-    for folder_pidl in shell_folder.EnumObjects(0, shellcon.SHCONTF_FOLDERS):
-        child_shell_folder = shell_folder.BindToObject(folder_pidl, None, shell.IID_IShellFolder)
-        name = shell_folder.GetDisplayNameOf(folder_pidl, shellcon.SHGDN_FORADDRESSBAR)
-        print_message_d(f"Listing folder '{name}'")
-        result |= walk_dcim(child_shell_folder)
-
-    for file_pidl in shell_folder.EnumObjects(0, shellcon.SHCONTF_NONFOLDERS):
-        sourcefolder_pidl = shell.SHGetIDListFromObject(shell_folder)
-        sourcefile_shell_item = shell.SHCreateShellItem(sourcefolder_pidl, None, file_pidl)
-        sourcefile_name = get_absolute_name(sourcefile_shell_item)
-        result[sourcefile_name] = sourcefile_shell_item
-
-    return result
+# yields (relative path, shell item) of the files of a shell folder and its sub-folders, as they are listed
+# relative paths are the absolute names of the files without the absolute name of the shell folder,
+# e.g. "202301_a\IMG_1694.HEIC": they are the keys of the import ledger
+# create_shell_item(folder_id_list, parent, child_pidl), get_id_list(shell_folder) and get_name(shell_item)
+# default to the shell functions, and can be replaced to list fake shell folders
+def iter_dcim(shell_folder, absolute_display_name, create_shell_item=None, get_id_list=None, get_name=None):
+    if create_shell_item is None:
+        create_shell_item = shell.SHCreateShellItem
+    if get_id_list is None:
+        get_id_list = shell.SHGetIDListFromObject
+    if get_name is None:
+        get_name = get_absolute_name
+    folder_interface = shell.IID_IShellFolder if shell is not None else None
+    prefix = absolute_display_name + '\\'
+
+    # Iterative: no recursion limit, and no merge of the results of the sub-folders
+    pending = [(shell_folder, absolute_display_name)]
+    while pending:
+        current_folder, folder_name = pending.pop()
+        print_message_d(f"Listing folder '{folder_name}'")
+        # ID list of the folder, read once for all its files
+        folder_id_list = None
+        for file_pidl in current_folder.EnumObjects(0, SHCONTF_NONFOLDERS):
+            if folder_id_list is None:
+                folder_id_list = get_id_list(current_folder)
+            shell_item = create_shell_item(folder_id_list, None, file_pidl)
+            absolute_name = get_name(shell_item)
+            if not absolute_name.startswith(prefix):
+                raise Exception(f"'{absolute_name}' should start with '{prefix}'")
+            yield absolute_name[len(prefix):], shell_item
+
+        child_folders = [(current_folder.GetDisplayNameOf(folder_pidl, SHGDN_FORADDRESSBAR), folder_pidl)
+                         for folder_pidl in current_folder.EnumObjects(0, SHCONTF_FOLDERS)]
+        # Listed in name order: pushed in reverse order
+        for name, folder_pidl in sorted(child_folders, key=lambda child: child[0], reverse=True):
+            pending.append((current_folder.BindToObject(folder_pidl, None, folder_interface), name))
 
 
 def copy_single_file(sourcefile_shell_item, destination_folder_shell_item, target_filename):
@@ -84,12 +113,9 @@ def copy_multiple_files(copy_params_list: list[CopyParams]):
                                                      pythoncom.CLSCTX_ALL,
                                                      shell.IID_IFileOperation)
     for copy_params in copy_params_list:
-        src_str = get_absolute_name(copy_params.sourcefile_shell_item)
-        dst_str = get_absolute_name(copy_params.destinationFolder_shell_item)
-        # print(f"Queuing copying '{src_str}' to '{dst_str}'")
         fileOperationObject.CopyItem(copy_params.sourcefile_shell_item, copy_params.destinationFolder_shell_item,
                                      copy_params.target_filename)
-    print_message(f"Running copy operations...")
+    print_message_d(f"Running {len(copy_params_list)} copy operations...")
     try:
         fileOperationObject.PerformOperations()
     except BaseException as exception:
@@ -98,6 +124,55 @@ def copy_multiple_files(copy_params_list: list[CopyParams]):
 
 
 
+# returns the (size in bytes, modification time in seconds) of a shell item, None when unknown
+def get_size_and_mtime(shell_item):
+    try:
+        shell_item2 = shell_item.QueryInterface(shell.IID_IShellItem2)
+    except BaseException:
+        return None, None
+    try:
+        size = shell_item2.GetUInt64(pscon.PKEY_Size)
+    except BaseException:
+        size = None
+    try:
+        mtime = shell_item2.GetFileTime(pscon.PKEY_DateModified).timestamp()
+    except BaseException:
+        mtime = None
+    return size, mtime
+
+
+class ShellItemReader:
+    """
+    Binary file object reading the content of a shell item through its IStream.
+    """
+
+    def __init__(self, shell_item):
+        self.stream = shell_item.BindToHandler(None, shell.BHID_Stream, pythoncom.IID_IStream)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.stream.Read(1024 * 1024)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        return self.stream.Read(size)
+
+    def close(self):
+        self.stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_shell_item(shell_item):
+    return ShellItemReader(shell_item)
+
+
 def get_absolute_name(shell_item):
     return shell_item.GetDisplayName(shellcon.SIGDN_DESKTOPABSOLUTEEDITING)
 